@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+
+"""
+Benchmark suite for StructureMatcher. Records the wall time and the peak
+memory of fit, get_rms_dist, fit_anonymous and group_structures as a
+function of the number of sites, the skewness of the lattice, the number of
+species, the tolerances and the number of structures, and writes a JSON
+report. A previous report can be given with --compare to flag regressions.
+
+Usage:
+    ./benchmark_structure_matcher.py -o report.json
+    ./benchmark_structure_matcher.py --quick --compare report.json
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import json
+import multiprocessing as mp
+import platform
+import resource
+import sys
+import time
+
+import numpy as np
+
+from pymatgen.core.lattice import Lattice
+from pymatgen.core.structure import Structure
+from pymatgen.core.structure_modifier import SupercellMaker
+from pymatgen.analysis.structure_matcher import StructureMatcher
+
+
+ELEMENTS = ["Li", "O", "Fe", "P", "Mn", "Co", "Ni", "Na", "S", "Si"]
+
+#Substitution used for fit_anonymous, which maps every element to a
+#different one.
+ANONYMOUS_MAP = dict(zip(ELEMENTS, ["K", "F", "Ti", "As", "V", "Cr", "Cu",
+                                    "Rb", "Se", "Ge"]))
+
+#Default parameters, which are varied one at a time in the scaling curves.
+DEFAULTS = {"nsites": 16, "angle": 90, "nspecies": 2, "ltol": 0.2,
+            "stol": 0.3}
+
+FULL = {"nsites": [4, 16, 64, 256],
+        "angle": [90, 75, 60, 45],
+        "nspecies": [1, 2, 4, 8],
+        "ltol": [0.1, 0.2, 0.3],
+        "stol": [0.1, 0.3, 0.5],
+        "nstructures": [10, 100, 1000]}
+
+QUICK = {"nsites": [4, 16, 64],
+         "angle": [90, 60],
+         "nspecies": [1, 4],
+         "ltol": [0.2],
+         "stol": [0.3],
+         "nstructures": [10, 100]}
+
+
+def random_structure(nsites, angle, nspecies, rng, lengths=None):
+    """
+    Returns a random structure with nsites sites of nspecies elements, in a
+    lattice with the given relative lengths (random by default), all angles
+    equal to angle and 10 A^3 per site.
+    """
+    a, b, c = 1 + rng.rand(3) / 2 if lengths is None else lengths
+    lattice = Lattice.from_parameters(a, b, c, angle, angle, angle)
+    lattice = Lattice(lattice.matrix * (10 * nsites / lattice.volume) **
+                      (1 / 3))
+    species = [ELEMENTS[i % nspecies] for i in range(nsites)]
+    return Structure(lattice, species, rng.rand(nsites, 3))
+
+
+def perturbed_copy(structure, rng, displacement=0.05):
+    """
+    Returns a copy of the structure in a different unit cell of the same
+    lattice, translated and with all sites randomly displaced by up to
+    displacement A, which should match the original structure.
+    """
+    s = SupercellMaker(structure, [[1, 1, 0], [0, 1, 0], [0, 0, 1]])
+    s = s.modified_structure
+    disp = (rng.rand(len(s), 3) - 0.5) * 2 * displacement / 3 ** 0.5
+    coords = s.cart_coords + disp + np.dot(rng.rand(3), s.lattice.matrix)
+    return Structure(s.lattice, s.species, coords, to_unit_cell=True,
+                     coords_are_cartesian=True)
+
+
+def relabeled(structure):
+    """
+    Returns the structure with the elements replaced by ANONYMOUS_MAP.
+    """
+    return Structure(structure.lattice,
+                     [ANONYMOUS_MAP[sp.symbol] for sp in structure.species],
+                     structure.frac_coords)
+
+
+def bench_pair(method, params, rng):
+    """
+    Sets up a pair of matching structures and returns a function calling
+    method on them.
+    """
+    s1 = random_structure(params["nsites"], params["angle"],
+                          params["nspecies"], rng)
+    s2 = perturbed_copy(s1, rng)
+    if method == "fit_anonymous":
+        s2 = relabeled(s2)
+    sm = StructureMatcher(ltol=params["ltol"], stol=params["stol"])
+    return lambda: getattr(sm, method)(s1, s2)
+
+
+def prototype_shape(i, angle):
+    """
+    Returns the relative lattice lengths and the angle of the i-th
+    prototype. The shapes cycle through 100 lattices whose lengths differ by
+    factors of 1.5 or whose angles differ by 10 degrees, so that prototypes
+    of different shapes are told apart by the lattice invariants, as in a
+    realistic population of structures.
+    """
+    i = i % 100
+    lengths = [1, 1.5 ** (i % 5), 1.5 ** (i % 5 + i // 5 % 5)]
+    return lengths, angle - 10 * (i // 25)
+
+
+def bench_group(params, rng):
+    """
+    Sets up nstructures structures of the same composition, which are
+    perturbed copies of nstructures / 10 distinct prototypes of different
+    lattice shapes, and returns a function grouping them.
+    """
+    nprotos = max(1, params["nstructures"] // 10)
+    protos = []
+    for i in range(nprotos):
+        lengths, angle = prototype_shape(i, params["angle"])
+        protos.append(random_structure(params["nsites"], angle,
+                                       params["nspecies"], rng, lengths))
+    structures = [perturbed_copy(protos[i % nprotos], rng)
+                  for i in range(params["nstructures"])]
+    sm = StructureMatcher(ltol=params["ltol"], stol=params["stol"])
+    return lambda: len(sm.group_structures(structures))
+
+
+def run_case(args):
+    """
+    Runs one benchmark case. Returns the best wall time over the repeats,
+    the peak resident memory of the process in MB and the result of the last
+    call, which is used to check that the benchmark still does the same
+    work.
+    """
+    name, params, repeat, seed = args
+    rng = np.random.RandomState(seed)
+    if name == "group_structures":
+        func = bench_group(params, rng)
+    else:
+        func = bench_pair(name, params, rng)
+    start_mem = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    times = []
+    for i in range(repeat):
+        t = time.time()
+        result = func()
+        times.append(time.time() - t)
+    peak_mem = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #ru_maxrss is in kB on Linux and in bytes on OS X.
+    unit = 1024 ** 2 if sys.platform == "darwin" else 1024
+    #Results are converted to plain Python values for the JSON report.
+    if name == "fit_anonymous":
+        result = result is not None
+    elif isinstance(result, (list, tuple)):
+        result = [round(float(x), 6) for x in result]
+    elif result is not None:
+        result = bool(result) if name == "fit" else int(result)
+    return {"benchmark": name, "params": params, "time": min(times),
+            "peak_memory": peak_mem / unit,
+            "memory_increase": (peak_mem - start_mem) / unit,
+            "result": result}
+
+
+def get_cases(grid, repeat, seed):
+    """
+    Generates the benchmark cases. Every parameter of DEFAULTS is varied in
+    turn for each of the pair benchmarks, and the number of structures is
+    varied for group_structures.
+    """
+    for name in ["fit", "get_rms_dist", "fit_anonymous"]:
+        for key in ["nsites", "angle", "nspecies", "ltol", "stol"]:
+            for value in grid[key]:
+                params = dict(DEFAULTS)
+                params[key] = value
+                yield name, params, repeat, seed
+    for n in grid["nstructures"]:
+        params = dict(DEFAULTS)
+        params["nstructures"] = n
+        yield "group_structures", params, 1, seed
+
+
+def compare_reports(report, baseline, threshold):
+    """
+    Returns the cases of report which are slower than in baseline by more
+    than a factor threshold, or whose result changed.
+    """
+    def key(case):
+        return case["benchmark"], json.dumps(case["params"], sort_keys=True)
+
+    old = dict([(key(c), c) for c in baseline["cases"]])
+    regressions = []
+    for case in report["cases"]:
+        ref = old.get(key(case))
+        if ref is None:
+            continue
+        if case["time"] > threshold * ref["time"] or \
+                case["result"] != ref["result"]:
+            regressions.append({"benchmark": case["benchmark"],
+                                "params": case["params"],
+                                "time": case["time"],
+                                "baseline_time": ref["time"],
+                                "result": case["result"],
+                                "baseline_result": ref["result"]})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="""
+    Benchmarks StructureMatcher and writes a JSON report.""")
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help="file to write the JSON report to. Defaults "
+                             "to stdout.")
+    parser.add_argument("--quick", action="store_true",
+                        help="run a reduced set of cases.")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="number of repeats of the pair benchmarks.")
+    parser.add_argument("-s", "--seed", type=int, default=0,
+                        help="seed of the random structures.")
+    parser.add_argument("-c", "--compare", type=str, default=None,
+                        help="previous JSON report to compare against.")
+    parser.add_argument("-t", "--threshold", type=float, default=1.5,
+                        help="slowdown factor reported as a regression.")
+    args = parser.parse_args()
+
+    grid = QUICK if args.quick else FULL
+    cases = []
+    for case in get_cases(grid, args.repeat, args.seed):
+        #Each case runs in a new process, so that the peak memory is that
+        #of the case alone.
+        pool = mp.Pool(1)
+        try:
+            result = pool.apply(run_case, (case, ))
+        finally:
+            pool.close()
+            pool.join()
+        print("{benchmark} {params}: {time:.4f} s, {peak_memory:.1f} MB"
+              .format(**result), file=sys.stderr)
+        cases.append(result)
+
+    report = {"python": platform.python_version(),
+              "numpy": np.__version__,
+              "platform": platform.platform(),
+              "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+              "cases": cases}
+    status = 0
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        report["regressions"] = compare_reports(report, baseline,
+                                                args.threshold)
+        for r in report["regressions"]:
+            print("REGRESSION {benchmark} {params}: {time:.4f} s vs "
+                  "{baseline_time:.4f} s".format(**r), file=sys.stderr)
+        status = 1 if report["regressions"] else 0
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -180,29 +180,46 @@ class RemoveDuplicatesFilter(AbstractStructureFilter):
         """
         self._symprec = symprec
         self._structure_list = []
+        self._fingerprints = []
         if isinstance(structure_matcher, dict):
             self._sm = StructureMatcher.from_dict(structure_matcher)
         else:
             self._sm = structure_matcher
 
     def test(self, structure):
+        comparator = self._sm._comparator
         if not self._structure_list:
             self._structure_list.append(structure)
+            self._fingerprints.append(None)
             return True
 
         def get_sg(s):
             finder = SymmetryFinder(s, symprec=self._symprec)
             return finder.get_spacegroup_number()
 
-        for s in self._structure_list:
-            if self._sm._comparator.get_structure_hash(structure) ==\
-                    self._sm._comparator.get_structure_hash(s):
-                if self._symprec is None or \
-                        get_sg(s) == get_sg(structure):
-                    if self._sm.fit(s, structure):
-                        return False
+        #Fingerprints are only computed for structures with the same hash,
+        #and if they can discard structures at the matcher tolerances.
+        structure_hash = comparator.get_structure_hash(structure)
+        fingerprint = None
+        for i, s in enumerate(self._structure_list):
+            if structure_hash != comparator.get_structure_hash(s):
+                continue
+            if self._sm._use_fingerprints():
+                if fingerprint is None:
+                    fingerprint = comparator.get_structure_fingerprint(
+                        structure)
+                if self._fingerprints[i] is None:
+                    self._fingerprints[i] = \
+                        comparator.get_structure_fingerprint(s)
+                if not self._sm.fingerprints_may_match(self._fingerprints[i],
+                                                       fingerprint):
+                    continue
+            if self._symprec is None or get_sg(s) == get_sg(structure):
+                if self._sm.fit(s, structure):
+                    return False
 
         self._structure_list.append(structure)
+        self._fingerprints.append(fingerprint)
         return True
 
     @property
@@ -20,6 +20,8 @@ import os
 import operator
 from math import exp, sqrt
 
+import numpy as np
+
 from pymatgen.core.periodic_table import Element, Specie
 from pymatgen.symmetry.finder import SymmetryFinder
 from pymatgen.core.structure_modifier import StructureEditor
@@ -165,26 +167,36 @@ class BVAnalyzer(object):
                 "Structure contains elements not in set of BV parameters!"
             )
 
-        #Perform symmetry determination and get sites grouped by symmetry.
+        #Perform symmetry determination and get the indices of the sites
+        #grouped by symmetry.
         if self.symm_tol:
             finder = SymmetryFinder(structure, self.symm_tol)
-            symm_structure = finder.get_symmetrized_structure()
-            equi_sites = symm_structure.equivalent_sites
+            equivalent = np.array(
+                finder.get_symmetry_dataset()["equivalent_atoms"])
+            equi_indices = [np.where(equivalent == k)[0]
+                            for k in sorted(set(equivalent))]
         else:
-            equi_sites = [[site] for site in structure]
+            equi_indices = [[i] for i in xrange(len(structure))]
 
         #Sort the equivalent sites by decreasing electronegativity.
-        equi_sites = sorted(equi_sites,
-                            key=lambda sites: -sites[0].species_and_occu
-                            .average_electroneg)
+        equi_indices = sorted(equi_indices,
+                              key=lambda inds: -structure[inds[0]]
+                              .species_and_occu.average_electroneg)
+        equi_sites = [[structure[i] for i in inds] for inds in equi_indices]
 
         #Get a list of valences and probabilities for each symmetrically
-        #distinct site.
+        #distinct site. The neighbors of all sites are obtained in one pass.
+        (centers, nn_indices, images, dists) = \
+            structure.get_neighbor_list(self.max_radius)
+        bounds = np.searchsorted(centers, np.arange(len(structure) + 1))
         valences = []
         all_prob = []
-        for sites in equi_sites:
+        for inds, sites in zip(equi_indices, equi_sites):
             test_site = sites[0]
-            nn = structure.get_neighbors(test_site, self.max_radius)
+            i = inds[0]
+            nn = [(structure[j], dist) for j, dist
+                  in zip(nn_indices[bounds[i]:bounds[i + 1]],
+                         dists[bounds[i]:bounds[i + 1]])]
             prob = self._calc_site_probabilities(test_site, nn)
             all_prob.append(prob)
             val = list(prob.keys())
@@ -232,12 +244,11 @@ class BVAnalyzer(object):
 
         if scores:
             best = max(scores.keys(), key=lambda k: scores[k])
-            assigned = {}
-            for val, sites in zip(best, equi_sites):
-                for site in sites:
-                    assigned[site] = val
+            assigned = np.zeros(len(structure), dtype=np.int)
+            for val, inds in zip(best, equi_indices):
+                assigned[inds] = val
 
-            return [int(assigned[site]) for site in structure]
+            return [int(v) for v in assigned]
         else:
             raise ValueError("Valences cannot be assigned!")
 
@@ -17,13 +17,27 @@ __date__ = "Aug 1 2012"
 
 from math import pi, sqrt, log, exp, cos, sin, erfc, factorial
 from datetime import datetime
-from copy import deepcopy, copy
 import bisect
+import heapq
+import itertools
 
 import numpy as np
 
 from pymatgen.core.physical_constants import ELECTRON_CHARGE, EPSILON_0
-from pymatgen.util.coord_utils import get_points_in_sphere_pbc
+from pymatgen.util.coord_utils import get_neighbor_list_pbc, MAX_MEMORY
+
+# Factor by which the cutoffs chosen for a target error reduce the
+# estimated error below the target, since the estimates are statistical.
+_ERROR_SAFETY_FACTOR = 10
+
+# Number of projected gradient steps used by EwaldMinimizer to tighten the
+# lower bound of each node of the search tree.
+_BOUND_STEPS = 20
+
+try:
+    from scipy.special import erfc as _erfc
+except ImportError:
+    _erfc = np.vectorize(erfc, otypes=[np.float])
 
 
 class EwaldSummation(object):
@@ -44,7 +58,7 @@ class EwaldSummation(object):
     CONV_FACT = 1e10 * ELECTRON_CHARGE / (4 * pi * EPSILON_0)
 
     def __init__(self, structure, real_space_cut=None, recip_space_cut=None,
-                 eta=None, acc_factor=8.0):
+                 eta=None, acc_factor=8.0, target_error=None, w=1.0):
         """
         Initializes and calculates the Ewald sum. Default convergence
         parameters have been specified, but you can override them if you wish.
@@ -69,51 +83,127 @@ class EwaldSummation(object):
                 determine automatically.
             acc_factor:
                 No. of significant figures each sum is converged to.
+            target_error:
+                Target error of the total energy in eV. Defaults to None,
+                which means that the cutoffs are determined from acc_factor.
+                If given, eta (unless specified) is chosen to balance the
+                cost of the real and reciprocal space sums, and the cutoffs
+                (unless specified) are the smallest for which the estimated
+                error of each sum is target_error / sqrt(2), reduced by a
+                safety factor of 10 since the estimates are statistical.
+                Large target errors speed up screenings of many structures.
+                The estimate only covers the truncation of the sums. The energy
+                of a charged cell also depends on eta through the
+                compensating background term, so the default eta is kept
+                for charged cells.
+            w:
+                Cost of a real space term relative to a reciprocal space
+                term, used to choose eta when target_error is given.
+                Defaults to 1.
         """
         self._s = structure
         self._vol = structure.volume
 
         self._acc_factor = acc_factor
 
-        # set screening length
-        self._eta = eta if eta \
-            else (len(structure) * 0.01 / self._vol) ** (1 / 3) * pi
+        # The next few lines pre-compute certain quantities and store them.
+        # Ewald summation is rather expensive, and these shortcuts are
+        # necessary to obtain several factors of improvement in speedup.
+        self._oxi_states = [compute_average_oxidation_state(site)
+                            for site in structure]
+        sum_q2 = sum([q * q for q in self._oxi_states])
+        charged = abs(sum(self._oxi_states)) > 1e-8
+
+        # set screening length. The real space sum has about N^2 rmax^3 / V
+        # terms and the reciprocal space sum N^2 V gmax^3 / (8 pi^3) terms,
+        # with rmax ~ 1 / sqrt(eta) and gmax ~ 2 sqrt(eta) for a given
+        # accuracy, so that the total cost is smallest for
+        # eta = pi * (w / V^2) ^ (1/3). The jellium term of charged cells
+        # depends on eta, so their eta is not changed.
+        if eta:
+            self._eta = eta
+        elif target_error and not charged:
+            self._eta = pi * (w / self._vol ** 2) ** (1 / 3)
+        else:
+            self._eta = (len(structure) * 0.01 / self._vol) ** (1 / 3) * pi
         self._sqrt_eta = sqrt(self._eta)
 
         # acc factor used to automatically determine the optimal real and
         # reciprocal space cutoff radii
         self._accf = sqrt(log(10 ** acc_factor))
 
-        self._rmax = real_space_cut if real_space_cut \
-            else self._accf / self._sqrt_eta
-        self._gmax = recip_space_cut if recip_space_cut \
-            else 2 * self._sqrt_eta * self._accf
+        rcp_latt = structure.lattice.reciprocal_lattice
+        if target_error and sum_q2 > 0:
+            # The estimates are statistical, and the actual errors of
+            # ordered structures can be several times larger.
+            target = target_error / sqrt(2) / _ERROR_SAFETY_FACTOR
+            self._rmax = real_space_cut if real_space_cut else _solve_cutoff(
+                lambda r: _real_space_error(sum_q2, self._vol, self._eta, r),
+                1 / self._sqrt_eta, target)
+            self._gmax = recip_space_cut if recip_space_cut \
+                else _solve_cutoff(lambda g: _recip_space_error(
+                    sum_q2, rcp_latt, self._vol, self._eta, g),
+                    self._sqrt_eta, target)
+        else:
+            self._rmax = real_space_cut if real_space_cut \
+                else self._accf / self._sqrt_eta
+            self._gmax = recip_space_cut if recip_space_cut \
+                else 2 * self._sqrt_eta * self._accf
+        self._error = sqrt(
+            _real_space_error(sum_q2, self._vol, self._eta, self._rmax) ** 2 +
+            _recip_space_error(sum_q2, rcp_latt, self._vol, self._eta,
+                               self._gmax) ** 2)
 
-        # The next few lines pre-compute certain quantities and store them.
-        # Ewald summation is rather expensive, and these shortcuts are
-        # necessary to obtain several factors of improvement in speedup.
-        self._oxi_states = [compute_average_oxidation_state(site)
-                            for site in structure]
         self._coords = np.array(self._s.cart_coords)
         self._forces = np.zeros((len(structure), 3))
 
         # Now we call the relevant private methods to calculate the reciprocal
         # and real space terms.
-        (self._recip, recip_forces) = self._calc_recip()
-        (self._real, self._point, real_point_forces) = \
+        (recip_kernel, recip_forces) = self._calc_recip()
+        (real_kernel, self._point, real_point_forces) = \
             self._calc_real_and_point()
         self._forces = recip_forces + real_point_forces
 
+        # The energy matrices are q_i * q_j times charge independent kernels,
+        # which are kept to evaluate the energy of other charges on the same
+        # sites with compute_energies.
+        oxi_states = np.array(self._oxi_states)
+        qiqj = oxi_states[:, None] * oxi_states[None, :]
+        self._recip = recip_kernel * qiqj
+        self._real = real_kernel * qiqj
+        self._kernel = recip_kernel + real_kernel
+        self._total_energy_matrix = None
+
+    def compute_energies(self, charges):
+        """
+        Gives the total ewald energy of the same sites with other charges,
+        e.g., for different orderings or occupancies of the sites, without
+        recomputing the sums. Sites can be removed by setting their charges
+        to 0.
+
+        Args:
+            charges:
+                Sequence of the charges of the sites, or a 2D array with one
+                row of charges per configuration.
+
+        Returns:
+            Ewald sum, or array of the Ewald sums of the configurations.
+        """
+        q = np.array(charges, dtype=np.float)
+        energies = np.sum(np.dot(q, self._kernel.T) * q, axis=-1)
+        energies += EwaldSummation.CONV_FACT * (
+            -np.sum(q ** 2, axis=-1) * sqrt(self._eta / pi) +
+            np.sum(q, axis=-1) * pi / (2.0 * self._vol * self._eta))
+        return energies
+
     def compute_partial_energy(self, removed_indices):
         """
         Gives total ewald energy for certain sites being removed, i.e. zeroed
         out.
         """
-        total_energy_matrix = self.total_energy_matrix.copy()
-        for i in removed_indices:
-            total_energy_matrix[i, :] = 0
-            total_energy_matrix[:, i] = 0
-        return sum(sum(total_energy_matrix))
+        scaling = np.ones(self._s.num_sites)
+        scaling[list(removed_indices)] = 0
+        return self._scaled_energy(scaling)
 
     def compute_sub_structure(self, sub_structure, tol=1e-3):
         """
@@ -130,39 +220,33 @@ class EwaldSummation(object):
         Returns:
             Ewald sum of substructure.
         """
-        total_energy_matrix = self.total_energy_matrix.copy()
-
-        def find_match(site):
-            for test_site in sub_structure:
-                frac_diff = abs(np.array(site.frac_coords)
-                                - np.array(test_site.frac_coords)) % 1
-                frac_diff = [abs(a) < tol or abs(a) > 1 - tol \
-                     for a in frac_diff]
-                if all(frac_diff):
-                    return test_site
-            return None
-
-        matches = []
-        for i, site in enumerate(self._s):
-            matching_site = find_match(site)
-            if matching_site:
-                new_charge = compute_average_oxidation_state(matching_site)
-                old_charge = self._oxi_states[i]
-                scaling_factor = new_charge / old_charge
-                matches.append(matching_site)
-            else:
-                scaling_factor = 0
-            total_energy_matrix[i, :] *= scaling_factor
-            total_energy_matrix[:, i] *= scaling_factor
-
-        if len(matches) != len(sub_structure):
+        sub_fcoords = np.array([site.frac_coords for site in sub_structure])
+        matches = _match_frac_coords(self._s.frac_coords,
+                                     sub_fcoords.reshape((-1, 3)), tol)
+
+        scaling = np.zeros(self._s.num_sites)
+        for i in np.where(matches >= 0)[0]:
+            new_charge = compute_average_oxidation_state(
+                sub_structure[matches[i]])
+            scaling[i] = new_charge / self._oxi_states[i]
+
+        unmatched = set(range(len(sub_structure))) - set(matches)
+        if unmatched:
             output = ["Missing sites."]
-            for site in sub_structure:
-                if site not in matches:
-                    output.append("unmatched = {}".format(site))
+            for j in sorted(unmatched):
+                output.append("unmatched = {}".format(sub_structure[j]))
             raise ValueError("\n".join(output))
 
-        return sum(sum(total_energy_matrix))
+        return self._scaled_energy(scaling)
+
+    def _scaled_energy(self, scaling):
+        """
+        Gives the total ewald energy with the rows and columns of the total
+        energy matrix scaled by scaling, as a single quadratic form.
+        """
+        if self._total_energy_matrix is None:
+            self._total_energy_matrix = self.total_energy_matrix
+        return np.dot(scaling, np.dot(self._total_energy_matrix, scaling))
 
     @property
     def reciprocal_space_energy(self):
@@ -244,8 +328,16 @@ class EwaldSummation(object):
         S(G) = sum_{k=1,N} q_k exp(-i G.r_k)
         S(G)S(-G) = |S(G)|**2
 
-        This method is heavily vectorized to utilize numpy's C backend for
-        speed.
+        The G vectors are processed in blocks. For each block, the phases
+        G.r_k form a (block, N) matrix, and the energy matrix is accumulated
+        with matrix products of the cosines and sines of the phases, using
+        cos(Gr_j - Gr_i) + sin(Gr_j - Gr_i) = cos_i (cos_j + sin_j) +
+        sin_i (sin_j - cos_j). The size of the block is chosen to keep the
+        temporary arrays within MAX_MEMORY.
+
+        Returns:
+            (kernel, forces), where the reciprocal space energy matrix is
+            q_i * q_j * kernel[i, j].
         """
         numsites = self._s.num_sites
         prefactor = 2 * pi / self._vol
@@ -253,99 +345,114 @@ class EwaldSummation(object):
         forces = np.zeros((numsites, 3))
         coords = self._coords
         rcp_latt = self._s.lattice.reciprocal_lattice
-        recip_nn = get_points_in_sphere_pbc(rcp_latt, [[0, 0, 0]], [0, 0, 0],
-                                            self._gmax)
+        (centers, inds, images, dists) = get_neighbor_list_pbc(
+            rcp_latt, [[0, 0, 0]], [[0, 0, 0]], self._gmax)
+        gvects = rcp_latt.get_cartesian_coords(images[dists != 0])
+        gsquares = np.sum(gvects ** 2, axis=1)
+        #weight of each G vector, exp(-G.G / (4 eta)) / G.G
+        weights = np.exp(-gsquares / (4.0 * self._eta)) / gsquares
 
-        frac_to_cart = rcp_latt.get_cartesian_coords
-        
         oxistates = np.array(self._oxi_states)
-        #create array where q_2[i,j] is qi * qj
-        qiqj = oxistates[None, :] * oxistates[:, None]
-        
-        for (fcoords, dist, i) in recip_nn:
-            if dist == 0:
-                continue
-            gvect = frac_to_cart(fcoords)
-            gsquare = np.linalg.norm(gvect) ** 2
-
-            expval = exp(-1.0 * gsquare / (4.0 * self._eta))
-
-            gvectdot = np.sum(gvect[None, :] * coords, 1)
-            
-            #calculate the structure factor
-            sreal = np.sum(oxistates * np.cos(gvectdot))
-            simag = np.sum(oxistates * np.sin(gvectdot))
-            
-            #create array where exparg[i,j] is gvectdot[i] - gvectdot[j] 
-            exparg = gvectdot[None, :] - gvectdot[:, None]
-            
-            #uses the identity sin(x)+cos(x) = 2**0.5 sin(x + pi/4)
-            sfactor = qiqj * np.sin(exparg + pi/4) * 2 ** 0.5
-            
-            erecip += expval / gsquare * sfactor
-            pref = 2 * expval / gsquare * oxistates
-            factor = prefactor * pref * \
-                (sreal * np.sin(gvectdot)
-                 - simag * np.cos(gvectdot)) * EwaldSummation.CONV_FACT
-             
-            forces += factor[:, None] * gvect[None, :]
 
+        block = max(1, int(MAX_MEMORY // (6 * 8 * max(numsites, 1))))
+        for start in xrange(0, len(gvects), block):
+            gvect = gvects[start:start + block]
+            weight = weights[start:start + block, None]
+            gvectdot = np.dot(gvect, coords.T)
+            cos_gr = np.cos(gvectdot)
+            sin_gr = np.sin(gvectdot)
+
+            erecip += np.dot((weight * cos_gr).T, cos_gr + sin_gr)
+            erecip += np.dot((weight * sin_gr).T, sin_gr - cos_gr)
+
+            #calculate the structure factors
+            sreal = np.dot(cos_gr, oxistates)[:, None]
+            simag = np.dot(sin_gr, oxistates)[:, None]
+            factor = 2 * weight * (sreal * sin_gr - simag * cos_gr)
+            forces += np.dot(factor.T, gvect)
+
+        forces *= oxistates[:, None] * prefactor * EwaldSummation.CONV_FACT
         return erecip * prefactor * EwaldSummation.CONV_FACT, forces
-    
+
     def _calc_real_and_point(self):
         """
         Determines the self energy -(eta/pi)**(1/2) * sum_{i=1}^{N} q_i**2
 
         If cell is charged a compensating background is added (i.e. a G=0 term)
+
+        The real space terms are computed at once for all pairs of sites in
+        the flat neighbor list, and summed into the energy matrix and the
+        forces with np.bincount.
+
+        Returns:
+            (kernel, epoint, forces), where the real space energy matrix is
+            q_i * q_j * kernel[i, j].
         """
-        all_nn = self._s.get_all_neighbors(self._rmax, True)
-        
+        (centers, js, images, rij) = self._s.get_neighbor_list(self._rmax)
+        ncoords = self._s.lattice.get_cartesian_coords(
+            self._s.frac_coords[js] + images)
 
         forcepf = 2.0 * self._sqrt_eta / sqrt(pi)
-        coords = self._coords
         numsites = self._s.num_sites
-        ereal = np.zeros((numsites, numsites))
-        epoint = np.zeros(numsites)
-        forces = np.zeros((numsites, 3))
-        for i in xrange(numsites):
-            nn = all_nn[i]  # self._s.get_neighbors(site, self._rmax)
-            num_neighbors = len(nn)
-            qi = self._oxi_states[i]
-            epoint[i] = qi * qi
-            epoint[i] *= -1.0 * sqrt(self._eta / pi)
-            # add jellium term
-            epoint[i] += qi * pi / (2.0 * self._vol * self._eta)
-            
-            rij = np.zeros(num_neighbors)
-            qj = np.zeros(num_neighbors)
-            js = np.zeros(num_neighbors)
-            ncoords = np.zeros((num_neighbors,3))
-            
-            for k, (site, dist, j) in enumerate(nn):
-                rij[k] = dist
-                qj[k] = self._oxi_states[j]
-                js[k] = j
-                ncoords[k] = site.coords
-            
-            erfcval = np.array(map(erfc, self._sqrt_eta * rij))
-            new_ereals = erfcval * qi * qj / rij
-            
-            #insert new_ereals
-            for k, new_e in enumerate(new_ereals):
-                ereal[js[k],i] += new_e
-                
-            fijpf = qj / rij ** 3 * (erfcval + forcepf * rij * np.exp(-self._eta * rij ** 2))
-            forces[i] += np.sum(np.expand_dims(fijpf, 1) * (np.array([coords[i]]) - ncoords) * \
-                                qi * EwaldSummation.CONV_FACT, axis = 0)
+        oxi_states = np.array(self._oxi_states)
+
+        epoint = -oxi_states ** 2 * sqrt(self._eta / pi)
+        # add jellium term
+        epoint += oxi_states * pi / (2.0 * self._vol * self._eta)
+
+        qiqj = oxi_states[centers] * oxi_states[js]
+        erfcval = _erfc(self._sqrt_eta * rij)
+        #ereal[j, i] is the sum of the terms of the neighbors j of site i.
+        ereal = np.bincount(js * numsites + centers,
+                            weights=erfcval / rij,
+                            minlength=numsites ** 2).astype(np.float)
+        ereal = ereal.reshape((numsites, numsites))
+
+        fijpf = qiqj / rij ** 3 * \
+            (erfcval + forcepf * rij * np.exp(-self._eta * rij ** 2))
+        fij = fijpf[:, None] * (self._coords[centers] - ncoords)
+        #np.bincount returns integers if there are no neighbors.
+        forces = np.array([np.bincount(centers, weights=fij[:, k],
+                                       minlength=numsites)
+                           for k in range(3)], dtype=np.float).T
 
         ereal *= 0.5 * EwaldSummation.CONV_FACT
         epoint *= EwaldSummation.CONV_FACT
+        forces *= EwaldSummation.CONV_FACT
         return ereal, epoint, forces
 
     @property
     def eta(self):
         return self._eta
 
+    @property
+    def real_space_cut(self):
+        """
+        The real space cutoff radius.
+        """
+        return self._rmax
+
+    @property
+    def recip_space_cut(self):
+        """
+        The reciprocal space cutoff radius.
+        """
+        return self._gmax
+
+    @property
+    def estimated_error(self):
+        """
+        Statistical estimate of the error of the total energy in eV due to
+        the cutoffs, from the formula of Kolafa and Perram (Mol. Simul. 9,
+        351 (1992)) for the real space sum and from the omitted G vectors
+        for the reciprocal space sum. It is the typical error for random
+        charges, and the actual error of an ordered structure can be a few
+        times larger. Only the truncation of the real and reciprocal space
+        sums is covered, and not the dependence of the energy of a charged
+        cell on eta.
+        """
+        return self._error
+
     def __str__(self):
         output = ["Real = " + str(self.real_space_energy),
                   "Reciprocal = " + str(self.reciprocal_space_energy),
@@ -355,6 +462,92 @@ class EwaldSummation(object):
         return "\n".join(output)
 
 
+def _real_space_error(sum_q2, vol, eta, rmax):
+    """
+    Kolafa-Perram estimate of the error in eV of the real space sum with
+    cutoff rmax, for charges with sum of squares sum_q2.
+    """
+    return EwaldSummation.CONV_FACT * sum_q2 * sqrt(rmax / (2 * vol)) * \
+        exp(-eta * rmax ** 2) / (eta * rmax ** 2)
+
+
+def _recip_space_error(sum_q2, rcp_latt, vol, eta, gmax):
+    """
+    Estimate of the error in eV of the reciprocal space sum with cutoff
+    gmax, for charges with sum of squares sum_q2. The omitted terms are
+    summed over the G vectors of the reciprocal lattice rcp_latt beyond
+    gmax, with |S(G)|^2 replaced by its average over G, sum_q2. Unlike the
+    Kolafa-Perram formula, which assumes a cubic cell, this accounts for the
+    shape of the cell.
+    """
+    # Terms beyond gmax_out are smaller than exp(-30) times the first ones.
+    gmax_out = sqrt(gmax ** 2 + 120 * eta)
+    (centers, inds, images, dists) = get_neighbor_list_pbc(
+        rcp_latt, [[0, 0, 0]], [[0, 0, 0]], gmax_out)
+    gsquares = dists[dists > gmax] ** 2
+    return EwaldSummation.CONV_FACT * 2 * pi / vol * sum_q2 * \
+        np.sum(np.exp(-gsquares / (4 * eta)) / gsquares)
+
+
+def _solve_cutoff(error, x0, target, rtol=1e-3):
+    """
+    Finds the smallest cutoff x >= x0 for which the error estimate
+    error(x), which decreases for x >= x0, is at most target, by bisection.
+    """
+    hi = x0
+    while error(hi) > target:
+        hi *= 2
+    lo = hi / 2 if hi > x0 else hi
+    while hi - lo > rtol * hi:
+        mid = (lo + hi) / 2
+        if error(mid) > target:
+            lo = mid
+        else:
+            hi = mid
+    return hi
+
+
+def _match_frac_coords(fcoords1, fcoords2, tol):
+    """
+    Matches two lists of fractional coordinates, taking into account
+    periodic boundary conditions. The points of fcoords2 are binned on a
+    grid of cells of size at least tol, so that each point of fcoords1 is
+    only compared to the points in the neighboring cells.
+
+    Args:
+        fcoords1:
+            (n, 3) array of fractional coordinates.
+        fcoords2:
+            (m, 3) array of fractional coordinates.
+        tol:
+            Tolerance along each axis.
+
+    Returns:
+        Array of the index of the first point of fcoords2 within tol of
+        each point of fcoords1, or -1 if there is none.
+    """
+    nbins = max(1, int(1 / tol))
+    bins2 = np.floor(np.mod(fcoords2, 1) * nbins).astype(np.int) % nbins
+    cells = {}
+    for j, b in enumerate(bins2):
+        cells.setdefault(tuple(b), []).append(j)
+
+    shifts = np.array(list(itertools.product([-1, 0, 1], repeat=3)))
+    matches = np.zeros(len(fcoords1), dtype=np.int) - 1
+    bins1 = np.floor(np.mod(fcoords1, 1) * nbins).astype(np.int)
+    for i, b in enumerate(bins1):
+        cands = [j for key in set(map(tuple, (b + shifts) % nbins))
+                 for j in cells.get(key, [])]
+        if not cands:
+            continue
+        cands = np.array(sorted(cands))
+        diff = np.abs(fcoords1[i] - fcoords2[cands]) % 1
+        close = np.all((diff < tol) | (diff > 1 - tol), axis=1)
+        if np.any(close):
+            matches[i] = cands[np.argmax(close)]
+    return matches
+
+
 class EwaldMinimizer:
     """
     This class determines the manipulations that will minimize an ewald matrix,
@@ -370,6 +563,13 @@ class EwaldMinimizer:
     An alternative (possibly more intuitive) interface to this class is the
     order disordered structure transformation.
 
+    The orderings are found with a branch and bound search. Each node of the
+    search tree stores the energy of the manipulations done so far and the
+    row sums of the manipulated matrix, which are updated in O(N) when an
+    index is manipulated. Nodes are discarded when a lower bound on the
+    energy of their orderings exceeds the energy of the worst ordering
+    kept.
+
     Author - Will Richards
     """
 
@@ -378,13 +578,13 @@ class EwaldMinimizer:
     ALGO_BEST_FIRST = 2
 
     """
-    ALGO_TIME_LIMIT: Slowly increases the speed (with the cost of decreasing
-    accuracy) as the minimizer runs. Attempts to limit the run time to
-    approximately 30 minutes.
+    ALGO_TIME_LIMIT: Same as ALGO_FAST, but stops after approximately 30
+    minutes (or time_limit) and returns the best orderings found so far.
     """
     ALGO_TIME_LIMIT = 3
 
-    def __init__(self, matrix, m_list, num_to_return=1, algo=ALGO_FAST):
+    def __init__(self, matrix, m_list, num_to_return=1, algo=ALGO_FAST,
+                 time_limit=None, max_nodes=None):
         """
         Args:
             matrix:
@@ -396,22 +596,39 @@ class EwaldMinimizer:
                 (multiplication fraction, number_of_indices, indices, species)
                 These are sorted such that the first manipulation contains the
                 most permutations. this is actually evaluated last in the
-                recursion since I'm using pop.
+                search.
             num_to_return:
                 The minimizer will find the number_returned lowest energy
                 structures. This is likely to return a number of duplicate
                 structures so it may be necessary to overestimate and then
                 remove the duplicates later. (duplicate checking in this
                 process is extremely expensive)
+            algo:
+                ALGO_FAST does a depth first search and returns the
+                num_to_return lowest energy orderings. ALGO_BEST_FIRST
+                expands the nodes with the lowest bound first, which finds
+                the same orderings and stops as soon as they are found.
+                ALGO_COMPLETE returns all orderings, ranked by energy.
+                ALGO_TIME_LIMIT is ALGO_FAST with a default time_limit of
+                30 minutes.
+            time_limit:
+                Wall-clock budget of the search in seconds. Defaults to None,
+                i.e., no limit.
+            max_nodes:
+                Maximum number of nodes of the search tree to expand.
+                Defaults to None, i.e., no limit.
+
+            If the search runs out of budget, the best orderings found so
+            far are returned. If fewer than num_to_return orderings have
+            been found, more are completed greedily from the most promising
+            unexplored nodes, until there are num_to_return orderings or no
+            more exist. With ALGO_COMPLETE, this only ensures that at least
+            one ordering is returned.
         """
         # Setup and checking of inputs
-        self._matrix = copy(matrix)
         # Make the matrix diagonally symmetric (so matrix[i,:] == matrix[:,j])
-        for i in range(len(self._matrix)):
-            for j in range(i, len(self._matrix)):
-                value = (self._matrix[i, j] + self._matrix[j, i]) / 2
-                self._matrix[i, j] = value
-                self._matrix[j, i] = value
+        matrix = np.array(matrix, dtype=np.float)
+        self._matrix = (matrix + matrix.T) / 2
 
         def comb(n, k):
             return factorial(n) / factorial(k) / factorial(n - k)
@@ -427,179 +644,347 @@ class EwaldMinimizer:
         self._num_to_return = num_to_return
         self._algo = algo
         if algo == EwaldMinimizer.ALGO_COMPLETE:
-            raise NotImplementedError('Complete algo not yet implemented for '
-                                      'EwaldMinimizer')
+            self._num_to_return = float('inf')
+        if algo == EwaldMinimizer.ALGO_TIME_LIMIT and time_limit is None:
+            time_limit = 1800
+        self._time_limit = time_limit
+        self._max_nodes = max_nodes
+        self._num_nodes = 0
 
         self._output_lists = []
-        # Tag that the recurse function looks at at each level. If a method
-        # sets this to true it breaks the recursion and stops the search.
+        # Tag that the search looks at at each node. It is set to true when
+        # the budget is exhausted.
         self._finished = False
 
         self._start_time = datetime.utcnow()
 
+        self._setup()
         self.minimize_matrix()
 
         self._best_m_list = self._output_lists[0][1]
         self._minimized_sum = self._output_lists[0][0]
 
+    def _setup(self):
+        """
+        Precomputes the quantities used to bound the energies. The indices
+        that can be manipulated are numbered by their position in
+        self._indices, and self._members[g, u] is True if index u can be
+        manipulated by manipulation g.
+        """
+        self._indices = np.array(sorted(set(itertools.chain(
+            *[m[2] for m in self._m_list]))), dtype=np.int)
+        pos = dict([(i, u) for u, i in enumerate(self._indices)])
+        ngroups, nind = len(self._m_list), len(self._indices)
+        self._deltas = np.array([m[0] - 1 for m in self._m_list],
+                                dtype=np.float)
+        self._members = np.zeros((ngroups, nind), dtype=np.bool)
+        for g, m in enumerate(self._m_list):
+            self._members[g, [pos[i] for i in m[2]]] = True
+        self._diag = self._matrix[self._indices, self._indices]
+        #interactions between the indices, with a zero diagonal.
+        self._sub = self._matrix[self._indices][:, self._indices]
+        self._sub[np.arange(nind), np.arange(nind)] = 0
+
     def minimize_matrix(self):
         """
         This method finds and returns the permutations that produce the lowest
-        ewald sum calls recursive function to iterate through permutations
+        ewald sum. The search tree is explored depth first, or best first
+        with a priority queue for ALGO_BEST_FIRST.
+        """
+        root = _MinimizerNode(
+            np.sum(self._matrix), np.sum(self._matrix, axis=1),
+            np.array([m[1] for m in self._m_list], dtype=np.int),
+            self._members.copy(), np.zeros(len(self._indices), dtype=np.bool),
+            [])
+        if root.is_leaf:
+            self.add_m_list(root.energy, [])
+            return
+        best_first = self._algo == EwaldMinimizer.ALGO_BEST_FIRST
+        prune = self._algo != EwaldMinimizer.ALGO_COMPLETE
+        root.bound = self.best_case(root) if prune else 0
+        #open nodes, as a heap of (bound, count, node) for best first and a
+        #stack of nodes otherwise.
+        count = itertools.count()
+        open_nodes = [(root.bound, next(count), root)] if best_first \
+            else [root]
+
+        while open_nodes:
+            if best_first:
+                node = heapq.heappop(open_nodes)[2]
+            else:
+                node = open_nodes.pop()
+            if prune and node.bound > self._current_minimum:
+                if best_first:
+                    #all remaining nodes have larger bounds
+                    return
+                continue
+            if self._out_of_budget():
+                self._finished = True
+                if best_first:
+                    heapq.heappush(open_nodes, (node.bound, next(count), node))
+                else:
+                    open_nodes.append(node)
+                break
+            self._num_nodes += 1
+
+            for child in self._expand(node):
+                if child.is_leaf:
+                    if child.energy < self._current_minimum or not prune:
+                        self.add_m_list(child.energy, child.output_m_list)
+                    continue
+                child.bound = self.best_case(child) if prune else 0
+                if child.bound > self._current_minimum or \
+                        child.bound == float('inf'):
+                    continue
+                if best_first:
+                    heapq.heappush(open_nodes,
+                                   (child.bound, next(count), child))
+                else:
+                    open_nodes.append(child)
+
+        #ALGO_COMPLETE keeps all orderings, and only needs one when out of
+        #budget.
+        needed = self._num_to_return if prune else 1
+        if self._finished and len(self._output_lists) < needed:
+            #Out of budget. Complete the most promising nodes greedily. The
+            #nodes excluded along each dive are kept for the next dives, so
+            #that the dives go on until enough orderings are found or the
+            #tree is exhausted.
+            if best_first:
+                nodes = [n for b, c, n in sorted(open_nodes, reverse=True)]
+            else:
+                nodes = open_nodes
+            while nodes and len(self._output_lists) < needed:
+                node = nodes.pop()
+                if prune and node.bound > self._current_minimum:
+                    continue
+                leaf = self._dive(node, nodes if prune else None)
+                if leaf is not None and (leaf.energy < self._current_minimum
+                                         or not prune):
+                    self.add_m_list(leaf.energy, leaf.output_m_list)
+
+    def _out_of_budget(self):
+        """
+        Checks whether the time or node budget of the search is exhausted.
         """
-        if self._algo == EwaldMinimizer.ALGO_FAST or \
-            self._algo == EwaldMinimizer.ALGO_BEST_FIRST:
-            return self._recurse(self._matrix, self._m_list,
-                                 set(range(len(self._matrix))))
+        if self._max_nodes is not None and \
+                self._num_nodes >= self._max_nodes:
+            return True
+        if self._time_limit is not None:
+            elapsed = datetime.utcnow() - self._start_time
+            return elapsed.total_seconds() > self._time_limit
+        return False
 
     def add_m_list(self, matrix_sum, m_list):
         """
         This adds an m_list to the output_lists and updates the current
         minimum if the list is full.
         """
-        if self._output_lists is None:
-            self._output_lists = [[matrix_sum, m_list]]
-        else:
-            bisect.insort(self._output_lists, [matrix_sum, m_list])
-        if self._algo == EwaldMinimizer.ALGO_BEST_FIRST and \
-            len(self._output_lists) == self._num_to_return:
-            self._finished = True
+        bisect.insort(self._output_lists, [matrix_sum, m_list])
         if len(self._output_lists) > self._num_to_return:
             self._output_lists.pop()
         if len(self._output_lists) == self._num_to_return:
             self._current_minimum = self._output_lists[-1][0]
 
-    def best_case(self, matrix, m_list, indices_left):
+    def _costs(self, node):
         """
-        Computes a best case given a matrix and manipulation list.
-
-        Args:
-            matrix:
-                the current matrix (with some permutations already performed
-            m_list:
-                [(multiplication fraction, number_of_indices, indices,
-                species)] describing the manipulation
-            indices:
-                Set of indices which haven't had a permutation performed on
-                them.
-        """
-
-        m_indices = []
-        fraction_list = []
-        for m in m_list:
-            m_indices.extend(m[2])
-            fraction_list.extend([m[0]] * m[1])
-
-        indices = list(indices_left.intersection(m_indices))
-
-        interaction_matrix = matrix[indices, :][:, indices]
-
-        fractions = np.zeros(len(interaction_matrix)) + 1
-        fractions[:len(fraction_list)] = fraction_list
-        fractions = np.sort(fractions)
-
-        # Sum associated with each index (disregarding interactions between
-        # indices)
-        sums = 2 * np.sum(matrix[indices], axis=1)
-        sums = np.sort(sums)
-
-        # Interaction corrections. Can be reduced to (1-x)(1-y) for x,y in
-        # fractions each element in a column gets multiplied by (1-x), and then
-        # the sum of the columns gets multiplied by (1-y) since fractions are
-        # less than 1, there is no effect of one choice on the other
-        step1 = np.sort(interaction_matrix) * (1 - fractions)
-        step2 = np.sort(np.sum(step1, axis=1))
-        step3 = step2 * (1 - fractions)
-        interaction_correction = np.sum(step3)
-
-        if self._algo == self.ALGO_TIME_LIMIT:
-            elapsed_time = datetime.utcnow() - self._start_time
-            speedup_parameter = elapsed_time.total_seconds() / 1800
-            avg_int = np.sum(interaction_matrix, axis=None)
-            avg_frac = np.average(np.outer(1 - fractions, 1 - fractions))
-            average_correction = avg_int * avg_frac
-
-            interaction_correction = average_correction * speedup_parameter \
-                + interaction_correction * (1 - speedup_parameter)
-
-        best_case = np.sum(matrix) + np.inner(sums[::-1], fractions - 1) \
-            + interaction_correction
-
-        return best_case
-
-    def get_next_index(self, matrix, manipulation, indices_left):
-        """
-        Returns an index that should have the most negative effect on the
-        matrix sum
-        """
-        f = manipulation[0]
-        indices = list(indices_left.intersection(manipulation[2]))
-        sums = np.sum(matrix[indices], axis=1)
-        if f < 1:
-            next_index = indices[sums.argmax(axis=0)]
-        else:
-            next_index = indices[sums.argmin(axis=0)]
-
-        return next_index
-
-    def _recurse(self, matrix, m_list, indices, output_m_list=[]):
+        Changes of energy from manipulating each index alone with each
+        manipulation at a node, as a (manipulations, indices) array.
+        Indices which cannot be manipulated have an infinite cost.
         """
-        This method recursively finds the minimal permutations using a binary
-        tree search strategy.
+        d = self._deltas[:, None]
+        r = node.row_sums[self._indices][None, :]
+        costs = 2 * d * r + d ** 2 * self._diag[None, :]
+        return np.where(self._active(node), costs, np.inf)
 
-        Args:
-            matrix:
-                The current matrix (with some permutations already performed
-            m_list:
-                The list of permutations still to be performed
-            indices:
-                Set of indices which haven't had a permutation performed on
-                them.
+    def _active(self, node):
         """
-        #check to see if we've found all the solutions that we need
-        if self._finished:
-            return
-
-        #if we're done with the current manipulation, pop it off.
-        while m_list[-1][1] == 0:
-            m_list = copy(m_list)
-            m_list.pop()
-            #if there are no more manipulations left to do check the value
-            if not m_list:
-                matrix_sum = np.sum(matrix)
-                if matrix_sum < self._current_minimum:
-                    self.add_m_list(matrix_sum, output_m_list)
-                return
-
-        #if we wont have enough indices left, return
-        if m_list[-1][1] > len(indices.intersection(m_list[-1][2])):
-            return
-
-        if len(m_list) == 1 or m_list[-1][1] > 1:
-            if self.best_case(matrix, m_list, indices) > self._current_minimum:
-                return
-
-        index = self.get_next_index(matrix, m_list[-1], indices)
-
-        m_list[-1][2].remove(index)
+        The (manipulations, indices) boolean array of the indices which can
+        still be manipulated by each manipulation at a node.
+        """
+        return node.available & np.logical_not(node.used)[None, :] & \
+            (node.remaining > 0)[:, None]
 
-        # Make the matrix and new m_list where we do the manipulation to the
-        # index that we just got
-        matrix2 = np.copy(matrix)
-        m_list2 = deepcopy(m_list)
-        output_m_list2 = copy(output_m_list)
+    def best_case(self, node):
+        """
+        Computes a lower bound on the energy of the orderings below a node
+        of the search tree.
+
+        With x[g, k] = 1 if index k is manipulated by g and 0 otherwise,
+        and z = d.x the fractions minus 1 of the indices, the energy of an
+        ordering is E + sum_k z_k (2 r_k + z_k M[k, k]) + z.A.z, where E
+        and r are the energy and row sums at the node and A the
+        interactions between the indices left, with a zero diagonal. If
+        lambda is the lowest eigenvalue of A, z.A.z = z.(A - lambda).z +
+        lambda * sum_g,k d_g^2 x[g, k], which is a convex function of x.
+        Its minimum over fractional x bounds the energy. For any x, it is
+        at least f(x) + min_s grad(x).(s - x), where the minimum over s is
+        taken either for each manipulation separately, or over distinct
+        indices regardless of how many each manipulation needs. x is
+        improved by accelerated projected gradient steps, starting from the
+        x of the parent node. The gradient at the best x is kept in
+        node.costs to pick the next index.
 
-        matrix2[index, :] *= m_list[-1][0]
-        matrix2[:, index] *= m_list[-1][0]
-        output_m_list2.append([index, m_list[-1][3]])
-        indices2 = copy(indices)
-        indices2.remove(index)
-        m_list2[-1][1] -= 1
+        Args:
+            node:
+                _MinimizerNode
 
-        #recurse through both the modified and unmodified matrices
+        Returns:
+            The lower bound, or inf if the manipulations cannot be completed.
+        """
+        active = self._active(node)
+        cand = np.where(np.any(active, axis=0))[0]
+        active = active[:, cand]
+        m = node.remaining
+        groups = np.where(m > 0)[0]
+        if np.any(np.sum(active, axis=1) < m) or len(cand) < np.sum(m):
+            return float('inf')
+        d = self._deltas[:, None]
+        r = node.row_sums[self._indices[cand]]
+        if np.sum(m) > 1:
+            a = self._sub[cand][:, cand]
+            eigs = np.linalg.eigvalsh(a)
+            lam = eigs[0]
+            a[np.arange(len(cand)), np.arange(len(cand))] -= lam
+            #Lipschitz constant of the gradient
+            lipschitz = 2 * np.sum(self._deltas[groups] ** 2) * \
+                (eigs[-1] - lam)
+        else:
+            #a single index left has no pair terms, and its costs are exact.
+            a, lam, lipschitz = np.zeros((len(cand), len(cand))), 0, 0
+        c = 2 * d * r[None, :] + d ** 2 * (self._diag[cand] + lam)[None, :]
 
-        self._recurse(matrix2, m_list2, indices2, output_m_list2)
-        self._recurse(matrix, m_list, indices, output_m_list)
+        if node.weights is not None:
+            x = np.where(active, node.weights[:, cand], 0)
+        else:
+            x = active.astype(np.float)
+        x = self._project(x, active, m)
+        y, t = x, 1.
+        bound = -float('inf')
+        for i in xrange(_BOUND_STEPS):
+            z = np.dot(self._deltas, y)
+            az = np.dot(a, z)
+            grad = c + 2 * d * az[None, :]
+            grad[np.logical_not(active)] = np.inf
+            separate = 0
+            for g in groups:
+                separate += np.partition(grad[g], m[g] - 1)[:m[g]].sum()
+            if len(groups) > 1:
+                total = np.sum(m)
+                shared = np.partition(np.min(grad, axis=0),
+                                      total - 1)[:total].sum()
+                separate = max(separate, shared)
+            #relaxed energy f(y) = c.y + z.az, and f(y) - grad.y + separate
+            #with grad.y = c.y + 2 z.az.
+            energy = node.energy + np.sum(c * y) + np.dot(z, az)
+            value = node.energy - np.dot(z, az) + separate
+            if value > bound:
+                bound = value
+                node.costs = np.empty(node.available.shape)
+                node.costs.fill(np.inf)
+                node.costs[:, cand] = grad
+                node.weights = np.zeros(node.available.shape)
+                node.weights[:, cand] = y
+            #stop once the node is pruned, or once the relaxed energy is
+            #below the current minimum, as the bound is then unlikely to
+            #get above it.
+            if lipschitz <= 0 or bound > self._current_minimum or \
+                    energy < self._current_minimum:
+                break
+            x_next = self._project(y - grad / lipschitz, active, m)
+            t_next = (1 + sqrt(1 + 4 * t * t)) / 2
+            y = x_next + (t - 1) / t_next * (x_next - x)
+            x, t = x_next, t_next
+        return bound
+
+    def _project(self, x, active, m):
+        """
+        Projects each row of x on the fractional assignments of the
+        manipulation, i.e., 0 <= x <= 1 with m indices in total.
+        """
+        proj = np.zeros(x.shape)
+        for g in np.where(m > 0)[0]:
+            y = x[g, active[g]]
+            #sum(clip(y - tau, 0, 1)) is piecewise linear and decreasing in
+            #tau, with breakpoints at y and y - 1.
+            taus = np.sort(np.concatenate([y, y - 1]))
+            sums = np.clip(y[None, :] - taus[:, None], 0, 1).sum(axis=1)
+            tau = np.interp(m[g], sums[::-1], taus[::-1])
+            proj[g, active[g]] = np.clip(y - tau, 0, 1)
+        return proj
+
+    def get_next_index(self, node):
+        """
+        Returns the manipulation to branch on, which is the one with the
+        fewest permutations that is not completed, and the position of the
+        index with the lowest cost for it, i.e., with the most negative
+        effect on the matrix sum. If the bound of the node was computed,
+        the costs are the gradient of the relaxed energy of best_case.
+        """
+        g = np.where(node.remaining > 0)[0][-1]
+        costs = node.costs if node.costs is not None else \
+            self._costs(node)
+        costs = costs[g]
+        u = np.argmin(costs)
+        if not np.isfinite(costs[u]):
+            return g, None
+        return g, u
+
+    def _manipulate(self, node, g, u):
+        """
+        Returns the child of node where index u is manipulated by g. The
+        energy and row sums are updated in O(N).
+        """
+        i = self._indices[u]
+        d = self._deltas[g]
+        energy = node.energy + 2 * d * node.row_sums[i] + \
+            d ** 2 * self._matrix[i, i]
+        row_sums = node.row_sums + d * self._matrix[:, i]
+        remaining = node.remaining.copy()
+        remaining[g] -= 1
+        used = node.used.copy()
+        used[u] = True
+        return _MinimizerNode(energy, row_sums, remaining, node.available,
+                              used, node.output_m_list +
+                              [[i, self._m_list[g][3]]])
+
+    def _expand(self, node):
+        """
+        Returns the children of a node: the index with the lowest cost is
+        either manipulated or excluded from the manipulation.
+        """
+        g, u = self.get_next_index(node)
+        if u is None:
+            return []
+        available = node.available.copy()
+        available[g, u] = False
+        excluded = _MinimizerNode(node.energy, node.row_sums, node.remaining,
+                                  available, node.used, node.output_m_list)
+        manipulated = self._manipulate(node, g, u)
+        excluded.weights = manipulated.weights = node.weights
+        #the manipulated child is returned last, so that it is expanded
+        #first in a depth first search.
+        return [excluded, manipulated]
+
+    def _dive(self, node, excluded=None):
+        """
+        Greedily completes a node by manipulating the index with the lowest
+        cost until all manipulations are done. Returns the leaf, or None if
+        the manipulations cannot be completed. If excluded is a list, the
+        nodes where the chosen indices are excluded instead, and which may
+        still improve on the current minimum, are appended to it.
+        """
+        while not node.is_leaf:
+            children = self._expand(node)
+            if not children:
+                return None
+            (other, node) = children
+            if excluded is not None:
+                other.bound = self.best_case(other)
+                if other.bound <= self._current_minimum and \
+                        other.bound != float('inf'):
+                    excluded.append(other)
+        return node
 
     @property
     def best_m_list(self):
@@ -613,6 +998,54 @@ class EwaldMinimizer:
     def output_lists(self):
         return self._output_lists
 
+    @property
+    def num_nodes(self):
+        """
+        Number of nodes of the search tree expanded.
+        """
+        return self._num_nodes
+
+
+class _MinimizerNode(object):
+    """
+    A node of the search tree of EwaldMinimizer.
+    """
+
+    __slots__ = ["energy", "row_sums", "remaining", "available", "used",
+                 "output_m_list", "bound", "costs", "weights"]
+
+    def __init__(self, energy, row_sums, remaining, available, used,
+                 output_m_list):
+        """
+        Args:
+            energy:
+                Sum of the matrix with the manipulations done so far.
+            row_sums:
+                Row sums of the manipulated matrix.
+            remaining:
+                Number of indices left to manipulate for each manipulation.
+            available:
+                (manipulations, indices) boolean array of the indices which
+                have not been excluded from each manipulation.
+            used:
+                Boolean array of the indices already manipulated.
+            output_m_list:
+                List of the [index, species] manipulations done so far.
+        """
+        self.energy = energy
+        self.row_sums = row_sums
+        self.remaining = remaining
+        self.available = available
+        self.used = used
+        self.output_m_list = output_m_list
+        self.bound = None
+        self.costs = None
+        self.weights = None
+
+    @property
+    def is_leaf(self):
+        return not np.any(self.remaining > 0)
+
 
 def compute_average_oxidation_state(site):
     """
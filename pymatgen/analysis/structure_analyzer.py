@@ -190,13 +190,19 @@ class RelaxationAnalyzer(object):
             site1 and siten is the same as bonding between siten and site1,
             there is no reason to duplicate the information or computation.
         """
+        #Only pairs within max_radius in the initial structure are needed,
+        #which the neighbor list provides without testing all pairs.
+        (centers, indices, images, dists) = \
+            self.initial.get_neighbor_list(max_radius)
+        initial_dists = {}
+        for i, j, dist in zip(centers.tolist(), indices.tolist(), dists):
+            if i < j and dist < initial_dists.get((i, j), max_radius):
+                initial_dists[(i, j)] = dist
+
         data = collections.defaultdict(dict)
-        for inds in itertools.combinations(xrange(len(self.initial)), 2):
-            (i, j) = sorted(inds)
-            initial_dist = self.initial[i].distance(self.initial[j])
-            if initial_dist < max_radius:
-                final_dist = self.final[i].distance(self.final[j])
-                data[i][j] = final_dist / initial_dist - 1
+        for (i, j), initial_dist in initial_dists.items():
+            final_dist = self.final[i].distance(self.final[j])
+            data[i][j] = final_dist / initial_dist - 1
         return data
 
 
@@ -17,17 +17,40 @@ __date__ = "Dec 3, 2012"
 import numpy as np
 import itertools
 import abc
+import collections
 
-from pymatgen.serializers.json_coders import MSONable
+from pymatgen.serializers.json_coders import MSONable, PMGJSONDecoder
 from pymatgen.core.structure import Structure
-from pymatgen.core.structure_modifier import StructureEditor
-from pymatgen.core.lattice import Lattice
+from pymatgen.core.lattice import Lattice, reduce_lattices
 from pymatgen.core.composition import Composition
-from pymatgen.optimization.linear_assignment import LinearAssignment
+from pymatgen.optimization.linear_assignment import LinearAssignment, \
+    batch_linear_assignment
 from pymatgen.util.coord_utils import get_points_in_sphere_pbc, \
     pbc_shortest_vectors
 
 
+#Relative tolerance on the lattice invariants, which accounts for the
+#numerical tolerance of the Niggli reduction.
+_INVARIANT_TOL = 1e-3
+
+#Maximum number of candidate triples of lattice vectors formed at once in
+#StructureMatcher._get_lattices.
+_MAX_LATTICE_CANDIDATES = 2 ** 18
+
+#Maximum number of elements of the distance arrays formed at once in
+#StructureMatcher._get_translations.
+_MAX_TRANSLATION_ELEMENTS = 2 ** 22
+
+#Number of nearest neighbor distances of each site in the default structure
+#fingerprint.
+_FINGERPRINT_NEIGHBORS = 8
+
+#The normalized nearest neighbor distances of most structures lie within a
+#range of about this width, so that fingerprints cannot discard pairs of
+#structures if the tolerance window on the distances is wider.
+_MAX_FINGERPRINT_WINDOW = 0.5
+
+
 class AbstractComparator(MSONable):
     """
     Abstract Comparator class. A Comparator defines how sites are compared in
@@ -76,6 +99,47 @@ class AbstractComparator(MSONable):
         """
         return
 
+    def get_structure_fingerprint(self, structure):
+        """
+        Defines a numeric fingerprint for structures, which refines the
+        structure hash. Structures with the same hash can only match if
+        their fingerprints pass StructureMatcher.fingerprints_may_match,
+        which allows more pairs of structures to be discarded without
+        fitting. Like the hash, the fingerprint should be fast to compute
+        relative to the actual matching. The default fingerprint only
+        depends on the geometry, and is suitable for all comparators.
+
+        Args:
+            structure:
+                A structure
+
+        Returns:
+            Numpy array of the volume per site, of the shortest and longest
+            nearest neighbor distances of the sites, and of the k-th nearest
+            neighbor distances averaged over the sites for k = 1 to 8. The
+            distances are normalized by the cube root of the volume per
+            site. None of these are changed by the reduction to a primitive
+            cell.
+        """
+        nsites = structure.num_sites
+        vol = structure.volume / nsites
+        scale = vol ** (1 / 3)
+        k = _FINGERPRINT_NEIGHBORS
+        #A site has about 4 pi r^3 / (3 vol) neighbors within r.
+        r = 1.5 * scale * (3 * k / (4 * np.pi)) ** (1 / 3)
+        while True:
+            (centers, indices, images, dists) = \
+                structure.get_neighbor_list(r)
+            counts = np.bincount(centers, minlength=nsites)
+            if np.all(counts >= k):
+                break
+            r *= 1.5
+        dists = dists[np.lexsort((dists, centers))]
+        starts = np.cumsum(counts) - counts
+        knn = dists[starts[:, None] + np.arange(k)[None, :]] / scale
+        return np.concatenate([[vol, np.min(knn[:, 0]), np.max(knn[:, 0])],
+                               np.mean(knn, axis=0)])
+
     @staticmethod
     def from_dict(d):
         for trans_modules in ['structure_matcher']:
@@ -254,6 +318,15 @@ class StructureMatcher(MSONable):
 
     """
 
+    #Maximum number of preprocessed structures cached by the matcher.
+    prepared_cache_size = 1000
+
+    #Pre-groups with fewer structures are grouped in one task by
+    #group_structures with n_jobs. For larger pre-groups, the candidate pairs
+    #are fitted in blocks of parallel_block_size pairs.
+    parallel_bucket_size = 100
+    parallel_block_size = 1000
+
     def __init__(self, ltol=0.2, stol=0.3, angle_tol=5, primitive_cell=True,
                  scale=True, comparator=SpeciesComparator()):
         """
@@ -292,73 +365,162 @@ class StructureMatcher(MSONable):
         self._comparator = comparator
         self._primitive_cell = primitive_cell
         self._scale = scale
+        self._prepared_cache = collections.OrderedDict()
+
+    def _get_lattices(self, lattice1, lattice2, vol_tol):
+        """
+        Generates the lattices spanned by lattice vectors of lattice2 that
+        are within the length and angle tolerances of lattice1, in order of
+        increasing distortion from lattice1, so that fits usually succeed
+        on one of the first lattices.
+
+        Candidate vectors are first selected by length for each lattice
+        vector of lattice1. The angles between pairs of candidates are then
+        checked before triples of vectors are formed, and triples are
+        formed in chunks to limit the memory used.
 
-    def _get_lattices(self, s1, s2, vol_tol):
-        s1_lengths, s1_angles = s1.lattice.lengths_and_angles
+        Args:
+            lattice1:
+                The lattice to match.
+            lattice2:
+                The lattice from which the lattice vectors are taken.
+            vol_tol:
+                Minimum volume of the generated lattices.
+        """
+        s1_lengths, s1_angles = lattice1.lengths_and_angles
         all_nn = get_points_in_sphere_pbc(
-            s2.lattice, [[0, 0, 0]], [0, 0, 0],
+            lattice2, [[0, 0, 0]], [0, 0, 0],
             (1 + self.ltol) * max(s1_lengths))[:, [0, 1]]
         nv = []
+        #Distortions are the deviations from the lengths and angles of
+        #lattice1 as fractions of the tolerances.
+        length_dev = []
         for l in s1_lengths:
             nvi = all_nn[np.where((all_nn[:, 1] < (1 + self.ltol) * l)
-                                  & (all_nn[:, 1] > (1 - self.ltol) * l))][:, 0]
+                                  & (all_nn[:, 1] > (1 - self.ltol) * l))]
             if not len(nvi):
                 return
-            nvi = [np.array(site) for site in nvi]
-            nvi = np.dot(nvi, s2.lattice.matrix)
-            nv.append(nvi)
-
-        #The vectors are broadcast into a 5-D array containing
-        #all permutations of the entries in nv[0], nv[1], nv[2]
-        #produces the same result as three nested loops over the
-        #same variables and calculating determinants individually
-        bfl = (np.array(nv[0])[None, None, :, None, :] *
-               np.array([1, 0, 0])[None, None, None, :, None] +
-               np.array(nv[1])[None, :, None, None, :] *
-               np.array([0, 1, 0])[None, None, None, :, None] +
-               np.array(nv[2])[:, None, None, None, :] *
-               np.array([0, 0, 1])[None, None, None, :, None])
-
-        #Compute volume of each array
-        vol = np.sum(bfl[:, :, :, 0, :] * np.cross(bfl[:, :, :, 1, :],
-                                                   bfl[:, :, :, 2, :]), 3)
-        #Find valid lattices
-        valid = np.where(abs(vol) >= vol_tol)
-        if not len(valid[0]):
-            return
-        #loop over valid lattices to compute the angles for each
-        lengths = np.sum(bfl[valid] ** 2, axis=2) ** 0.5
-        angles = np.zeros((len(bfl[valid]), 3), float)
-        for i in xrange(3):
-            j = (i + 1) % 3
-            k = (i + 2) % 3
-            angles[:, i] = \
-                np.sum(bfl[valid][:, j, :] * bfl[valid][:, k, :], 1)\
-                / (lengths[:, j] * lengths[:, k])
-        angles = np.arccos(angles) * 180. / np.pi
-        #Check angles are within tolerance
-        valid_angles = np.where(np.all(np.abs(angles - s1_angles) <
-                                       self.angle_tol, axis=1))
-        if not len(valid_angles[0]):
+            nv.append(np.dot([np.array(site) for site in nvi[:, 0]],
+                             lattice2.matrix))
+            length_dev.append(np.abs(nvi[:, 1].astype(np.float) / l - 1) /
+                              self.ltol)
+
+        def get_angle_dev(i, j, angle):
+            v1, v2 = nv[i], nv[j]
+            cos = np.dot(v1, v2.T) / np.outer(np.sum(v1 ** 2, axis=1) ** 0.5,
+                                              np.sum(v2 ** 2, axis=1) ** 0.5)
+            angles = np.arccos(np.clip(cos, -1, 1)) * 180. / np.pi
+            return np.abs(angles - angle) / self.angle_tol
+
+        #alpha is the angle between b and c, beta between a and c and gamma
+        #between a and b.
+        dev_bc = get_angle_dev(1, 2, s1_angles[0])
+        dev_ac = get_angle_dev(0, 2, s1_angles[1])
+        dev_ab = get_angle_dev(0, 1, s1_angles[2])
+
+        ia, ib = np.where(dev_ab < 1)
+        chunk = max(1, _MAX_LATTICE_CANDIDATES // len(nv[2]))
+        matrices = []
+        distortions = []
+        for start in xrange(0, len(ia), chunk):
+            pa, pb = ia[start:start + chunk], ib[start:start + chunk]
+            inds, ic = np.where((dev_ac[pa] < 1) & (dev_bc[pb] < 1))
+            pa, pb = pa[inds], pb[inds]
+            mats = np.concatenate([nv[0][pa][:, None], nv[1][pb][:, None],
+                                   nv[2][ic][:, None]], axis=1)
+            vol = np.sum(mats[:, 0] * np.cross(mats[:, 1], mats[:, 2]),
+                         axis=1)
+            valid = np.abs(vol) >= vol_tol
+            matrices.append(mats[valid])
+            distortions.append(np.max(
+                [length_dev[0][pa], length_dev[1][pb], length_dev[2][ic],
+                 dev_ab[pa, pb], dev_ac[pa, ic], dev_bc[pb, ic]],
+                axis=0)[valid])
+        if not matrices:
             return
+        matrices = np.concatenate(matrices)
+        distortions = np.concatenate(distortions)
+
         #yield valid lattices
-        for lat in bfl[valid][valid_angles]:
-            nl = Lattice(lat)
-            yield nl
+        for i in np.argsort(distortions, kind="mergesort"):
+            yield Lattice(matrices[i])
+
+    def _get_translations(self, s1, s2, frac_tol):
+        """
+        Finds the translations of s2 that may map it onto s1. The
+        translations bring each site in the first site group of s2 to the
+        origin. A translation is rejected if, for any site group, a
+        translated site of s2 is not within frac_tol of any site of s1, or
+        vice versa, which is a necessary condition for _cmp_struct.
+
+        The translations are evaluated together in one broadcast, in chunks
+        of increasing size, since one of the first translations often
+        matches, up to a size that limits the memory used.
+
+        Args:
+            s1:
+                List of arrays of fractional coordinates of the site groups
+                of the first structure.
+            s2:
+                List of arrays of fractional coordinates of the site groups
+                of the second structure.
+            frac_tol:
+                Fractional tolerance along each lattice vector.
+
+        Returns:
+            Generator of arrays of the indices of the sites in s2[0] giving
+            valid translations, in ascending order.
+        """
+        trans = s2[0]
+        max_chunk = max(1, _MAX_TRANSLATION_ELEMENTS //
+                        max([3 * len(c) ** 2 for c in s1]))
+        start, chunk = 0, 1
+        while start < len(trans):
+            inds = np.arange(start, min(start + chunk, len(trans)))
+            start, chunk = start + chunk, min(2 * chunk, max_chunk)
+            for s1_coords, s2_coords in zip(s1, s2):
+                t_s2 = np.mod(s2_coords[None, :] - trans[inds][:, None], 1)
+                dist = s1_coords[None, :, None] - t_s2[:, None, :]
+                close = np.all(np.abs(dist - np.round(dist)) <= frac_tol,
+                               axis=-1)
+                inds = inds[np.all(np.any(close, axis=1), axis=1) &
+                            np.all(np.any(close, axis=2), axis=1)]
+                if not len(inds):
+                    break
+            if len(inds):
+                yield inds
 
     def _cmp_struct(self, s1, s2, frac_tol):
-        #compares the fractional coordinates
+        """
+        Compares the fractional coordinates of s1 with those of several
+        translations of s2 at once. The sites of each site group of s1 and
+        s2 are matched with a linear assignment, where sites further apart
+        than frac_tol cannot be matched.
+
+        Args:
+            s1:
+                List of arrays of fractional coordinates of the site groups
+                of the first structure.
+            s2:
+                List of (k, n, 3) arrays of fractional coordinates of the
+                site groups of k translations of the second structure.
+            frac_tol:
+                Fractional tolerance along each lattice vector.
+
+        Returns:
+            Boolean array indicating which translations match.
+        """
+        valid = np.ones(len(s2[0]), dtype=np.bool)
         for s1_coords, s2_coords in zip(s1, s2):
-            dist = s1_coords[:, None] - s2_coords[None, :]
+            dist = s1_coords[None, :, None] - s2_coords[valid][:, None, :]
             dist = abs(dist - np.round(dist))
-            dist[np.where(dist > frac_tol[None, None, :])] = 3 * len(dist)
+            dist[np.where(dist > frac_tol)] = 3 * len(s1_coords)
             cost = np.sum(dist, axis=-1)
-            if np.max(np.min(cost, axis=0)) >= 3 * len(dist):
-                return False
-            lin = LinearAssignment(cost)
-            if lin.min_cost >= 3 * len(dist):
-                return False
-        return True
+            min_costs = batch_linear_assignment(cost)[1]
+            valid[valid] = min_costs < 3 * len(s1_coords)
+            if not np.any(valid):
+                break
+        return valid
 
     def _cmp_cartesian_struct(self, s1, s2, l1, l2):
         """
@@ -369,8 +531,9 @@ class StructureMatcher(MSONable):
         2) All sites are shifted by the mean
             displacement vector between matched sites.
         3) calculate distances
-        4) return rms distance normalized by (V/Natom) ^ 1/3
-            and the maximum distance found
+        4) return rms distance normalized by (V/Natom) ^ 1/3,
+            the maximum distance found and the index of the site of s2
+            matched to each site of s1
         """
         nsites = sum([len(i) for i in s1])
 
@@ -401,7 +564,7 @@ class StructureMatcher(MSONable):
 
         max_dist = np.max(shortest_vec_square) ** 0.5 / norm_length
 
-        return rms, max_dist
+        return rms, max_dist, lin.solution
 
     def fit(self, struct1, struct2):
         """
@@ -417,7 +580,14 @@ class StructureMatcher(MSONable):
             True or False.
         """
 
-        fit_dist = self._calc_rms(struct1, struct2, break_on_match=True)
+        return self._fit_prepared(self._prepare(struct1),
+                                  self._prepare(struct2))
+
+    def _fit_prepared(self, prep1, prep2):
+        """
+        Same as fit, but for structures preprocessed with _prepare.
+        """
+        fit_dist = self._calc_rms_prepared(prep1, prep2, break_on_match=True)
 
         if fit_dist is None:
             return False
@@ -461,109 +631,187 @@ class StructureMatcher(MSONable):
             rms displacement normalized by (Vol / nsites) ** (1/3) and
             maximum distance found between two paired sites
         """
-        stol = self.stol
-        comparator = self._comparator
-        if comparator.get_structure_hash(struct1) !=\
-                comparator.get_structure_hash(struct2):
+        return self._calc_rms_prepared(self._prepare(struct1),
+                                       self._prepare(struct2),
+                                       break_on_match)
+
+    def _calc_rms_prepared(self, prep1, prep2, break_on_match):
+        """
+        Same as _calc_rms, but for structures preprocessed with _prepare.
+        """
+        if prep1.hash != prep2.hash:
             return None
 
-        #primitive cell transformation
-        if self._primitive_cell and struct1.num_sites != struct2.num_sites:
-            struct1 = struct1.get_primitive_structure()
-            struct2 = struct2.get_primitive_structure()
+        stored_rms = None
+        for rms, max_dist, site_map in self._get_alignments(
+                prep1, prep2, self._comparator):
+            if break_on_match and max_dist < self.stol:
+                return max_dist
+            elif stored_rms is None or rms < stored_rms[0]:
+                stored_rms = [rms, max_dist]
 
-        # Same number of sites
-        if struct1.num_sites != struct2.num_sites:
+        if break_on_match:
             return None
-        #initial stored rms
-        stored_rms = None
+        else:
+            return stored_rms
+
+    def _get_alignments(self, prep1, prep2, comparator):
+        """
+        Generates the alignments of two prepared structures which pass the
+        comparison of the fractional coordinates, i.e., the candidate fits.
+        If the structures have different numbers of sites, they are first
+        reduced to their primitive cells.
+
+        Args:
+            prep1:
+                1st _PreparedStructure
+            prep2:
+                2nd _PreparedStructure
+            comparator:
+                Comparator used to match the site groups of prep2 to those
+                of prep1.
+
+        Returns:
+            Generator of (rms, max_dist, site_map), where rms and max_dist
+            are as in get_rms_dist, and site_map is an array of the index
+            of the site of the reduced structure of prep2 matched to each
+            site of the reduced structure of prep1. If the structures were
+            reduced to their primitive cells, the indices are those of the
+            reduced primitive structures.
+        """
+        stol = self.stol
+
+        #primitive cell transformation
+        if self._primitive_cell and prep1.num_sites != prep2.num_sites:
+            prep1 = prep1.primitive
+            prep2 = prep2.primitive
 
-        # Get niggli reduced cells. Though technically not necessary, this
-        # minimizes cell lengths and speeds up the matching of skewed
-        # cells considerably.
-        struct1 = struct1.get_reduced_structure(reduction_algo="niggli")
-        struct2 = struct2.get_reduced_structure(reduction_algo="niggli")
+        # Same number of sites
+        if prep1.num_sites != prep2.num_sites:
+            return
 
-        nl1 = struct1.lattice
-        nl2 = struct2.lattice
+        # The lattices of the prepared structures are niggli reduced. Though
+        # technically not necessary, this minimizes cell lengths and speeds
+        # up the matching of skewed cells considerably.
+        nl1 = prep1.lattice
+        nl2 = prep2.lattice
 
         #rescale lattice to same volume
         if self._scale:
             scale_vol = (nl2.volume / nl1.volume) ** (1 / 6)
-            se1 = StructureEditor(struct1)
             nl1 = Lattice(nl1.matrix * scale_vol)
-            se1.modify_lattice(nl1)
-            struct1 = se1.modified_structure
-            se2 = StructureEditor(struct2)
             nl2 = Lattice(nl2.matrix / scale_vol)
-            se2.modify_lattice(nl2)
-            struct2 = se2.modified_structure
 
         #Volume to determine invalid lattices
         vol_tol = nl2.volume / 2
 
         #fractional tolerance of atomic positions (2x for initial fitting)
         frac_tol = (2 / (1 - self.ltol)) * \
-            np.array([stol / i for i in struct1.lattice.abc]) * \
+            np.array([stol / i for i in nl1.abc]) * \
                    ((nl1.volume + nl2.volume) /
-                    (2 * struct1.num_sites)) ** (1.0 / 3)
-        #generate structure coordinate lists
-        species_list = []
-        s1 = []
-        for site in struct1:
-            found = False
-            for i, species in enumerate(species_list):
-                if comparator.are_equal(site.species_and_occu, species):
-                    found = True
-                    s1[i].append(site.frac_coords)
-                    break
-            if not found:
-                s1.append([site.frac_coords])
-                species_list.append(site.species_and_occu)
-
-        zipped = sorted(zip(s1, species_list), key=lambda x: len(x[0]))
-
-        s1 = [x[0] for x in zipped]
-        species_list = [x[1] for x in zipped]
-        s2_cart = [[] for i in s1]
-
-        for site in struct2:
-            found = False
-            for i, species in enumerate(species_list):
-                if comparator.are_equal(site.species_and_occu, species):
-                    found = True
-                    s2_cart[i].append(site.coords)
+                    (2 * prep1.num_sites)) ** (1.0 / 3)
+        #generate structure coordinate lists, with the site groups of the
+        #first structure sorted by size
+        order = sorted(range(len(prep1.species_list)),
+                       key=lambda i: len(prep1.groups[i]))
+        s1 = [prep1.frac_coords[prep1.groups[i]] for i in order]
+        species_list = [prep1.species_list[i] for i in order]
+        s2_inds = [[] for i in s1]
+
+        for species, inds in zip(prep2.species_list, prep2.groups):
+            for i, sp in enumerate(species_list):
+                if comparator.are_equal(species, sp):
+                    s2_inds[i].extend(inds)
                     break
-            #if no site match found return None
-            if not found:
-                return None
+            #if no site match found, there is no alignment
+            else:
+                return
+        s2_inds = [sorted(inds) for inds in s2_inds]
+        s2_cart = [nl2.get_cartesian_coords(prep2.frac_coords[inds])
+                   for inds in s2_inds]
 
         #check that sizes of the site groups are identical
         for f1, c2 in zip(s1, s2_cart):
             if len(f1) != len(c2):
-                return None
+                return
+
+        #indices of the sites in the concatenated site groups
+        s1_order = np.array([i for j in order for i in prep1.groups[j]],
+                            dtype=np.int)
+        s2_order = np.array([i for inds in s2_inds for i in inds],
+                            dtype=np.int)
 
         #translate s1
         s1_translation = s1[0][0]
         for i in range(len(species_list)):
             s1[i] = np.mod(s1[i] - s1_translation, 1)
         #do permutations of vectors, check for equality
-        for nl in self._get_lattices(struct1, struct2, vol_tol):
+        for nl in self._get_lattices(nl1, nl2, vol_tol):
             s2 = [nl.get_fractional_coords(c) for c in s2_cart]
-            for coord in s2[0]:
-                t_s2 = [np.mod(coords - coord, 1) for coords in s2]
-                if self._cmp_struct(s1, t_s2, frac_tol):
-                    rms, max_dist = self._cmp_cartesian_struct(s1, t_s2, nl,
-                                                               nl1)
-                    if break_on_match and max_dist < stol:
-                        return max_dist
-                    elif stored_rms is None or rms < stored_rms[0]:
-                        stored_rms = [rms, max_dist]
+            for inds in self._get_translations(s1, s2, frac_tol):
+                trans = s2[0][inds]
+                t_s2 = [np.mod(coords[None, :] - trans[:, None], 1)
+                        for coords in s2]
+                for i in np.where(self._cmp_struct(s1, t_s2, frac_tol))[0]:
+                    rms, max_dist, solution = self._cmp_cartesian_struct(
+                        s1, [coords[i] for coords in t_s2], nl, nl1)
+                    site_map = np.zeros(prep1.num_sites, dtype=np.int)
+                    site_map[s1_order] = s2_order[solution]
+                    yield rms, max_dist, site_map
+
+    def _prepare(self, structure):
+        """
+        Returns the structure preprocessed for matching. The preprocessed
+        structures of recently matched structures are cached, so that
+        matching one structure against many others only preprocesses it
+        once. Structures are immutable, and are cached by identity.
 
-        if break_on_match:
-            return None
-        else:
-            return stored_rms
+        Args:
+            structure:
+                A structure
+
+        Returns:
+            _PreparedStructure
+        """
+        cache = self.__dict__.setdefault("_prepared_cache",
+                                         collections.OrderedDict())
+        key = id(structure)
+        if key in cache:
+            prep = cache.pop(key)
+            if prep.structure is structure:
+                cache[key] = prep
+                return prep
+        prep = _PreparedStructure(structure, self._comparator)
+        cache[key] = prep
+        while len(cache) > self.prepared_cache_size:
+            cache.popitem(last=False)
+        return prep
+
+    def __getstate__(self):
+        #The cache of preprocessed structures is not pickled.
+        d = dict(self.__dict__)
+        d.pop("_prepared_cache", None)
+        return d
+
+    def find_matches(self, structure, candidates):
+        """
+        Finds the candidate structures that match a structure. This is much
+        faster than calling fit for each candidate, since candidates are
+        discarded based on invariants of their lattices before fitting. To
+        query the same candidates repeatedly, build a StructureIndex
+        instead.
+
+        Args:
+            structure:
+                The structure to match.
+            candidates:
+                Sequence of candidate structures.
+
+        Returns:
+            Sorted list of the indices of the candidates c for which
+            fit(structure, c) is True.
+        """
+        return StructureIndex(candidates, self).find_matches(structure)
 
     def find_indexes(self, s_list, group_list):
         """
@@ -584,14 +832,27 @@ class StructureMatcher(MSONable):
                     break
         return inds
 
-    def group_structures(self, s_list):
+    def group_structures(self, s_list, n_jobs=1):
         """
         Given a list of structures, use fit to group
         them by structural equality.
 
+        Structures are first pre-grouped by the structure hash of the
+        comparator. Within each pre-group, invariants of the lattices and
+        the structure fingerprints of the comparator are computed once for
+        every structure and used to discard pairs of structures that cannot
+        possibly match, so that fit is only called on the remaining pairs.
+        Matched pairs are joined with a union-find.
+
         Args:
             s_list:
                 List of structures to be grouped
+            n_jobs:
+                Number of processes to use. The pre-groups, and blocks of
+                candidate pairs within large pre-groups, are matched in
+                parallel, and the result is identical to that of serial
+                matching. Defaults to 1, i.e., serial processing. None or a
+                negative number uses all cpus.
 
         Returns:
             A list of lists of matched structures
@@ -600,21 +861,258 @@ class StructureMatcher(MSONable):
         """
         #Use structure hash to pre-group structures.
         sorted_s_list = sorted(s_list, key=self._comparator.get_structure_hash)
-        all_groups = []
+        buckets = [list(g) for k, g in itertools.groupby(
+            sorted_s_list, key=self._comparator.get_structure_hash)]
 
         #For each pre-grouped list of structures, perform actual matching.
-        for k, g in itertools.groupby(sorted_s_list,
-                                      key=self._comparator.get_structure_hash):
-            g = list(g)
-            group_list = [[g[0]]]
-            for i, j in itertools.combinations(range(len(g)), 2):
-                s1_ind, s2_ind = self.find_indexes([g[i], g[j]], group_list)
-                if s2_ind == -1 and self.fit(g[i], g[j]):
-                    group_list[s1_ind].append(g[j])
-                elif (j - i) == 1 and s2_ind == -1:
-                    group_list.append([g[j]])
-            all_groups.extend(group_list)
-        return all_groups
+        if n_jobs == 1:
+            bucket_groups = [self._group_indices(g) for g in buckets]
+        else:
+            bucket_groups = self._group_indices_parallel(buckets, n_jobs)
+        return [[g[i] for i in inds]
+                for g, groups in zip(buckets, bucket_groups)
+                for inds in groups]
+
+    def _group_indices(self, structures):
+        """
+        Groups structures by structural equality.
+
+        Args:
+            structures:
+                List of structures.
+
+        Returns:
+            List of lists of indices of matched structures. The groups are
+            ordered by their first index and the indices in each group are
+            sorted.
+        """
+        prepared = [_PreparedStructure(s, self._comparator)
+                    for s in structures]
+        matches = self._match_pairs(prepared,
+                                    self._get_candidate_pairs(prepared))
+        return _get_connected_components(len(structures), matches)
+
+    def _group_indices_parallel(self, buckets, n_jobs):
+        """
+        Same as calling _group_indices on each bucket of structures, using
+        a pool of n_jobs processes. Small buckets are grouped in one task
+        each. For large buckets, the candidate pairs are found in this
+        process and fitted in blocks in parallel. Structures are sent to the
+        workers with _encode_structure.
+        """
+        import multiprocessing as mp
+        pool = mp.Pool(n_jobs if n_jobs > 0 else None)
+        tasks = []
+        try:
+            for g in buckets:
+                if len(g) < self.parallel_bucket_size:
+                    args = (self, [_encode_structure(s) for s in g])
+                    tasks.append(pool.apply_async(_group_worker, (args, )))
+                    continue
+                prepared = [_PreparedStructure(s, self._comparator)
+                            for s in g]
+                pairs = self._get_candidate_pairs(prepared)
+                encoded = {}
+                blocks = []
+                while True:
+                    block = list(itertools.islice(pairs,
+                                                  self.parallel_block_size))
+                    if not block:
+                        break
+                    for i in set(itertools.chain(*block)):
+                        if i not in encoded:
+                            encoded[i] = _encode_structure(g[i])
+                    args = (self, {i: encoded[i]
+                                   for i in set(itertools.chain(*block))},
+                            block)
+                    blocks.append(pool.apply_async(_match_pairs_worker,
+                                                   (args, )))
+                tasks.append(blocks)
+
+            bucket_groups = []
+            for g, task in zip(buckets, tasks):
+                if isinstance(task, list):
+                    matches = itertools.chain(*[b.get() for b in task])
+                    bucket_groups.append(_get_connected_components(len(g),
+                                                                   matches))
+                else:
+                    bucket_groups.append(task.get())
+        finally:
+            pool.close()
+            pool.join()
+        return bucket_groups
+
+    def _get_candidate_pairs(self, prepared):
+        """
+        Finds the pairs of structures that may match, using the lattice
+        invariants and the fingerprints of the structures.
+
+        Args:
+            prepared:
+                List of _PreparedStructure.
+
+        Returns:
+            Generator of pairs of indices (i, j), with i < j, ordered by j
+            and then by i.
+        """
+        structures = [p.structure for p in prepared]
+        nsites = np.array([s.num_sites for s in structures])
+        invariants = [(nsites, ) + self._get_lattice_invariants(structures)]
+        #fit only reduces structures to primitive cells if the number of
+        #sites differ.
+        if self._primitive_cell and len(set(nsites)) > 1:
+            prims = [p.primitive for p in prepared]
+            invariants.append((np.array([p.num_sites for p in prims]), ) +
+                              self._get_lattice_invariants(
+                                  [p.structure for p in prims]))
+
+        #Structures are indexed by the shortest lattice length to quickly
+        #find the candidates for each structure.
+        windows = [_get_window_index(lengths, vols, self.ltol)
+                   for sites, lengths, vols in invariants]
+        if self._use_fingerprints():
+            fingerprints = np.array([
+                self._comparator.get_structure_fingerprint(s)
+                for s in structures])
+
+        for j in xrange(1, len(structures)):
+            cands = set()
+            for (sites, lengths, vols), window in zip(invariants, windows):
+                inds = window(j)
+                inds = inds[(inds < j) & (sites[inds] == sites[j])]
+                inds = inds[self._lattices_may_match(lengths[inds],
+                                                     lengths[j], vols[j])]
+                cands.update(inds)
+            cands = np.array(sorted(cands), dtype=np.int)
+            if self._use_fingerprints():
+                cands = cands[self.fingerprints_may_match(
+                    fingerprints[cands], fingerprints[j])]
+            for i in cands:
+                yield i, j
+
+    def _match_pairs(self, prepared, pairs):
+        """
+        Fits pairs of structures. Pairs of structures which are already
+        connected by earlier matches are skipped, since they end up in the
+        same group regardless.
+
+        Args:
+            prepared:
+                Sequence or dict of _PreparedStructure.
+            pairs:
+                Sequence of pairs of indices (i, j).
+
+        Returns:
+            List of the matched pairs.
+        """
+        parents = {}
+        matches = []
+        for i, j in pairs:
+            ri, rj = _find_root(parents, i), _find_root(parents, j)
+            if ri != rj and self._fit_prepared(prepared[i], prepared[j]):
+                parents[max(ri, rj)] = min(ri, rj)
+                matches.append((i, j))
+        return matches
+
+    def _get_lattice_invariants(self, structures):
+        """
+        Computes invariants of the lattices of structures, which are used
+        to find pairs of structures that cannot match without calling fit.
+
+        Args:
+            structures:
+                List of structures.
+
+        Returns:
+            (lengths, volumes), where lengths is a (n, 3) array of the
+            lengths of the Niggli reduced lattices, which are the successive
+            minima of the lattices, in ascending order. If the structures are
+            scaled to the same volume before matching, the lengths are
+            normalized by the cube root of the volumes and all volumes are 1.
+        """
+        lattices = reduce_lattices([s.lattice for s in structures],
+                                   reduction_algo="niggli")
+        lengths = np.array([sorted(l.abc) for l in lattices]).reshape((-1, 3))
+        vols = np.array([l.volume for l in lattices])
+        if self._scale:
+            lengths /= vols[:, None] ** (1 / 3)
+            vols = np.ones(len(vols))
+        return lengths, vols
+
+    def _lattices_may_match(self, lengths1, lengths2, vol2):
+        """
+        Necessary condition for fit(struct1, struct2) to be True, based on
+        the invariants returned by _get_lattice_invariants. Broadcasts over
+        the leading dimensions of lengths1 and lengths2.
+
+        The lattice of struct2 is matched by lattice vectors which are
+        within ltol of the lengths of the Niggli reduced lattice of struct1.
+        The successive minima of the lattice of struct2 are therefore at
+        most (1 + ltol) times those of struct1, and their product is at
+        least the volume of the lattice of struct2.
+        """
+        upper = (1 + self.ltol) * (1 + _INVARIANT_TOL) * lengths1
+        lower = np.array(vol2)[..., None] / \
+            (upper[..., [1, 0, 0]] * upper[..., [2, 2, 1]])
+        return np.all((lengths2 <= upper) & (lengths2 >= lower), axis=-1)
+
+    def _get_distortion_factor(self):
+        """
+        Returns the largest factor by which distances can be stretched by
+        the distortion of the lattices within ltol and angle_tol, or None if
+        it is unbounded.
+        """
+        dev = self.ltol + np.radians(self.angle_tol)
+        if dev >= 1:
+            return None
+        return (1 + dev) / (1 - dev) * (1 + _INVARIANT_TOL)
+
+    def _use_fingerprints(self):
+        """
+        Whether fingerprints can discard pairs of structures at the
+        tolerances of the matcher. If the tolerance window on the normalized
+        distances is wider than their usual range, computing the
+        fingerprints is not worth the cost.
+        """
+        factor = self._get_distortion_factor()
+        return factor is not None and \
+            2 * factor * self.stol < _MAX_FINGERPRINT_WINDOW
+
+    def fingerprints_may_match(self, fp1, fp2):
+        """
+        Conservative necessary condition for fit(struct1, struct2) to be
+        True, based on the fingerprints returned by the
+        get_structure_fingerprint method of the comparator. Broadcasts over
+        the leading dimensions of fp1 and fp2.
+
+        Matched sites are at most stol apart in units of the cube root of
+        the volume per site, so the distance between two sites and the k-th
+        nearest neighbor distance of each site differ by at most 2 * stol
+        between matched structures, on top of the distortion of the
+        lattices within ltol and angle_tol. The same holds for their
+        minimum, maximum and average over the sites. If the structures are
+        not scaled, the volumes per site are compared too.
+
+        Args:
+            fp1:
+                Fingerprint(s) of the first structure(s).
+            fp2:
+                Fingerprint(s) of the second structure(s).
+
+        Returns:
+            Boolean (array) which is False if the structures cannot match.
+        """
+        fp1, fp2 = np.asarray(fp1), np.asarray(fp2)
+        factor = self._get_distortion_factor()
+        if factor is None:
+            return np.ones(np.broadcast(fp1, fp2).shape[:-1], dtype=np.bool)
+        d1, d2 = fp1[..., 1:], fp2[..., 1:]
+        ok = np.all((d2 <= factor * (d1 + 2 * self.stol)) &
+                    (d1 <= factor * (d2 + 2 * self.stol)), axis=-1)
+        if not self._scale:
+            v1, v2 = fp1[..., 0], fp2[..., 0]
+            ok &= (v2 <= factor ** 3 * v1) & (v1 <= factor ** 3 * v2)
+        return ok
 
     @property
     def to_dict(self):
@@ -656,6 +1154,17 @@ class StructureMatcher(MSONable):
             Note that the return form is a list of pairs of species and
             occupancy dicts. This complicated return for is necessary because
             species and occupancy dicts are non-hashable.
+
+        Instead of fitting the structures for every permutation of the
+        species, the structures are first aligned regardless of the
+        species, as with a FrameworkComparator. Each alignment within stol
+        pairs the sites of the two structures, which gives at most one
+        candidate species mapping, and these candidates are fitted first.
+        If the structures cannot be aligned regardless of the species, they
+        cannot match. Sites of different species which are close together
+        can be paired across species by the alignments, so if none of the
+        candidates fit, the one-to-one mappings made of the pairs of species
+        seen in the alignments are fitted.
         """
         sp1 = list(set(struct1.species_and_occu))
         sp2 = list(set(struct2.species_and_occu))
@@ -663,17 +1172,393 @@ class StructureMatcher(MSONable):
         if len(sp1) != len(sp2):
             return None
 
-        for perm in itertools.permutations(sp2):
-            perm = list(perm)
-            mapped_sp = []
-            for site in struct1:
-                ind = sp1.index(site.species_and_occu)
-                mapped_sp.append(perm[ind])
+        prep1 = self._prepare(struct1)
+        prep2 = self._prepare(struct2)
+        if len(sp1) == 1:
+            if self._fit_prepared(prep1.relabel([(sp1[0], sp2[0])]), prep2):
+                return {sp1[0]: sp2[0]} if sp1[0] != sp2[0] else {}
+            return None
+
+        #The species pairs of all the alignments are collected while the
+        #candidates are generated.
+        pairs = set()
+        tried = set()
+        for mapping in self._get_anonymous_mappings(prep1, prep2, pairs):
+            tried.add(frozenset(mapping))
+            if self._fit_prepared(prep1.relabel(mapping), prep2):
+                return {old_sp: sp for old_sp, sp in mapping if old_sp != sp}
+
+        for mapping in _get_perfect_matchings(sp1, sp2, pairs):
+            if frozenset(mapping) in tried:
+                continue
+            tried.add(frozenset(mapping))
+            if self._fit_prepared(prep1.relabel(mapping), prep2):
+                return {old_sp: sp for old_sp, sp in mapping if old_sp != sp}
+
+        return None
+
+    def _get_anonymous_mappings(self, prep1, prep2, pairs=None):
+        """
+        Generates the candidate species mappings for fit_anonymous from the
+        alignments of the two structures regardless of their species.
 
-            transformed_structure = Structure(struct1.lattice, mapped_sp,
-                                              struct1.frac_coords)
-            if self.fit(transformed_structure, struct2):
-                return {sp1[i]: perm[i] for i in xrange(len(sp1))
-                        if sp1[i] != perm[i]}
+        Args:
+            prep1:
+                1st _PreparedStructure
+            prep2:
+                2nd _PreparedStructure
+            pairs:
+                Optional set, to which the (species of prep1, species of
+                prep2) pairs of the sites paired by any alignment within
+                stol are added.
+
+        Returns:
+            Generator of distinct lists of (species of prep1, species of
+            prep2) pairs, which map the species one-to-one.
+        """
+        #The primitive cells are shared with the prepared structures, which
+        #are fitted afterwards.
+        if self._primitive_cell and prep1.num_sites != prep2.num_sites:
+            prep1, prep2 = prep1.primitive, prep2.primitive
+            if prep1.num_sites != prep2.num_sites:
+                return
+        framework = FrameworkComparator()
+        frame1 = _PreparedStructure(prep1.structure, framework,
+                                    prep1.reduced_structure)
+        frame2 = _PreparedStructure(prep2.structure, framework,
+                                    prep2.reduced_structure)
+        species1 = frame1.reduced_structure.species_and_occu
+        species2 = frame2.reduced_structure.species_and_occu
+
+        tried = set()
+        for rms, max_dist, site_map in self._get_alignments(frame1, frame2,
+                                                            framework):
+            if max_dist >= self.stol:
+                continue
+            mapping = []
+            for i, j in enumerate(site_map):
+                pair = (species1[i], species2[j])
+                if pair not in mapping:
+                    mapping.append(pair)
+            if pairs is not None:
+                pairs.update(mapping)
+            #Each species must be mapped to exactly one species.
+            if len(set([sp for sp, new_sp in mapping])) != len(mapping) or \
+                    len(set([sp for old_sp, sp in mapping])) != len(mapping):
+                continue
+            if frozenset(mapping) not in tried:
+                tried.add(frozenset(mapping))
+                yield mapping
+
+
+class StructureIndex(object):
+    """
+    An index over a set of reference structures for finding the reference
+    structures that match a query structure. The reference structures are
+    bucketed by the structure hash of the comparator and their lattice
+    invariants and fingerprints are computed once when the index is built,
+    so that each query only fits the references that can possibly match.
+    """
+
+    def __init__(self, structures, matcher=None):
+        """
+        Args:
+            structures:
+                Sequence of reference structures.
+            matcher:
+                The StructureMatcher used for matching. Defaults to a
+                StructureMatcher with default parameters.
+        """
+        self.matcher = matcher if matcher is not None else StructureMatcher()
+        self.structures = list(structures)
+        self._prepared = [None] * len(self.structures)
+
+        get_hash = self.matcher._comparator.get_structure_hash
+        buckets = collections.defaultdict(list)
+        for i, s in enumerate(self.structures):
+            buckets[get_hash(s)].append(i)
+
+        #For each bucket, the indices, fingerprints (None if the matcher
+        #does not use them), number of sites and lattice invariants of the
+        #structures and, lazily, of the primitive structures.
+        get_fingerprint = self.matcher._comparator.get_structure_fingerprint
+        self._buckets = {}
+        for k, inds in buckets.items():
+            structures = [self.structures[i] for i in inds]
+            fingerprints = np.array([get_fingerprint(s) for s in structures]) \
+                if self.matcher._use_fingerprints() else None
+            lengths, vols = self.matcher._get_lattice_invariants(structures)
+            nsites = np.array([s.num_sites for s in structures])
+            self._buckets[k] = (np.array(inds), fingerprints, nsites, lengths,
+                                vols, np.zeros(len(inds), dtype=np.int),
+                                np.zeros((len(inds), 3)),
+                                np.zeros(len(inds)))
+
+    def __len__(self):
+        return len(self.structures)
+
+    def _get_prepared(self, i):
+        if self._prepared[i] is None:
+            self._prepared[i] = _PreparedStructure(
+                self.structures[i], self.matcher._comparator)
+        return self._prepared[i]
+
+    def find_matches(self, structure):
+        """
+        Finds the reference structures that match a structure.
 
-        return None
\ No newline at end of file
+        Args:
+            structure:
+                The structure to match.
+
+        Returns:
+            Sorted list of the indices of the reference structures s for
+            which matcher.fit(structure, s) is True.
+        """
+        matcher = self.matcher
+        prep = matcher._prepare(structure)
+        if prep.hash not in self._buckets:
+            return []
+        (inds, fingerprints, nsites, lengths, vols, prim_nsites, prim_lengths,
+         prim_vols) = self._buckets[prep.hash]
+
+        same = nsites == prep.num_sites
+        lengths1, vols1 = matcher._get_lattice_invariants([structure])
+        cands = same & matcher._lattices_may_match(lengths1[0], lengths, vols)
+
+        #fit only reduces structures to primitive cells if the number of
+        #sites differ.
+        if matcher._primitive_cell and not np.all(same):
+            todo = np.where(np.logical_not(same) & (prim_nsites == 0))[0]
+            if len(todo):
+                prims = [self._get_prepared(inds[i]).primitive.structure
+                         for i in todo]
+                prim_nsites[todo] = [s.num_sites for s in prims]
+                prim_lengths[todo], prim_vols[todo] = \
+                    matcher._get_lattice_invariants(prims)
+            prim = prep.primitive
+            lengths1, vols1 = matcher._get_lattice_invariants([prim.structure])
+            cands |= np.logical_not(same) & \
+                (prim_nsites == prim.num_sites) & \
+                matcher._lattices_may_match(lengths1[0], prim_lengths,
+                                            prim_vols)
+
+        if fingerprints is not None:
+            cands &= matcher.fingerprints_may_match(
+                fingerprints, matcher._comparator.get_structure_fingerprint(
+                    structure))
+        return sorted([i for i in inds[cands]
+                       if matcher._fit_prepared(prep, self._get_prepared(i))])
+
+
+class _PreparedStructure(object):
+    """
+    A structure preprocessed for matching, i.e., with the Niggli reduced
+    lattice, the fractional coordinates in the reduced lattice and the
+    indices of the sites in each group of equal species according to a
+    comparator. The primitive structure is prepared on demand.
+    """
+
+    def __init__(self, structure, comparator, reduced_structure=None):
+        """
+        Args:
+            structure:
+                The structure to prepare.
+            comparator:
+                The comparator used to group the species.
+            reduced_structure:
+                The Niggli reduced structure, if already available.
+        """
+        self.structure = structure
+        self.comparator = comparator
+        self.hash = comparator.get_structure_hash(structure)
+        self.num_sites = structure.num_sites
+        if reduced_structure is None:
+            reduced_structure = structure.get_reduced_structure(
+                reduction_algo="niggli")
+        self.reduced_structure = reduced_structure
+        self.lattice = reduced_structure.lattice
+        self.frac_coords = reduced_structure.frac_coords
+        self._primitive = None
+
+        #Species of ordered sites are shared, so the comparator is only
+        #called once for each distinct species object.
+        self.species_list = []
+        self.groups = []
+        group_ids = {}
+        for i, sp in enumerate(reduced_structure.species_and_occu):
+            ind = group_ids.get(id(sp))
+            if ind is None:
+                for ind, species in enumerate(self.species_list):
+                    if comparator.are_equal(sp, species):
+                        break
+                else:
+                    ind = len(self.species_list)
+                    self.species_list.append(sp)
+                    self.groups.append([])
+                group_ids[id(sp)] = ind
+            self.groups[ind].append(i)
+
+    @property
+    def primitive(self):
+        """
+        The prepared primitive structure.
+        """
+        if self._primitive is None:
+            self._primitive = _PreparedStructure(
+                self.structure.get_primitive_structure(), self.comparator)
+        return self._primitive
+
+    def relabel(self, mapping):
+        """
+        Returns the prepared structure with the species replaced, without
+        redoing the lattice reduction.
+
+        Args:
+            mapping:
+                Sequence of (old species, new species) pairs, where species
+                are species and occupancy dicts.
+        """
+        def relabel_structure(s):
+            species = [sp for old_sp in s.species_and_occu
+                       for sp1, sp in mapping if sp1 == old_sp]
+            return Structure(s.lattice, species, s.frac_coords)
+
+        prep = _PreparedStructure(
+            relabel_structure(self.structure), self.comparator,
+            relabel_structure(self.reduced_structure))
+        if self._primitive is not None:
+            prep._primitive = self._primitive.relabel(mapping)
+        return prep
+
+
+def _get_perfect_matchings(sp1, sp2, pairs):
+    """
+    Generates the one-to-one mappings of the species sp1 to the species sp2
+    which only use the allowed (species of sp1, species of sp2) pairs.
+
+    Args:
+        sp1:
+            List of species.
+        sp2:
+            List of species, with the same length as sp1.
+        pairs:
+            Set of allowed pairs.
+
+    Returns:
+        Generator of lists of (species of sp1, species of sp2) pairs.
+    """
+    allowed = [[sp for sp in sp2 if (old_sp, sp) in pairs] for old_sp in sp1]
+    #Species with the fewest choices are assigned first.
+    order = sorted(range(len(sp1)), key=lambda i: len(allowed[i]))
+
+    def assign(k, used):
+        if k == len(order):
+            yield []
+            return
+        i = order[k]
+        for sp in allowed[i]:
+            if sp not in used:
+                used.add(sp)
+                for rest in assign(k + 1, used):
+                    yield [(sp1[i], sp)] + rest
+                used.remove(sp)
+
+    return assign(0, set())
+
+
+def _find_root(parents, i):
+    """
+    Finds the root of i in a union-find forest stored as a dict of parents,
+    with path halving.
+    """
+    while parents.get(i, i) != i:
+        parents[i] = parents.get(parents[i], parents[i])
+        i = parents[i]
+    return i
+
+
+def _get_connected_components(n, pairs):
+    """
+    Returns the connected components of the graph with n nodes and the
+    edges in pairs, as lists of sorted node indices ordered by their
+    smallest index.
+    """
+    parents = {}
+    for i, j in pairs:
+        ri, rj = _find_root(parents, i), _find_root(parents, j)
+        if ri != rj:
+            parents[max(ri, rj)] = min(ri, rj)
+    groups = collections.OrderedDict()
+    for i in xrange(n):
+        groups.setdefault(_find_root(parents, i), []).append(i)
+    return groups.values()
+
+
+def _encode_structure(structure):
+    """
+    Encodes a structure in a compact, picklable form for sending to worker
+    processes. The lattice and coordinates are sent as arrays, and each
+    distinct species only once.
+    """
+    species = []
+    ids = {}
+    inds = []
+    for sp in structure.species_and_occu:
+        if id(sp) not in ids:
+            ids[id(sp)] = len(species)
+            species.append([(k.to_dict, v) for k, v in sp.items()])
+        inds.append(ids[id(sp)])
+    return (structure.lattice.matrix, species, np.array(inds, dtype=np.int),
+            structure.frac_coords, dict(structure.site_properties))
+
+
+def _decode_structure(encoded):
+    """
+    Reconstitutes a structure encoded with _encode_structure.
+    """
+    matrix, species, inds, frac_coords, props = encoded
+    decoder = PMGJSONDecoder()
+    species = [{decoder.process_decoded(d): v for d, v in sp}
+               for sp in species]
+    return Structure(Lattice(matrix), [species[i] for i in inds],
+                     frac_coords, site_properties=props)
+
+
+def _group_worker(args):
+    matcher, encoded = args
+    return matcher._group_indices([_decode_structure(e) for e in encoded])
+
+
+def _match_pairs_worker(args):
+    matcher, encoded, pairs = args
+    prepared = {i: _PreparedStructure(_decode_structure(e),
+                                      matcher._comparator)
+                for i, e in encoded.items()}
+    return matcher._match_pairs(prepared, pairs)
+
+
+def _get_window_index(lengths, vols, ltol):
+    """
+    Returns a function that gives the indices of the structures whose
+    invariants may allow them to be matched to structure j, i.e., with
+    fit(structures[i], structures[j]). The structures are sorted by the
+    shortest lattice length, which is bounded from below by the shortest
+    length of structure j. By Minkowski's second theorem, the product of
+    the successive minima of a lattice is at most sqrt(2) times its volume,
+    which gives an upper bound.
+    """
+    order = np.argsort(lengths[:, 0])
+    sorted_lengths = lengths[order, 0]
+    max_vol = np.max(vols) if len(vols) else 0
+    tol = (1 + ltol) * (1 + _INVARIANT_TOL)
+
+    def window(j):
+        lo = np.searchsorted(sorted_lengths, lengths[j, 0] / tol)
+        hi = np.searchsorted(sorted_lengths,
+                             2 ** 0.5 * tol ** 2 * max_vol /
+                             (lengths[j, 1] * lengths[j, 2]) *
+                             (1 + _INVARIANT_TOL), side="right")
+        return order[lo:hi]
+
+    return window
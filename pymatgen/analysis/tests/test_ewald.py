@@ -2,6 +2,8 @@ import unittest
 import os
 
 from pymatgen.core.structure_modifier import StructureEditor
+from pymatgen.core.structure import Structure
+from pymatgen.core.lattice import Lattice
 from pymatgen.analysis.ewald import EwaldSummation, EwaldMinimizer
 from pymatgen.io.vaspio.vasp_input import Poscar
 import numpy as np
@@ -64,6 +66,85 @@ class EwaldSummationTest(unittest.TestCase):
         self.assertAlmostEqual(ham2.real_space_energy, -354.91294268, 4,
                                "Real space energy incorrect!")
 
+    def test_no_real_space_neighbors(self):
+        s = Structure(Lattice.cubic(5), ["Na", "Cl"],
+                      [[0, 0, 0], [0.5, 0.5, 0.5]],
+                      site_properties={"charge": [1, -1]})
+        ham = EwaldSummation(s, real_space_cut=1.0)
+        self.assertEqual(ham.real_space_energy, 0)
+        self.assertTrue(np.all(np.isfinite(ham.forces)))
+
+    def test_compute_energies(self):
+        p = Poscar.from_file(os.path.join(test_dir, 'POSCAR'))
+        modifier = StructureEditor(p.structure)
+        modifier.add_oxidation_state_by_element({"Li": 1, "Fe": 2,
+                                                 "P": 5, "O": -2})
+        s = modifier.modified_structure
+        ham = EwaldSummation(s)
+        charges = np.array([site.specie.oxi_state for site in s])
+        self.assertAlmostEqual(ham.compute_energies(charges),
+                               ham.total_energy, 6)
+
+        modifier = StructureEditor(p.structure)
+        modifier.add_site_property('charge', 2 * charges)
+        ham2 = EwaldSummation(modifier.modified_structure)
+        removed = charges.copy()
+        removed[[0, 1]] = 0
+        energies = ham.compute_energies([charges, 2 * charges, removed])
+        self.assertAlmostEqual(energies[0], ham.total_energy, 6)
+        self.assertAlmostEqual(energies[1], ham2.total_energy, 6)
+        self.assertAlmostEqual(energies[2], ham.compute_partial_energy([0, 1]),
+                               6)
+
+        modifier = StructureEditor(s)
+        modifier.delete_site(0)
+        self.assertAlmostEqual(ham.compute_sub_structure(
+            modifier.modified_structure), ham.compute_partial_energy([0]), 6)
+        modifier.append_site("Li", [0.1234, 0.5, 0.5],
+                             validate_proximity=False)
+        self.assertRaises(ValueError, ham.compute_sub_structure,
+                          modifier.modified_structure)
+
+    def test_target_error(self):
+        p = Poscar.from_file(os.path.join(test_dir, 'POSCAR'))
+        #Neutral FePO4
+        modifier = StructureEditor(p.structure)
+        modifier.add_oxidation_state_by_element({"Fe": 3, "P": 5, "O": -2})
+        s = modifier.modified_structure
+        ham = EwaldSummation(s)
+        self.assertTrue(ham.estimated_error < 1e-4)
+        accurate = EwaldSummation(s, target_error=1e-4)
+        self.assertTrue(accurate.estimated_error <= 1e-4)
+        self.assertNotEqual(accurate.eta, ham.eta)
+        self.assertAlmostEqual(accurate.total_energy, ham.total_energy, 2)
+        fast = EwaldSummation(s, target_error=0.1)
+        self.assertTrue(fast.estimated_error <= 0.1)
+        self.assertEqual(fast.eta, accurate.eta)
+        self.assertTrue(fast.real_space_cut < accurate.real_space_cut)
+        self.assertTrue(fast.recip_space_cut < accurate.recip_space_cut)
+        self.assertTrue(abs(fast.total_energy - ham.total_energy) < 1)
+
+        #The energy of a charged cell depends on eta, which is kept.
+        modifier = StructureEditor(p.structure)
+        modifier.add_oxidation_state_by_element({"Fe": 2, "P": 5, "O": -2})
+        charged = modifier.modified_structure
+        ham = EwaldSummation(charged)
+        accurate = EwaldSummation(charged, target_error=1e-4)
+        self.assertEqual(accurate.eta, ham.eta)
+        self.assertAlmostEqual(accurate.total_energy, ham.total_energy, 2)
+
+        #The actual errors are within the targets.
+        fcc = np.array([[0, 0, 0], [0, 0.5, 0.5], [0.5, 0, 0.5],
+                        [0.5, 0.5, 0]])
+        nacl = Structure(Lattice.cubic(5.64), ["Na"] * 4 + ["Cl"] * 4,
+                         np.concatenate([fcc, fcc + 0.5]) % 1,
+                         site_properties={"charge": [1] * 4 + [-1] * 4})
+        for structure in [s, charged, nacl]:
+            reference = EwaldSummation(structure, acc_factor=12).total_energy
+            for target in [0.1, 1e-3, 1e-6]:
+                ham = EwaldSummation(structure, target_error=target)
+                self.assertTrue(abs(ham.total_energy - reference) <= target)
+
 
 class EwaldMinimizerTest(unittest.TestCase):
 
@@ -90,5 +171,28 @@ class EwaldMinimizerTest(unittest.TestCase):
         self.assertEqual(len(e_min.best_m_list), 6,
                          "Returned wrong number of permutations")
 
+        e_all = EwaldMinimizer(matrix, m_list, 1, EwaldMinimizer.ALGO_COMPLETE)
+        self.assertEqual(len(e_all.output_lists), 15)
+        sums = [l[0] for l in e_all.output_lists]
+        for algo in [EwaldMinimizer.ALGO_FAST, EwaldMinimizer.ALGO_BEST_FIRST,
+                     EwaldMinimizer.ALGO_TIME_LIMIT]:
+            e_min = EwaldMinimizer(matrix, m_list, 3, algo)
+            for l, s in zip(e_min.output_lists, sums[:3]):
+                self.assertAlmostEqual(l[0], s)
+            self.assertEqual(len(e_min.output_lists), 3)
+
+        #Manipulations which share indices.
+        shared = [[0, 2, [0, 1, 2, 3, 4], 'a'], [.5, 2, [2, 3, 4, 5, 6], 'b']]
+        e_all = EwaldMinimizer(matrix, shared, 1, EwaldMinimizer.ALGO_COMPLETE)
+        e_min = EwaldMinimizer(matrix, shared, 3)
+        for l, s in zip(e_min.output_lists, e_all.output_lists):
+            self.assertAlmostEqual(l[0], s[0])
+
+        #Out of budget, the best orderings found so far are returned.
+        e_min = EwaldMinimizer(matrix, m_list, 3, max_nodes=1)
+        self.assertEqual(e_min.num_nodes, 1)
+        self.assertEqual(len(e_min.output_lists), 3)
+        self.assertGreaterEqual(e_min.minimized_sum, sums[0] - 1e-8)
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,10 +1,11 @@
 import unittest
 import os
 import json
+import pickle
 import numpy as np
 
 from pymatgen.analysis.structure_matcher import StructureMatcher, \
-    ElementComparator, FrameworkComparator
+    ElementComparator, FrameworkComparator, StructureIndex
 from pymatgen.serializers.json_coders import PMGJSONDecoder
 from pymatgen.core.operations import SymmOp
 from pymatgen.core.structure_modifier import StructureEditor
@@ -12,6 +13,7 @@ from pymatgen.core.structure_modifier import SupercellMaker
 from pymatgen.io.smartio import read_structure
 from pymatgen.core.structure import Structure
 from pymatgen.core.composition import Composition
+from pymatgen.core.lattice import Lattice
 
 test_dir = os.path.join(os.path.dirname(__file__), "..", "..", "..",
                         'test_files')
@@ -83,6 +85,53 @@ class StructureMatcherTest(unittest.TestCase):
         self.assertEqual(sm.fit_anonymous(s1, s2),
                          {Composition("Fe0.5"): Composition("Fe0.25")})
 
+    def test_fit_anonymous(self):
+        sm = StructureMatcher()
+        lfp = read_structure(os.path.join(test_dir, "LiFePO4.cif"))
+
+        def relabel(mapping):
+            return Structure(lfp.lattice,
+                             [mapping[sp.symbol] for sp in lfp.species],
+                             lfp.frac_coords)
+
+        mapping = {"Li": "Na", "Fe": "Mn", "P": "As", "O": "S"}
+        self.assertEqual(sm.fit_anonymous(lfp, relabel(mapping)),
+                         {Composition(k): Composition(v)
+                          for k, v in mapping.items()})
+        #Li and Fe occupy the same number of sites, but not the same ones.
+        swapped = relabel({"Li": "Fe", "Fe": "Li", "P": "P", "O": "O"})
+        self.assertEqual(sm.fit_anonymous(lfp, swapped),
+                         {Composition("Li"): Composition("Fe"),
+                          Composition("Fe"): Composition("Li")})
+        self.assertIsNone(sm.fit_anonymous(lfp, self.struct_list[0]))
+
+        #Only the one-to-one mappings seen in the species-blind alignments
+        #are fitted for a non-matching quaternary pair, rather than all 24
+        #permutations of the species.
+        species = [sp.symbol for sp in lfp.species]
+        i, j = species.index("Li"), species.index("Fe")
+        species[i], species[j] = "Fe", "Li"
+        mapping = {"Li": "Na", "Fe": "Mn", "P": "As", "O": "S"}
+        partly_swapped = Structure(lfp.lattice,
+                                   [mapping[sp] for sp in species],
+                                   lfp.frac_coords)
+        calls = []
+        fit_prepared = sm._fit_prepared
+
+        def counting_fit(prep1, prep2):
+            calls.append(1)
+            return fit_prepared(prep1, prep2)
+
+        sm._fit_prepared = counting_fit
+        self.assertIsNone(sm.fit_anonymous(lfp, partly_swapped))
+        self.assertTrue(0 < len(calls) <= 2)
+        #Structures which cannot be aligned are not fitted at all.
+        del calls[:]
+        distorted = Structure(Lattice(lfp.lattice.matrix * [1.5, 1, 1]),
+                              partly_swapped.species, lfp.frac_coords)
+        self.assertIsNone(sm.fit_anonymous(lfp, distorted))
+        self.assertEqual(len(calls), 0)
+
     def test_oxi(self):
         """Test oxidation state removal matching"""
         sm = StructureMatcher()
@@ -121,6 +170,164 @@ class StructureMatcherTest(unittest.TestCase):
             else:
                 self.assertEqual(len(g), 1)
 
+    def test_lattice_invariants(self):
+        sm = StructureMatcher()
+        lengths, vols = sm._get_lattice_invariants(self.struct_list)
+        #Every pair of structures that fits must pass the prefilter.
+        for i, s1 in enumerate(self.struct_list):
+            for j, s2 in enumerate(self.struct_list):
+                if i != j and len(s1) == len(s2) and sm.fit(s1, s2):
+                    self.assertTrue(sm._lattices_may_match(
+                        lengths[i], lengths[j], vols[j]))
+        mask = sm._lattices_may_match(lengths, lengths[3], vols[3])
+        self.assertTrue(mask[3])
+        self.assertFalse(np.all(mask))
+
+        #Supercells are grouped with the original structure.
+        s = self.struct_list[3]
+        sc = SupercellMaker(s, [[1, 1, 0], [0, 1, 0], [0, 0, 2]])
+        groups = sm.group_structures([s, self.struct_list[4],
+                                      sc.modified_structure])
+        self.assertEqual([len(g) for g in groups], [2, 1])
+
+    def test_fingerprints(self):
+        sm = StructureMatcher()
+        comparator = sm._comparator
+        fps = np.array([comparator.get_structure_fingerprint(s)
+                        for s in self.struct_list])
+        self.assertEqual(fps.shape, (len(self.struct_list), 11))
+        #Every pair of structures that fits must pass the prefilter.
+        for i, s1 in enumerate(self.struct_list):
+            for j, s2 in enumerate(self.struct_list):
+                if i != j and sm.fit(s1, s2):
+                    self.assertTrue(sm.fingerprints_may_match(fps[i], fps[j]))
+
+        #The fingerprint is unchanged in a supercell.
+        s = self.struct_list[3]
+        sc = SupercellMaker(s, [[1, 1, 0], [0, 1, 0], [0, 0, 2]])
+        self.assertTrue(np.allclose(
+            comparator.get_structure_fingerprint(sc.modified_structure),
+            fps[3]))
+
+        #Tight tolerances discard structures with different volumes.
+        sm = StructureMatcher(ltol=0.05, stol=0.05, angle_tol=1, scale=False)
+        s2 = Structure(Lattice(s.lattice.matrix * 1.2), s.species,
+                       s.frac_coords)
+        fp2 = comparator.get_structure_fingerprint(s2)
+        self.assertTrue(sm.fingerprints_may_match(fps[3], fps[3]))
+        self.assertFalse(sm.fingerprints_may_match(fps[3], fp2))
+        self.assertEqual(list(sm.fingerprints_may_match(fps, fps[3])),
+                         [sm.fingerprints_may_match(fp, fps[3])
+                          for fp in fps])
+
+    def test_fingerprints_polymorphs(self):
+        #Rocksalt, CsCl and zincblende NaCl with the same nearest neighbor
+        #distance, and slightly distorted copies of them.
+        fcc = np.array([[0, 0, 0], [0, 0.5, 0.5], [0.5, 0, 0.5],
+                        [0.5, 0.5, 0]])
+        rocksalt = Structure(Lattice.cubic(6), ["Na"] * 4 + ["Cl"] * 4,
+                             np.concatenate([fcc, fcc + 0.5]) % 1)
+        cscl = Structure(Lattice.cubic(2 * 3 / 3 ** 0.5), ["Na", "Cl"],
+                         [[0, 0, 0], [0.5, 0.5, 0.5]])
+        zincblende = Structure(Lattice.cubic(4 * 3 / 3 ** 0.5),
+                               ["Na"] * 4 + ["Cl"] * 4,
+                               np.concatenate([fcc, fcc + 0.25]))
+        structures = []
+        for s in [rocksalt, cscl, zincblende]:
+            structures.append(s)
+            structures.append(Structure(
+                Lattice(s.lattice.matrix * [1.005, 1, 0.995]), s.species,
+                s.frac_coords + 0.002))
+
+        sm = StructureMatcher(ltol=0.02, stol=0.02, angle_tol=1)
+        self.assertTrue(sm._use_fingerprints())
+        self.assertFalse(StructureMatcher()._use_fingerprints())
+        fps = np.array([sm._comparator.get_structure_fingerprint(s)
+                        for s in structures])
+        pruned = 0
+        for i in range(len(structures)):
+            for j in range(i + 1, len(structures)):
+                may_match = sm.fingerprints_may_match(fps[i], fps[j])
+                if sm.fit(structures[i], structures[j]):
+                    self.assertTrue(may_match)
+                #Only the distorted copies of each polymorph can match.
+                self.assertEqual(may_match, i // 2 == j // 2)
+                pruned += not may_match
+        self.assertEqual(pruned, 12)
+        groups = sm.group_structures(structures)
+        self.assertEqual(sorted([len(g) for g in groups]), [2, 2, 2])
+
+    def test_prepared_cache(self):
+        sm = StructureMatcher()
+        s1, s2 = self.struct_list[:2]
+        self.assertTrue(sm.fit(s1, s2))
+        prep = sm._prepare(s1)
+        self.assertIs(prep.structure, s1)
+        self.assertIs(sm._prepare(s1), prep)
+        self.assertEqual(sum([len(g) for g in prep.groups]), len(s1))
+        self.assertAlmostEqual(sm.get_rms_dist(s1, s2)[0],
+                               sm.get_rms_dist(s1.copy(), s2)[0])
+
+        sm.prepared_cache_size = 1
+        sm.fit(s2, s1.copy())
+        self.assertEqual(len(sm._prepared_cache), 1)
+        sm2 = pickle.loads(pickle.dumps(sm))
+        self.assertFalse(hasattr(sm2, "_prepared_cache"))
+        self.assertTrue(sm2.fit(s1, s2))
+
+    def test_group_structures_parallel(self):
+        sm = StructureMatcher()
+        serial = sm.group_structures(self.struct_list)
+        #Split the largest pre-group into blocks of pairs.
+        sm.parallel_bucket_size = 4
+        sm.parallel_block_size = 5
+        parallel = sm.group_structures(self.struct_list, n_jobs=2)
+        self.assertEqual([[id(s) for s in g] for g in serial],
+                         [[id(s) for s in g] for g in parallel])
+
+    def test_find_matches(self):
+        sm = StructureMatcher()
+        sc = SupercellMaker(self.struct_list[3], [[2, 0, 0], [0, 1, 0],
+                                                  [0, 0, 1]])
+        refs = self.struct_list + [sc.modified_structure]
+        index = StructureIndex(refs, sm)
+        self.assertEqual(len(index), 17)
+        for s in self.struct_list[:5]:
+            expected = [i for i, r in enumerate(refs) if sm.fit(s, r)]
+            self.assertEqual(index.find_matches(s), expected)
+            self.assertEqual(sm.find_matches(s, refs), expected)
+        self.assertEqual(index.find_matches(self.struct_list[3]), [3, 16])
+        self.assertEqual(index.find_matches(self.oxi_structs[0]), [])
+
+    def test_get_lattices(self):
+        sm = StructureMatcher(ltol=0.3, angle_tol=10)
+        l1 = self.struct_list[0].lattice.get_niggli_reduced_lattice()
+        l2 = Lattice(l1.matrix * 1.05)
+        lattices = list(sm._get_lattices(l1, l2, l2.volume / 2))
+        self.assertTrue(len(lattices) > 1)
+        #The least distorted lattice comes first.
+        self.assertTrue(np.allclose(lattices[0].abc, l2.abc))
+        self.assertTrue(np.allclose(lattices[0].angles, l1.angles))
+        lengths = np.array([l.abc for l in lattices])
+        self.assertTrue(np.all(lengths < 1.3 * np.array(l1.abc)))
+        self.assertTrue(np.all(lengths > 0.7 * np.array(l1.abc)))
+        self.assertTrue(np.all([l.volume >= l2.volume / 2 for l in lattices]))
+
+    def test_get_translations(self):
+        sm = StructureMatcher()
+        s1 = [np.array([[0, 0, 0], [0.5, 0.5, 0.5]]),
+              np.array([[0.25, 0.25, 0.25], [0.75, 0.75, 0.75],
+                        [0.25, 0.75, 0.5]])]
+        #s2 is s1 shifted by (0.1, 0.2, 0.3), with a small perturbation.
+        s2 = [np.mod(c + [0.1, 0.2, 0.3] + 0.01, 1) for c in s1]
+        frac_tol = np.array([0.05, 0.05, 0.05])
+        #Only the translation of the first site is valid, since the third
+        #site of the second group breaks the body centering.
+        self.assertEqual([list(inds) for inds
+                          in sm._get_translations(s1, s2, frac_tol)], [[0]])
+        s2[1][2] = [0.5, 0.5, 0]
+        self.assertEqual(list(sm._get_translations(s1, s2, frac_tol)), [])
+
     def test_left_handed_lattice(self):
         """Ensure Left handed lattices are accepted"""
         sm = StructureMatcher()
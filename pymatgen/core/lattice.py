@@ -19,7 +19,7 @@ import itertools
 
 import numpy as np
 from numpy.linalg import inv
-from numpy import pi, dot, transpose, radians
+from numpy import pi, dot, radians
 
 from pymatgen.serializers.json_coders import MSONable
 from pymatgen.util.coord_utils import get_points_in_sphere_pbc
@@ -65,6 +65,10 @@ class Lattice(MSONable):
         self._matrix = m
         # The inverse matrix is lazily generated for efficiency.
         self._inv_matrix = None
+        # Since a Lattice is immutable, reductions are cached as
+        # {parameter: (reduced lattice, mapping)}.
+        self._lll_cache = {}
+        self._niggli_cache = {}
 
     @property
     def matrix(self):
@@ -519,6 +523,7 @@ class Lattice(MSONable):
         Performs a Lenstra-Lenstra-Lovasz lattice basis reduction to obtain a
         c-reduced basis. This method returns a basis which is as "good" as
         possible, with "good" defined by orthongonality of the lattice vectors.
+        The result is cached.
 
         Args:
             delta:
@@ -527,72 +532,26 @@ class Lattice(MSONable):
         Returns:
             Reduced lattice.
         """
-        # Transpose the lattice matrix first so that basis vectors are columns.
-        # Makes life easier.
-        a = self._matrix.T
+        return reduce_lattices([self], "LLL", delta=delta)[0]
 
-        b = np.zeros((3, 3))  # Vectors after the Gram-Schmidt process
-        u = np.zeros((3, 3))  # Gram-Schmidt coeffieicnts
-        m = np.zeros(3)  # These are the norm squared of each vec.
-
-        b[:, 0] = a[:, 0]
-        m[0] = dot(b[:, 0], b[:, 0])
-        for i in xrange(1, 3):
-            u[i, 0:i] = dot(a[:, i].T, b[:, 0:i]) / m[0:i]
-            b[:, i] = a[:, i] - dot(b[:, 0:i], u[i, 0:i].T)
-            m[i] = dot(b[:, i], b[:, i])
-
-        k = 2
-
-        while k <= 3:
-            # Size reduction.
-            for i in xrange(k - 1, 0, -1):
-                q = round(u[k - 1, i - 1])
-                if q != 0:
-                    # Reduce the k-th basis vector.
-                    a[:, k - 1] = a[:, k - 1] - q * a[:, i - 1]
-                    uu = list(u[i - 1, 0:(i - 1)])
-                    uu.append(1)
-                    # Update the GS coefficients.
-                    u[k - 1, 0:i] = u[k - 1, 0:i] - q * np.array(uu)
-
-            # Check the Lovasz condition.
-            if dot(b[:, k - 1], b[:, k - 1]) >=\
-                    (delta - abs(u[k - 1, k - 2]) ** 2) *\
-                    dot(b[:, (k - 2)], b[:, (k - 2)]):
-                # Increment k if the Lovasz condition holds.
-                k += 1
-            else:
-                #If the Lovasz condition fails,
-                #swap the k-th and (k-1)-th basis vector
-                v = a[:, k - 1].copy()
-                a[:, k - 1] = a[:, k - 2].copy()
-                a[:, k - 2] = v
-                #Update the Gram-Schmidt coefficients
-                for s in xrange(k - 1, k + 1):
-                    u[s - 1, 0:(s - 1)] = dot(a[:, s - 1].T,
-                                              b[:, 0:(s - 1)]) / m[0:(s - 1)]
-                    b[:, s - 1] = a[:, s - 1] - dot(b[:, 0:(s - 1)],
-                                                    u[s - 1, 0:(s - 1)].T)
-                    m[s - 1] = dot(b[:, s - 1], b[:, s - 1])
-
-                if k > 2:
-                    k -= 1
-                else:
-                    # We have to do p/q, so do lstsq(q.T, p.T).T instead.
-                    p = dot(a[:, k:3].T, b[:, (k - 2):k])
-                    q = np.diag(m[(k - 2):k])
-                    result = np.linalg.lstsq(q.T, p.T)[0].T
-                    u[k:3, (k - 2):k] = result
+    def get_lll_mapping(self, delta=0.75):
+        """
+        Returns the integer matrix which transforms this lattice into its LLL
+        reduced lattice, i.e., reduced.matrix = dot(mapping, self.matrix).
 
-        return Lattice(a.T)
+        Args:
+            delta:
+                Reduction parameter. Default of 0.75 is usually fine.
+        """
+        self.get_lll_reduced_lattice(delta)
+        return np.copy(self._lll_cache[delta][1])
 
     def get_niggli_reduced_lattice(self, tol=1e-5):
         """
         Get the Niggli reduced lattice using the numerically stable algo
         proposed by R. W. Grosse-Kunstleve, N. K. Sauter, & P. D. Adams,
         Acta Crystallographica Section A Foundations of Crystallography, 2003,
-        60(1), 1-6. doi:10.1107/S010876730302186X
+        60(1), 1-6. doi:10.1107/S010876730302186X. The result is cached.
 
         Args:
             tol:
@@ -602,93 +561,27 @@ class Lattice(MSONable):
         Returns:
             Niggli-reduced lattice.
         """
-        a = self._matrix[0]
-        b = self._matrix[1]
-        c = self._matrix[2]
-        e = tol * self.volume ** (1 / 3)
-
-        #Define metric tensor
-        G = [[dot(a, a), dot(a, b), dot(a, c)],
-             [dot(a, b), dot(b, b), dot(b, c)],
-             [dot(a, c), dot(b, c), dot(c, c)]]
-        G = np.array(G)
-
-        #This sets an upper limit on the number of iterations.
-        for count in xrange(100):
-            #The steps are labelled as Ax as per the labelling scheme in the
-            #paper.
-            (A, B, C, E, N, Y) = (G[0, 0], G[1, 1], G[2, 2],
-                                  2 * G[1, 2], 2 * G[0, 2], 2 * G[0, 1])
-
-            if A > B + e or (abs(A - B) < e and abs(E) > abs(N) + e):
-                #A1
-                M = [[0, -1, 0], [-1, 0, 0], [0, 0, -1]]
-                G = dot(transpose(M), dot(G, M))
-            if (B > C + e) or (abs(B - C) < e and abs(N) > abs(Y) + e):
-                #A2
-                M = [[-1, 0, 0], [0, 0, -1], [0, -1, 0]]
-                G = dot(transpose(M), dot(G, M))
-                continue
-
-            l = 0 if abs(E) < e else E / abs(E)
-            m = 0 if abs(N) < e else N / abs(N)
-            n = 0 if abs(Y) < e else Y / abs(Y)
-            if l * m * n == 1:
-                # A3
-                i = -1 if l == -1 else 1
-                j = -1 if m == -1 else 1
-                k = -1 if n == -1 else 1
-                M = [[i, 0, 0], [0, j, 0], [0, 0, k]]
-                G = dot(transpose(M), dot(G, M))
-            elif l * m * n == 0 or l * m * n == -1:
-                # A4
-                i = -1 if l == 1 else 1
-                j = -1 if m == 1 else 1
-                k = -1 if n == 1 else 1
-
-                if i * j * k == -1:
-                    if n == 0:
-                        k = -1
-                    elif m == 0:
-                        j = -1
-                    elif l == 0:
-                        i = -1
-                M = [[i, 0, 0], [0, j, 0], [0, 0, k]]
-                G = dot(transpose(M), dot(G, M))
-
-            (A, B, C, E, N, Y) = (G[0, 0], G[1, 1], G[2, 2],
-                                  2 * G[1, 2], 2 * G[0, 2], 2 * G[0, 1])
-
-            #A5
-            if abs(E) > B + e or (abs(E - B) < e and 2 * N < Y - e) or\
-                    (abs(E + B) < e and Y < -e):
-                M = [[1, 0, 0], [0, 1, -E / abs(E)], [0, 0, 1]]
-                G = dot(transpose(M), dot(G, M))
-                continue
-
-            #A6
-            if abs(N) > A + e or (abs(A - N) < e and 2 * E < Y - e) or\
-                    (abs(A + N) < e and Y < -e):
-                M = [[1, 0, -N / abs(N)], [0, 1, 0], [0, 0, 1]]
-                G = dot(transpose(M), dot(G, M))
-                continue
-
-            #A7
-            if abs(Y) > A + e or (abs(A - Y) < e and 2 * E < N - e) or\
-                    (abs(A + Y) < e and N < -e):
-                M = [[1, -Y / abs(Y), 0], [0, 1, 0], [0, 0, 1]]
-                G = dot(transpose(M), dot(G, M))
-                continue
+        return reduce_lattices([self], "niggli", tol=tol)[0]
 
-            #A8
-            if E + N + Y + A + B < -e or\
-                    (abs(E + N + Y + A + B) < e < Y + (A + N) * 2):
-                M = [[1, 0, 1], [0, 1, 1], [0, 0, 1]]
-                G = dot(transpose(M), dot(G, M))
-                continue
+    def get_niggli_mapping(self, tol=1e-5):
+        """
+        Returns the integer matrix which transforms this lattice into its
+        Niggli reduced lattice, i.e., reduced.matrix = dot(mapping,
+        self.matrix).
 
-            break
+        Args:
+            tol:
+                The numerical tolerance. The default of 1e-5 should result in
+                stable behavior for most cases.
+        """
+        self.get_niggli_reduced_lattice(tol)
+        return np.copy(self._niggli_cache[tol][1])
 
+    def _get_niggli_lattice(self, G, e):
+        """
+        Returns the lattice on the lattice points of this lattice which has
+        the Niggli reduced metric tensor G.
+        """
         A = G[0, 0]
         B = G[1, 1]
         C = G[2, 2]
@@ -709,6 +602,14 @@ class Lattice(MSONable):
             return mapped[0]
         raise ValueError("can't find niggli")
 
+    def _set_reduced(self, cache_name, key, reduced):
+        """
+        Caches a reduced lattice together with the integer matrix mapping
+        this lattice onto it.
+        """
+        mapping = np.around(dot(reduced._matrix, self.inv_matrix))
+        getattr(self, cache_name)[key] = (reduced, mapping.astype(np.int))
+
     def get_wigner_seitz_cell(self):
         """
         Returns the Wigner-Seitz cell for the given lattice.
@@ -747,3 +648,274 @@ class Lattice(MSONable):
             represent a square facet.
         """
         return self.reciprocal_lattice.get_wigner_seitz_cell()
+
+
+def _lll_reduce(matrices, delta=0.75):
+    """
+    Performs a Lenstra-Lenstra-Lovasz reduction on a batch of lattices at
+    once. Each step of the algorithm is applied to all lattices that are at
+    the same stage of the reduction, so the Python loop only runs over the
+    stages and not over the lattices.
+
+    Args:
+        matrices:
+            Nx3x3 array of lattice matrices, with each row of a matrix
+            corresponding to a lattice vector.
+        delta:
+            Reduction parameter.
+
+    Returns:
+        Nx3x3 array of reduced lattice matrices.
+    """
+    # Transpose the lattice matrices first so that basis vectors are
+    # columns. Makes life easier.
+    a = np.array(matrices, dtype=np.float64).transpose((0, 2, 1))
+    nlatt = len(a)
+
+    b = np.zeros((nlatt, 3, 3))  # Vectors after the Gram-Schmidt process
+    u = np.zeros((nlatt, 3, 3))  # Gram-Schmidt coeffieicnts
+    m = np.zeros((nlatt, 3))  # These are the norm squared of each vec.
+
+    def update_gs(inds, s):
+        #Recomputes the Gram-Schmidt vector and coefficients of column s.
+        u[inds, s, 0:s] = np.einsum("ij,ijk->ik", a[inds, :, s],
+                                    b[inds, :, 0:s]) / m[inds, 0:s]
+        b[inds, :, s] = a[inds, :, s] - np.einsum("ijk,ik->ij",
+                                                  b[inds, :, 0:s],
+                                                  u[inds, s, 0:s])
+        m[inds, s] = np.sum(b[inds, :, s] ** 2, axis=1)
+
+    all_inds = np.arange(nlatt)
+    b[:, :, 0] = a[:, :, 0]
+    m[:, 0] = np.sum(b[:, :, 0] ** 2, axis=1)
+    for i in xrange(1, 3):
+        update_gs(all_inds, i)
+
+    k = np.ones(nlatt, dtype=np.int) * 2
+
+    while np.any(k <= 3):
+        stages = [(kk, np.where(k == kk)[0]) for kk in (2, 3)]
+        for kk, inds in stages:
+            if len(inds) == 0:
+                continue
+            # Size reduction.
+            for i in xrange(kk - 1, 0, -1):
+                #Round half away from zero, as in the builtin round.
+                x = u[inds, kk - 1, i - 1]
+                q = np.sign(x) * np.floor(np.abs(x) + 0.5)
+                # Reduce the k-th basis vector.
+                a[inds, :, kk - 1] -= q[:, None] * a[inds, :, i - 1]
+                uu = np.ones((len(inds), i))
+                uu[:, 0:(i - 1)] = u[inds, i - 1, 0:(i - 1)]
+                # Update the GS coefficients.
+                u[inds, kk - 1, 0:i] -= q[:, None] * uu
+
+            # Check the Lovasz condition.
+            lovasz = m[inds, kk - 1] >= \
+                (delta - np.abs(u[inds, kk - 1, kk - 2]) ** 2) * \
+                m[inds, kk - 2]
+            # Increment k if the Lovasz condition holds.
+            k[inds[lovasz]] += 1
+
+            #If the Lovasz condition fails, swap the k-th and (k-1)-th basis
+            #vector
+            inds = inds[np.logical_not(lovasz)]
+            if len(inds) == 0:
+                continue
+            v = a[inds, :, kk - 1].copy()
+            a[inds, :, kk - 1] = a[inds, :, kk - 2]
+            a[inds, :, kk - 2] = v
+            #Update the Gram-Schmidt coefficients
+            for s in xrange(kk - 1, kk + 1):
+                update_gs(inds, s - 1)
+
+            if kk > 2:
+                k[inds] -= 1
+            else:
+                # The Gram-Schmidt norms form a diagonal matrix, so the
+                # coefficients are simply obtained by division.
+                p = np.einsum("ijk,ijl->ikl", a[inds, :, kk:3],
+                              b[inds, :, (kk - 2):kk])
+                u[inds, kk:3, (kk - 2):kk] = p / m[inds, None, (kk - 2):kk]
+
+    return a.transpose((0, 2, 1))
+
+
+def _niggli_reduce_metrics(metrics, e):
+    """
+    Niggli reduces a batch of metric tensors at once, using the numerically
+    stable algo proposed by R. W. Grosse-Kunstleve, N. K. Sauter, & P. D.
+    Adams, Acta Crystallographica Section A Foundations of Crystallography,
+    2003, 60(1), 1-6. doi:10.1107/S010876730302186X
+
+    Each step of the algorithm is applied to the metric tensors for which its
+    condition holds, so the Python loop only runs over the iterations and not
+    over the lattices.
+
+    Args:
+        metrics:
+            Nx3x3 array of metric tensors.
+        e:
+            Array of N numerical tolerances.
+
+    Returns:
+        Nx3x3 array of reduced metric tensors.
+    """
+    G = np.array(metrics, dtype=np.float64)
+    e = np.array(e, dtype=np.float64)
+    nlatt = len(G)
+    active = np.ones(nlatt, dtype=np.bool)
+
+    def transform(mask, M):
+        #Applies G = M^T G M to the metric tensors selected by mask.
+        inds = np.where(mask)[0]
+        if len(inds) > 0:
+            M = np.array(M, dtype=np.float64)
+            M = M[inds] if M.ndim == 3 else M[None].repeat(len(inds), 0)
+            G[inds] = np.einsum("ijn,ijl,ilk->ink", M, G[inds], M)
+
+    def params():
+        return (G[:, 0, 0].copy(), G[:, 1, 1].copy(), G[:, 2, 2].copy(),
+                2 * G[:, 1, 2], 2 * G[:, 0, 2], 2 * G[:, 0, 1])
+
+    def sign(x):
+        return np.where(np.abs(x) < e, 0, np.sign(x))
+
+    def diag(i, j, k):
+        M = np.zeros((nlatt, 3, 3))
+        M[:, 0, 0] = i
+        M[:, 1, 1] = j
+        M[:, 2, 2] = k
+        return M
+
+    #This sets an upper limit on the number of iterations.
+    for count in xrange(100):
+        if not np.any(active):
+            break
+        #Lattices which have not yet restarted the loop in this iteration.
+        todo = active.copy()
+
+        #The steps are labelled as Ax as per the labelling scheme in the
+        #paper.
+        (A, B, C, E, N, Y) = params()
+        #A1
+        cond = (A > B + e) | ((np.abs(A - B) < e) &
+                              (np.abs(E) > np.abs(N) + e))
+        transform(todo & cond, [[0, -1, 0], [-1, 0, 0], [0, 0, -1]])
+        #The parameters must be updated after A1, otherwise the sign
+        #conventions applied in A3 and A4 can be wrong.
+        (A, B, C, E, N, Y) = params()
+        #A2
+        cond = todo & ((B > C + e) |
+                       ((np.abs(B - C) < e) & (np.abs(N) > np.abs(Y) + e)))
+        transform(cond, [[-1, 0, 0], [0, 0, -1], [0, -1, 0]])
+        todo &= np.logical_not(cond)
+
+        l, m, n = sign(E), sign(N), sign(Y)
+        lmn = l * m * n
+        # A3
+        i = np.where(l == -1, -1, 1)
+        j = np.where(m == -1, -1, 1)
+        k = np.where(n == -1, -1, 1)
+        transform(todo & (lmn == 1), diag(i, j, k))
+        # A4
+        i = np.where(l == 1, -1, 1)
+        j = np.where(m == 1, -1, 1)
+        k = np.where(n == 1, -1, 1)
+        fix = i * j * k == -1
+        k = np.where(fix & (n == 0), -1, k)
+        j = np.where(fix & (n != 0) & (m == 0), -1, j)
+        i = np.where(fix & (n != 0) & (m != 0) & (l == 0), -1, i)
+        transform(todo & ((lmn == 0) | (lmn == -1)), diag(i, j, k))
+
+        (A, B, C, E, N, Y) = params()
+        ones = np.ones(nlatt)
+
+        #A5
+        cond = todo & ((np.abs(E) > B + e) |
+                       ((np.abs(E - B) < e) & (2 * N < Y - e)) |
+                       ((np.abs(E + B) < e) & (Y < -e)))
+        M = diag(ones, ones, ones)
+        M[:, 1, 2] = -np.sign(E)
+        transform(cond, M)
+        todo &= np.logical_not(cond)
+
+        #A6
+        cond = todo & ((np.abs(N) > A + e) |
+                       ((np.abs(A - N) < e) & (2 * E < Y - e)) |
+                       ((np.abs(A + N) < e) & (Y < -e)))
+        M = diag(ones, ones, ones)
+        M[:, 0, 2] = -np.sign(N)
+        transform(cond, M)
+        todo &= np.logical_not(cond)
+
+        #A7
+        cond = todo & ((np.abs(Y) > A + e) |
+                       ((np.abs(A - Y) < e) & (2 * E < N - e)) |
+                       ((np.abs(A + Y) < e) & (N < -e)))
+        M = diag(ones, ones, ones)
+        M[:, 0, 1] = -np.sign(Y)
+        transform(cond, M)
+        todo &= np.logical_not(cond)
+
+        #A8
+        s = E + N + Y + A + B
+        cond = todo & ((s < -e) |
+                       ((np.abs(s) < e) & (e < Y + (A + N) * 2)))
+        transform(cond, [[1, 0, 1], [0, 1, 1], [0, 0, 1]])
+        todo &= np.logical_not(cond)
+
+        #Lattices for which no step was taken are reduced.
+        active &= np.logical_not(todo)
+
+    return G
+
+
+def reduce_lattices(lattices, reduction_algo="niggli", tol=1e-5,
+                    delta=0.75):
+    """
+    Reduces many lattices at once. The iterative reduction steps are carried
+    out for all lattices together, which is much faster than reducing each
+    lattice separately when there are many of them. The results are the same
+    as those of Lattice.get_niggli_reduced_lattice and
+    Lattice.get_lll_reduced_lattice, and are cached on the Lattice objects
+    if these are supplied.
+
+    Args:
+        lattices:
+            Sequence of Lattices or lattice matrices.
+        reduction_algo:
+            The lattice reduction algorithm to use. Currently supported
+            options are "niggli" or "LLL".
+        tol:
+            The numerical tolerance for the Niggli reduction.
+        delta:
+            Reduction parameter for the LLL reduction.
+
+    Returns:
+        List of reduced Lattices.
+    """
+    lattices = [l if isinstance(l, Lattice) else Lattice(l)
+                for l in lattices]
+    if reduction_algo == "niggli":
+        cache_name, key = "_niggli_cache", tol
+    elif reduction_algo == "LLL":
+        cache_name, key = "_lll_cache", delta
+    else:
+        raise ValueError("Invalid reduction algo : {}"
+                         .format(reduction_algo))
+
+    todo = [l for l in lattices if key not in getattr(l, cache_name)]
+    if todo:
+        matrices = np.array([l._matrix for l in todo])
+        if reduction_algo == "niggli":
+            e = tol * np.array([l.volume for l in todo]) ** (1 / 3)
+            metrics = _niggli_reduce_metrics(
+                np.einsum("ijk,ilk->ijl", matrices, matrices), e)
+            reduced = [l._get_niggli_lattice(G, ee)
+                       for l, G, ee in zip(todo, metrics, e)]
+        else:
+            reduced = [Lattice(m) for m in _lll_reduce(matrices, delta)]
+        for l, r in zip(todo, reduced):
+            l._set_reduced(cache_name, key, r)
+    return [getattr(l, cache_name)[key][0] for l in lattices]
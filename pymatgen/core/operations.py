@@ -142,6 +142,21 @@ class SymmOp(MSONable):
         affine_point = np.array([point[0], point[1], point[2], 1])
         return np.dot(self.affine_matrix, affine_point)[0:3]
 
+    def operate_multi(self, points):
+        """
+        Apply the operation on a sequence of points.
+
+        Args:
+            points:
+                Nx3 array of cartesian coordinates.
+
+        Returns:
+            Nx3 array of coordinates of points after operation.
+        """
+        points = np.array(points, dtype=np.float64).reshape((-1, 3))
+        return np.dot(points, self.affine_matrix[0:3, 0:3].T) + \
+            self.affine_matrix[0:3, 3]
+
     def apply_rotation_only(self, vector):
         """
         Vectors should only be operated by the rotation matrix and not the
@@ -24,15 +24,50 @@ from pymatgen.util.coord_utils import pbc_diff
 from pymatgen.core.composition import Composition
 
 
-class Site(collections.Mapping, collections.Hashable, MSONable):
+#Immutable species and occupancy Compositions for ordered sites, shared
+#between all sites with the same species input.
+_ORDERED_SPECIES = {}
+
+
+def get_ordered_species(sp):
+    """
+    Returns an interned Composition for a site occupied by a single
+    element / specie with occupancy 1.
+
+    Args:
+        sp:
+            Element / specie specified as a string symbol, an atomic number or
+            an actual Element or Specie object.
+    """
+    try:
+        #Specie equality ignores optional properties such as spin, so these
+        #are made part of the key.
+        key = (sp, tuple(sorted(getattr(sp, "_properties", {}).items())))
+        comp = _ORDERED_SPECIES.get(key)
+    except TypeError:
+        key, comp = None, None
+    if comp is None:
+        comp = Composition({smart_element_or_specie(sp): 1})
+        if key is not None:
+            _ORDERED_SPECIES[key] = comp
+    return comp
+
+
+class Site(MSONable):
     """
     A generalized *non-periodic* site. This is essentially a composition
     at a point in space, with some optional properties associated with it. A
     Composition is used to represent the atoms and occupancy, which allows for
     disordered site representation. Coords are given in standard cartesian
     coordinates.
+
+    Sites are registered as a collections.Mapping of species to occupancy,
+    but use __slots__ to keep the memory footprint small. The species and
+    occupancies of ordered sites are shared Compositions.
     """
 
+    __slots__ = ("_species", "_coords", "_properties", "_is_ordered")
+
     supported_properties = ("magmom", "charge", "coordination_no", "forces")
 
     def __init__(self, atoms_n_occu, coords, properties=None):
@@ -55,16 +90,22 @@ class Site(collections.Mapping, collections.Hashable, MSONable):
                 Properties associated with the site as a dict, e.g.
                 {"magmom": 5}. Defaults to None.
         """
-        if issubclass(atoms_n_occu.__class__, collections.Mapping):
-            self._species = Composition({smart_element_or_specie(k): v
-                                         for k, v in atoms_n_occu.items()})
+        if isinstance(atoms_n_occu, collections.Mapping):
+            if len(atoms_n_occu) == 1 and atoms_n_occu.values()[0] == 1:
+                self._species = get_ordered_species(atoms_n_occu.keys()[0])
+            elif isinstance(atoms_n_occu, Composition):
+                #Compositions are immutable and can be shared.
+                self._species = atoms_n_occu
+            else:
+                self._species = Composition(
+                    {smart_element_or_specie(k): v
+                     for k, v in atoms_n_occu.items()})
             totaloccu = self._species.num_atoms
             if totaloccu > 1:
                 raise ValueError("Species occupancies sum to more than 1!")
             self._is_ordered = (totaloccu == 1 and len(self._species) == 1)
         else:
-            self._species = Composition(
-                {smart_element_or_specie(atoms_n_occu): 1})
+            self._species = get_ordered_species(atoms_n_occu)
             self._is_ordered = True
 
         self._coords = coords
@@ -88,6 +129,16 @@ class Site(collections.Mapping, collections.Hashable, MSONable):
             return p[a]
         raise AttributeError(a)
 
+    def __getstate__(self):
+        #Classes with __slots__ need to provide their own state for pickling.
+        return {k: getattr(self, k) for cls in self.__class__.__mro__
+                for k in cls.__dict__.get("__slots__", ())
+                if hasattr(self, k)}
+
+    def __setstate__(self, state):
+        for k, v in state.items():
+            setattr(self, k, v)
+
     def distance(self, other):
         """
         Get distance between two sites.
@@ -217,6 +268,30 @@ class Site(collections.Mapping, collections.Hashable, MSONable):
     def __iter__(self):
         return self._species.__iter__()
 
+    def keys(self):
+        return self._species.keys()
+
+    def values(self):
+        return self._species.values()
+
+    def items(self):
+        return self._species.items()
+
+    def iterkeys(self):
+        return iter(self._species)
+
+    def itervalues(self):
+        return (self._species[k] for k in self._species)
+
+    def iteritems(self):
+        return ((k, self._species[k]) for k in self._species)
+
+    def get(self, el, default=None):
+        try:
+            return self._species[el]
+        except KeyError:
+            return default
+
     def __repr__(self):
         return "Site: {} ({:.4f}, {:.4f}, {:.4f})".format(
             self.species_string, self._coords[0], self._coords[1],
@@ -277,6 +352,8 @@ class PeriodicSite(Site, MSONable):
     PeriodicSite includes a lattice system.
     """
 
+    __slots__ = ("_lattice", "_fcoords")
+
     def __init__(self, atoms_n_occu, coords, lattice, to_unit_cell=False,
                  coords_are_cartesian=False, properties=None):
         """
@@ -534,3 +611,8 @@ class PeriodicSite(Site, MSONable):
         props = d.get("properties", None)
         lattice = lattice if lattice else Lattice.from_dict(d["lattice"])
         return PeriodicSite(atoms_n_occu, d["abc"], lattice, properties=props)
+
+
+#Sites do not inherit from collections.Mapping, which has no __slots__, but
+#support the full Mapping interface.
+collections.Mapping.register(Site)
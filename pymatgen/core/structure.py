@@ -19,17 +19,20 @@ import abc
 import math
 import collections
 import itertools
+import fractions
 
 import numpy as np
 
 from pymatgen.core.lattice import Lattice
-from pymatgen.core.periodic_table import Element, Specie
+from pymatgen.core.periodic_table import Element, Specie, \
+    smart_element_or_specie
 from pymatgen.serializers.json_coders import MSONable
-from pymatgen.core.sites import Site, PeriodicSite
+from pymatgen.core.sites import Site, PeriodicSite, get_ordered_species
 from pymatgen.core.bonds import CovalentBond
 from pymatgen.core.physical_constants import AMU_TO_KG
 from pymatgen.core.composition import Composition
-from pymatgen.util.coord_utils import get_points_in_sphere_pbc
+from pymatgen.util.coord_utils import get_neighbor_list_pbc, \
+    pbc_all_distances, MAX_MEMORY
 
 
 class SiteCollection(collections.Sequence, collections.Hashable):
@@ -286,22 +289,47 @@ class Structure(SiteCollection, MSONable):
         else:
             self._lattice = Lattice(lattice)
 
-        sites = []
-        for i in xrange(len(species)):
-            prop = None
-            if site_properties:
-                prop = {k: v[i] for k, v in site_properties.items()}
-            sites.append(PeriodicSite(species[i], coords[i],
-                                      self._lattice, to_unit_cell,
-                                      coords_are_cartesian,
-                                      properties=prop))
+        #Sites are stored as arrays. The species are stored as a list of
+        #unique species and occupancies and an array of indices into that
+        #list, and PeriodicSites are only created when they are accessed.
+        self._unique_species = []
+        self._species_indices = np.array(
+            _index_species(species, self._unique_species), dtype=np.int)
+
+        coords = np.array(coords, dtype=np.float64).reshape((-1, 3))
+        if coords_are_cartesian:
+            self._frac_coords = self._lattice.get_fractional_coords(coords)
+            self._cart_coords = coords
+        else:
+            self._frac_coords = coords
+            self._cart_coords = None
+        if to_unit_cell:
+            self._frac_coords = np.mod(self._frac_coords, 1)
+            self._cart_coords = None
+        if self._cart_coords is None:
+            self._cart_coords = self._lattice.get_cartesian_coords(
+                self._frac_coords)
+
+        self._site_properties = {}
+        if site_properties:
+            for k, v in site_properties.items():
+                if k not in Site.supported_properties:
+                    raise ValueError("{} is not a supported property"
+                                     .format(k))
+                self._site_properties[k] = list(v)
+
+        # Since a Structure is immutable, the sites and distance matrix are
+        # lazily generated once and cached.
+        self._site_cache = [None] * len(self._species_indices)
+        self._sites = None
+        self._distance_matrix = None
 
         if validate_proximity:
-            for (s1, s2) in itertools.combinations(sites, 2):
-                if s1.distance(s2) < SiteCollection.DISTANCE_TOLERANCE:
-                    raise StructureError(("Structure contains sites that are ",
-                                          "less than 0.01 Angstrom apart!"))
-        self._sites = tuple(sites)
+            dist = self.distance_matrix[
+                np.triu_indices(len(self._species_indices), 1)]
+            if np.any(dist < SiteCollection.DISTANCE_TOLERANCE):
+                raise StructureError(("Structure contains sites that are ",
+                                      "less than 0.01 Angstrom apart!"))
 
     @staticmethod
     def from_sites(sites):
@@ -331,8 +359,45 @@ class Structure(SiteCollection, MSONable):
         """
         Returns an iterator for the sites in the Structure.
         """
+        if self._sites is None:
+            self._sites = tuple(self._get_site(i) for i in xrange(len(self)))
         return self._sites
 
+    def _get_site(self, i):
+        """
+        Returns the PeriodicSite at index i, creating it from the stored
+        arrays if it has not been accessed before.
+        """
+        site = self._site_cache[i]
+        if site is None:
+            props = {k: v[i] for k, v in self._site_properties.items()}
+            site = PeriodicSite(
+                self._unique_species[self._species_indices[i]],
+                self._frac_coords[i], self._lattice, properties=props)
+            #Use the stored cartesian coords, which may have been supplied
+            #directly.
+            site._coords = self._cart_coords[i]
+            self._site_cache[i] = site
+        return site
+
+    def __getitem__(self, ind):
+        if isinstance(ind, (int, long, np.integer)):
+            nsites = len(self)
+            if ind < 0:
+                ind += nsites
+            if not 0 <= ind < nsites:
+                raise IndexError("Structure index out of range")
+            return self._get_site(ind)
+        return self.sites[ind]
+
+    def __iter__(self):
+        if self._sites is not None:
+            return iter(self._sites)
+        return (self._get_site(i) for i in xrange(len(self)))
+
+    def __len__(self):
+        return len(self._species_indices)
+
     @property
     def lattice(self):
         """
@@ -340,6 +405,47 @@ class Structure(SiteCollection, MSONable):
         """
         return self._lattice
 
+    @property
+    def species_and_occu(self):
+        """
+        List of species and occupancies at each site of the structure.
+        """
+        return [self._unique_species[i] for i in self._species_indices]
+
+    @property
+    def site_properties(self):
+        """
+        Returns the site properties as a dict of sequences. E.g.,
+        {"magmom": (5,-5), "charge": (-4,4)}.
+        """
+        props = collections.defaultdict(list)
+        for k, v in self._site_properties.items():
+            props[k] = list(v)
+        return props
+
+    @property
+    def composition(self):
+        """
+        Returns the composition
+        """
+        counts = np.bincount(self._species_indices,
+                             minlength=len(self._unique_species))
+        elmap = collections.defaultdict(float)
+        for comp, count in zip(self._unique_species, counts):
+            for species, occu in comp.items():
+                elmap[species] += occu * count
+        return Composition(elmap)
+
+    @property
+    def is_ordered(self):
+        """
+        Checks if structure is ordered, meaning no partial occupancies in any
+        of the sites.
+        """
+        return all(len(self._unique_species[i]) == 1 and
+                   self._unique_species[i].num_atoms == 1
+                   for i in np.unique(self._species_indices))
+
     @property
     def density(self):
         """
@@ -370,9 +476,39 @@ class Structure(SiteCollection, MSONable):
     @property
     def frac_coords(self):
         """
-        Returns the fractional coordinates.
+        Returns a copy of the fractional coordinates as a Nx3 numpy array.
         """
-        return [site.frac_coords for site in self._sites]
+        return np.copy(self._frac_coords)
+
+    @property
+    def cart_coords(self):
+        """
+        Returns a copy of the cartesian coordinates as a Nx3 numpy array.
+        """
+        return np.copy(self._cart_coords)
+
+    @property
+    def distance_matrix(self):
+        """
+        Returns the distance matrix between all sites in the structure,
+        using the nearest periodic image. The matrix is computed with the
+        vectorized pbc_all_distances, a block of rows at a time to limit
+        memory usage. The cached matrix is returned as a read-only array, so
+        make a copy to modify it.
+        """
+        if self._distance_matrix is None:
+            fcoords = self.frac_coords
+            nsites = len(fcoords)
+            distmatrix = np.zeros((nsites, nsites))
+            #pbc_all_distances creates an array of 27 * 3 * nrows * nsites
+            #floats.
+            nrows = max(1, int(MAX_MEMORY // (27 * 3 * 8 * max(nsites, 1))))
+            for i in xrange(0, nsites, nrows):
+                distmatrix[i:i + nrows] = pbc_all_distances(
+                    self._lattice, fcoords[i:i + nrows], fcoords)
+            distmatrix.flags.writeable = False
+            self._distance_matrix = distmatrix
+        return self._distance_matrix
 
     @property
     def volume(self):
@@ -437,10 +573,11 @@ class Structure(SiteCollection, MSONable):
         """
         site_fcoords = np.mod(self.frac_coords, 1)
         neighbors = []
-        for fcoord, dist, i in get_points_in_sphere_pbc(self._lattice,
-                                                        site_fcoords, pt, r):
+        (centers, indices, images, dists) = get_neighbor_list_pbc(
+            self._lattice, site_fcoords, [pt], r)
+        for i, image, dist in zip(indices, images, dists):
             nnsite = PeriodicSite(self[i].species_and_occu,
-                                  fcoord, self._lattice,
+                                  site_fcoords[i] + image, self._lattice,
                                   properties=self[i].properties)
             neighbors.append((nnsite, dist) if not include_index
                              else (nnsite, dist, i))
@@ -497,49 +634,50 @@ class Structure(SiteCollection, MSONable):
             sites contribute to the ewald sum.
         """
 
-        # Use same algorithm as get_sites_in_sphere to determine supercell but
-        # loop over all atoms in crystal
-        recp_len = self.lattice.reciprocal_lattice.abc
-        sr = r + 0.15
-        nmax = [sr * l / (2 * math.pi) for l in recp_len]
-        site_nminmax = []
-        floor = math.floor
-        for site in self:
-            pcoords = site.frac_coords
-            inmax = [int(floor(pcoords[i] + nmax[i])) for i in xrange(3)]
-            inmin = [int(floor(pcoords[i] - nmax[i])) for i in xrange(3)]
-            site_nminmax.append(zip(inmin, inmax))
+        (centers, indices, images, dists) = self.get_neighbor_list(r)
+        neighbors = [list() for i in xrange(len(self))]
+        fcoords = self.frac_coords
+        latt = self._lattice
+        for i, j, image, dist in zip(centers, indices, images, dists):
+            nnsite = PeriodicSite(self[j].species_and_occu,
+                                  fcoords[j] + image, latt,
+                                  properties=self[j].properties)
+            item = (nnsite, dist, j) if include_index else (nnsite, dist)
+            neighbors[i].append(item)
+        return neighbors
 
-        nmin = [min([i[j][0] for i in site_nminmax]) for j in xrange(3)]
-        nmax = [max([i[j][1] for i in site_nminmax]) for j in xrange(3)]
+    def get_neighbor_list(self, r, numerical_tol=1e-8):
+        """
+        Get neighbors for each atom in the unit cell, out to a distance r, as
+        flat arrays. Unlike get_all_neighbors, no site objects are created,
+        which makes this the method of choice for analyses that only need
+        indices and distances (e.g., Ewald sums and bond valence analyses).
 
-        all_ranges = [range(nmin[i], nmax[i] + 1) for i in xrange(3)]
+        The pairs are returned in coordinate (COO) form, sorted by the index
+        of the center site. Compressed (CSR) row offsets can be obtained with
+        np.searchsorted(center_indices, np.arange(len(structure) + 1)).
 
-        neighbors = [list() for i in xrange(len(self._sites))]
-        all_fcoords = np.mod(self.frac_coords, 1)
+        Args:
+            r:
+                radius of sphere.
+            numerical_tol:
+                Pairs with distances smaller than this (i.e., a site and
+                itself) are excluded. Defaults to 1e-8.
 
-        site_coords = np.array(self.cart_coords)
-        latt = self._lattice
-        frac_2_cart = latt.get_cartesian_coords
-        n = len(self)
-        indices = np.array(range(n))
-        for image in itertools.product(*all_ranges):
-            for (j, fcoord) in enumerate(all_fcoords):
-                fcoords = fcoord + image
-                coords = frac_2_cart(fcoords)
-                submat = np.tile(coords, (n, 1))
-                dists = (site_coords - submat) ** 2
-                dists = np.sqrt(dists.sum(axis=1))
-                withindists = (dists <= r) * (dists > 1e-8)
-                sp = self[j].species_and_occu
-                props = self[j].properties
-                for i in indices[withindists]:
-                    nnsite = PeriodicSite(sp, fcoords, latt,
-                                          properties=props)
-                    item = (nnsite, dists[i], j) if include_index else (
-                        nnsite, dists[i])
-                    neighbors[i].append(item)
-        return neighbors
+        Returns:
+            (center_indices, neighbor_indices, images, distances) as numpy
+            arrays. The neighbor of site center_indices[k] is the periodic
+            image of site neighbor_indices[k] at fractional coordinates
+            structure[neighbor_indices[k]].frac_coords + images[k], and lies
+            at distance distances[k] from the center.
+        """
+        # All pairs are found in a single pass of the linked-cell neighbor
+        # list, which scales linearly with the number of sites for a fixed
+        # cutoff.
+        (centers, indices, images, dists) = get_neighbor_list_pbc(
+            self._lattice, self.frac_coords, self.cart_coords, r)
+        keep = dists > numerical_tol
+        return centers[keep], indices[keep], images[keep], dists[keep]
 
     def get_neighbors_in_shell(self, origin, r, dr):
         """
@@ -616,10 +754,8 @@ class Structure(SiteCollection, MSONable):
         if site_properties:
             props.update(site_properties)
         if not sanitize:
-            return Structure(self._lattice,
-                             [site.species_and_occu for site in self],
-                             [site.frac_coords for site in self],
-                             site_properties=props)
+            return Structure(self._lattice, self.species_and_occu,
+                             self._frac_coords, site_properties=props)
         else:
             reduced_latt = self._lattice.get_lll_reduced_lattice()
             new_sites = []
@@ -669,7 +805,7 @@ class Structure(SiteCollection, MSONable):
 
         vec = end_coords - start_coords
         structs = [Structure(self.lattice,
-                             [site.species_and_occu for site in self._sites],
+                             self.species_and_occu,
                              start_coords + float(x) / float(nimages) * vec,
                              site_properties=self.site_properties)
                    for x in range(0, nimages + 1)]
@@ -677,137 +813,150 @@ class Structure(SiteCollection, MSONable):
 
     def get_primitive_structure(self, tolerance=0.25):
         """
-        This finds a smaller unit cell than the input. Sometimes it doesn"t
-        find the smallest possible one, so this method is recursively called
-        until it is unable to find a smaller cell.
-
-        The method works by finding possible smaller translations
-        and then using that translational symmetry instead of one of the
-        lattice basis vectors if more than one vector is found (usually the
-        case for large cells) the one with the smallest norm is used.
+        This finds the primitive cell of the structure, i.e., the smallest
+        cell which reproduces the structure by lattice translations.
 
-        Things are done in fractional coordinates because its easier to
-        translate back to the unit cell.
+        The method works by building up the group of pure translations that
+        map the structure onto itself. The candidate translations are the
+        vectors from one site of the least frequent species to every other
+        site of that species. Candidates are tried from shortest to longest,
+        skipping those already generated by the translations found so far.
+        Each candidate is tested against all sites at once, using a
+        linked-cell search on the fractional coordinates modulo lattice
+        translations. The primitive lattice is the lattice generated by the
+        translations and the original lattice vectors, and is found in one
+        pass without recursion. The resulting lattice is LLL reduced.
 
         NOTE: if the tolerance is greater than 1/2 the minimum inter-site
         distance, the algorithm may find 2 non-equivalent sites that are
-        within tolerance of each other. The algorithm will reject this
-        lattice.
+        within tolerance of each other. The algorithm will reject such
+        translations.
 
         Args:
             tolerance:
                 Tolerance for each coordinate of a particular site. For
                 example, [0.5, 0, 0.5] in cartesian coordinates will be
                 considered to be on the same coordinates as [0, 0, 0] for a
-                tolerance of 0.5. Defaults to 0.5.
+                tolerance of 0.5. Defaults to 0.25.
 
         Returns:
             The most primitive structure found. The returned structure is
             guanranteed to have len(new structure) <= len(structure).
         """
-        original_volume = self.volume
-        (reduced_formula, num_fu) =\
-            self.composition.get_reduced_composition_and_factor()
-
-        min_vol = original_volume * 0.5 / num_fu
-
-        #get the possible symmetry vectors
-        sites = sorted(self._sites, key=lambda site: site.species_string)
-        grouped_sites = [list(a[1]) for a
-                         in itertools.groupby(sites,
-                                              key=lambda s: s.species_string)]
-        min_site_list = min(grouped_sites, key=lambda group: len(group))
-
-        min_site_list = [site.to_unit_cell for site in min_site_list]
-        org = min_site_list[0].coords
-        possible_vectors = [min_site_list[i].coords - org
-                            for i in xrange(1, len(min_site_list))]
-
-        #Let's try to use the shortest vector possible first. Allows for faster
-        #convergence to primitive cell.
-        possible_vectors = sorted(possible_vectors,
-                                  key=lambda x: np.linalg.norm(x))
+        nsites = len(self)
+        if nsites < 2:
+            return self
 
-        # Pre-create a few varibles for faster lookup.
-        all_coords = [site.coords for site in sites]
+        #Group sites by species.
+        sites = sorted(self.sites, key=lambda site: site.species_string)
+        species_strings = [site.species_string for site in sites]
+        grouped_inds = [[i for i, _ in g] for _, g
+                        in itertools.groupby(enumerate(species_strings),
+                                             key=lambda x: x[1])]
+        sp_ids = np.zeros(nsites, dtype=np.int)
+        for i, inds in enumerate(grouped_inds):
+            sp_ids[inds] = i
         all_sp = [site.species_and_occu for site in sites]
-        new_structure = None
-
-        #all lattice points need to be projected to 0 under new basis
-        l_points = np.array([[0, 0, 1], [0, 1, 0], [0, 1, 1], [1, 0, 0],
-                             [1, 0, 1], [1, 1, 0], [1, 1, 1]])
-        l_points = self._lattice.get_cartesian_coords(l_points)
-
-        for v, repl_pos in itertools.product(possible_vectors, xrange(3)):
-            #Try combinations of new lattice vectors with existing lattice
-            #vectors.
-            latt = self._lattice.matrix
-            latt[repl_pos] = v
-
-            #Exclude coplanar lattices from consideration.
-            if abs(np.dot(np.cross(latt[0], latt[1]), latt[2])) < min_vol:
-                continue
-            latt = Lattice(latt)
-
-            #Convert to fractional tol
-            tol = tolerance / np.array(latt.abc)
-
-            #check validity of new basis
-            new_l_points = latt.get_fractional_coords(l_points)
-            f_l_dist = np.abs(new_l_points - np.round(new_l_points))
-            if np.any(f_l_dist > tol[None, None, :]):
-                continue
-
-            all_frac = latt.get_fractional_coords(np.array(all_coords))
-
-            #calculate grouping of equivalent sites, represented by
-            #adjacency matrix
-            fdist = all_frac[None, :, :] - all_frac[:, None, :]
+        all_frac = np.array([site.frac_coords for site in sites])
+        tol = tolerance / np.array(self._lattice.abc)
+
+        #Candidate translations are the vectors between sites of the least
+        #frequent species, shortest first.
+        min_inds = min(grouped_inds, key=len)
+        translations = all_frac[min_inds[1:]] - all_frac[min_inds[0]]
+        translations -= np.round(translations)
+        norms = np.sum(self._lattice.get_cartesian_coords(translations) ** 2,
+                       axis=1)
+        translations = translations[np.argsort(norms, kind="mergesort")]
+
+        #The valid translations form a group whose order divides the number
+        #of sites of each species, so g * t must be a lattice vector for
+        #every valid translation t. This cheaply discards most candidates.
+        g = reduce(fractions.gcd, [len(inds) for inds in grouped_inds])
+        gdist = np.abs(translations * g - np.round(translations * g))
+        translations = translations[np.all(gdist < g * tol, axis=1)]
+
+        def in_group(group, t):
+            fdist = group - t
             fdist = np.abs(fdist - np.round(fdist))
-            groups = np.all(fdist < tol[None, None, :], axis=2)
-
-            #check that all group sizes are the same
-            sizes = np.unique(np.sum(groups, axis=0))
-            if len(sizes) > 1:
+            return np.any(np.all(fdist < tol, axis=1))
+
+        def get_perm(t):
+            #Returns the indices of the sites that each site is mapped onto
+            #by translation t, or None if t is not a valid translation.
+            #Sites within tolerance in each fractional coordinate are within
+            #3 * tolerance in cartesian coordinates.
+            centers = np.mod(all_frac + t, 1)
+            cinds, pinds, images, dists = get_neighbor_list_pbc(
+                self._lattice, all_frac,
+                self._lattice.get_cartesian_coords(centers), 3 * tolerance)
+            fdist = np.abs(all_frac[pinds] + images - centers[cinds])
+            within = np.all(fdist < tol, axis=1) & \
+                (sp_ids[cinds] == sp_ids[pinds])
+            #Keep the nearest match for each translated site.
+            order = np.lexsort((dists[within], cinds[within]))
+            cinds, pinds = cinds[within][order], pinds[within][order]
+            cinds, first = np.unique(cinds, return_index=True)
+            if len(cinds) != nsites:
+                return None
+            perm = pinds[first]
+            if len(np.unique(perm)) != nsites:
+                return None
+            return perm
+
+        group = np.zeros((1, 3))
+        perms = []
+        for t in translations:
+            if len(group) == g:
+                break
+            if in_group(group, t):
                 continue
-
-            #check that reduction in number of sites was by the same
-            #amount as the volume reduction
-            if round(self._lattice.volume / latt.volume) != sizes[0]:
+            perm = get_perm(t)
+            if perm is None:
                 continue
+            perms.append(perm)
+            #Extend the group by the cosets of t.
+            cosets = [group]
+            while not in_group(group, len(cosets) * t):
+                cosets.append(group + len(cosets) * t)
+                if len(cosets) * len(group) > g:
+                    return self
+            group = np.concatenate(cosets)
+            group -= np.floor(group)
+
+        ntrans = len(group)
+        if ntrans == 1:
+            return self
 
-            new_sp = []
-            new_frac = []
-            #this flag is set to ensure that all sites in a group are
-            #the same species, it is set to false if a group is found
-            #where this is not the case
-            correct = True
-
-            added = np.zeros(len(groups), dtype='bool')
-            for i, g in enumerate(groups):
-                if added[i]:
-                    continue
-                indices = np.where(g)[0]
-                i0 = indices[0]
-                sp = all_sp[i0]
-                added[indices] = 1
-                if not all([all_sp[i] == sp for i in indices]):
-                    correct = False
-                    break
-                new_sp.append(all_sp[i0])
-                new_frac.append(all_frac[i0])
-
-            if correct:
-                new_structure = Structure(latt, new_sp, new_frac,
-                                          to_unit_cell=True)
+        #The sites in each orbit of the translation group are equivalent.
+        #The representative of each orbit is the site with the lowest index.
+        reps = np.arange(nsites)
+        while True:
+            new_reps = reps
+            for perm in perms:
+                new_reps = np.minimum(new_reps, new_reps[perm])
+            if np.all(new_reps == reps):
                 break
+            reps = new_reps
+        rep_inds = np.unique(reps)
+        if len(rep_inds) * ntrans != nsites or \
+                np.any(np.bincount(reps)[rep_inds] != ntrans):
+            return self
 
-        if new_structure and len(new_structure) != len(self):
-            # If a more primitive structure has been found, try to find an
-            # even more primitive structure again.
-            return new_structure.get_primitive_structure(tolerance=tolerance)
-        else:
+        #ntrans * t is a lattice vector for every translation t in the group.
+        #The primitive lattice is found from the integer span of these
+        #vectors and the original lattice vectors.
+        generators = np.concatenate([np.eye(3) * ntrans, group * ntrans])
+        basis = _get_integer_basis(np.round(generators).astype(np.int))
+        if abs(round(np.linalg.det(basis))) * ntrans != ntrans ** 3:
             return self
+        new_matrix = np.dot(basis / ntrans, self._lattice.matrix)
+        latt = Lattice(new_matrix).get_lll_reduced_lattice()
+
+        cart_coords = self._lattice.get_cartesian_coords(all_frac[rep_inds])
+        return Structure(latt, [all_sp[i] for i in rep_inds],
+                         latt.get_fractional_coords(cart_coords),
+                         to_unit_cell=True)
 
     def __repr__(self):
         outs = ["Structure Summary", repr(self.lattice)]
@@ -861,8 +1010,20 @@ class Structure(SiteCollection, MSONable):
             Structure object
         """
         lattice = Lattice.from_dict(d["lattice"])
-        sites = [PeriodicSite.from_dict(sd, lattice) for sd in d["sites"]]
-        return Structure.from_sites(sites)
+        species = []
+        props = collections.defaultdict(list)
+        for sd in d["sites"]:
+            atoms_n_occu = {}
+            for sp_occu in sd["species"]:
+                sp = Specie.from_dict(sp_occu) \
+                    if "oxidation_state" in sp_occu \
+                    else Element(sp_occu["element"])
+                atoms_n_occu[sp] = sp_occu["occu"]
+            species.append(atoms_n_occu)
+            for k, v in sd.get("properties", {}).items():
+                props[k].append(v)
+        return Structure(lattice, species, [sd["abc"] for sd in d["sites"]],
+                         site_properties=props)
 
 
 class Molecule(SiteCollection, MSONable):
@@ -1183,6 +1344,103 @@ class Molecule(SiteCollection, MSONable):
                          site_properties=self.site_properties)
 
 
+def _get_integer_basis(vectors):
+    """
+    Finds a basis for the lattice spanned by a set of integer vectors using
+    integer row reduction, i.e., the rows of the Hermite normal form.
+
+    Args:
+        vectors:
+            Sequence of integer 3-vectors, which must span 3 dimensions.
+
+    Returns:
+        3x3 integer numpy array with the basis vectors as rows.
+    """
+    rows = [[int(i) for i in v] for v in vectors]
+    basis = []
+    for col in xrange(3):
+        rows = [r for r in rows if any(r)]
+        nonzero = [r for r in rows if r[col] != 0]
+        while len(nonzero) > 1:
+            pivot = min(nonzero, key=lambda r: abs(r[col]))
+            for r in nonzero:
+                if r is not pivot:
+                    q = r[col] // pivot[col]
+                    for k in xrange(3):
+                        r[k] -= q * pivot[k]
+            nonzero = [r for r in rows if r[col] != 0]
+        pivot = nonzero[0]
+        basis.append(pivot)
+        rows = [r for r in rows if r is not pivot]
+    return np.array(basis)
+
+
+def _index_species(species, unique_species):
+    """
+    Converts a sequence of species inputs into indices into a list of unique
+    species and occupancies, which is extended as needed.
+
+    Args:
+        species:
+            Sequence of species on each site, in any of the forms accepted by
+            Site.
+        unique_species:
+            List of unique species and occupancies as Compositions. New
+            species are appended to this list.
+
+    Returns:
+        List of indices into unique_species for each site.
+    """
+    #Specie equality ignores optional properties such as spin, so these are
+    #made part of the lookup key.
+    def get_key(comp):
+        return tuple(sorted((sp, amt,
+                             tuple(sorted(getattr(sp, "_properties",
+                                                  {}).items())))
+                            for sp, amt in comp.items()))
+
+    lookup = {}
+    for i, comp in enumerate(unique_species):
+        lookup[get_key(comp)] = i
+    #Inputs which are seen more than once (e.g., the same symbol or the same
+    #Composition object) are only converted once.
+    seen = {}
+    indices = []
+    for sp in species:
+        if isinstance(sp, (basestring, int, Element)):
+            seen_key = sp
+        else:
+            seen_key = id(sp)
+        if seen_key in seen:
+            indices.append(seen[seen_key])
+            continue
+        if isinstance(sp, collections.Mapping):
+            if len(sp) == 1 and sp.values()[0] == 1:
+                comp = get_ordered_species(sp.keys()[0])
+            elif isinstance(sp, Composition):
+                comp = sp
+            else:
+                comp = Composition({smart_element_or_specie(k): v
+                                    for k, v in sp.items()})
+            if comp.num_atoms > 1:
+                raise ValueError("Species occupancies sum to more than 1!")
+        else:
+            comp = get_ordered_species(sp)
+        try:
+            key = get_key(comp)
+        except TypeError:
+            #Unhashable species properties. Do not share the entry.
+            key = None
+        if key is None or key not in lookup:
+            unique_species.append(comp)
+            if key is not None:
+                lookup[key] = len(unique_species) - 1
+        ind = lookup[key] if key is not None else len(unique_species) - 1
+        seen[seen_key] = ind
+        indices.append(ind)
+    return indices
+
+
 class StructureError(Exception):
     """
     Exception class for Structure.
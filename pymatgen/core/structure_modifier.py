@@ -20,11 +20,14 @@ import warnings
 import collections
 
 import numpy as np
-from pymatgen.core.periodic_table import Specie, Element
+from pymatgen.core.periodic_table import Specie, Element, \
+    smart_element_or_specie
 from pymatgen.core.lattice import Lattice
-from pymatgen.core.sites import PeriodicSite, Site
+from pymatgen.core.sites import Site, get_ordered_species
 from pymatgen.core.structure import Structure, Molecule
-from pymatgen.util.coord_utils import get_points_in_sphere_pbc
+from pymatgen.core.composition import Composition
+from pymatgen.util.coord_utils import get_neighbor_list_pbc, \
+    pbc_all_distances
 
 
 class StructureModifier(object):
@@ -50,7 +53,11 @@ class StructureModifier(object):
 
 class StructureEditor(StructureModifier):
     """
-    Editor for adding, removing and changing sites from a structure
+    Editor for adding, removing and changing sites from a structure. The
+    editor is a mutable, array-backed builder, i.e., the species, fractional
+    coordinates and site properties are stored as arrays which are modified
+    in place, and a Structure is only created when modified_structure is
+    called.
     """
     DISTANCE_TOLERANCE = 0.01
 
@@ -62,7 +69,63 @@ class StructureEditor(StructureModifier):
         """
         self._original_structure = structure
         self._lattice = structure.lattice
-        self._sites = list(structure.sites)
+        #Species are stored as a list of unique species and occupancies and
+        #an array of indices into that list.
+        self._unique_species = []
+        self._unique_ids = {}
+        self._species_indices = np.array(
+            [self._get_species_index(sp)
+             for sp in structure.species_and_occu], dtype=np.int)
+        self._frac_coords = structure.frac_coords
+        self._site_properties = {k: list(v) for k, v
+                                 in structure.site_properties.items()}
+
+    def _get_species_index(self, species):
+        """
+        Returns the index of a species and occupancy Composition in the list
+        of unique species, adding it if necessary. Compositions are compared
+        by identity, which is cheap since the species of ordered sites are
+        shared.
+        """
+        ind = self._unique_ids.get(id(species))
+        if ind is None:
+            ind = len(self._unique_species)
+            self._unique_species.append(species)
+            self._unique_ids[id(species)] = ind
+        return ind
+
+    def _map_species(self, func):
+        """
+        Replaces the species and occupancy of every site by
+        func(species_and_occu). func is called once for each unique species
+        and occupancy, and may return None to remove the species from the
+        site.
+        """
+        #All new species are computed before the editor is modified, so
+        #that an exception in func leaves the editor unchanged.
+        new_species = [func(comp) for comp in self._unique_species]
+        self._unique_species = []
+        self._unique_ids = {}
+        mapping = np.zeros(len(new_species), dtype=np.int)
+        for i, new_comp in enumerate(new_species):
+            mapping[i] = -1 if new_comp is None \
+                else self._get_species_index(_get_species_and_occu(new_comp))
+        if len(self._species_indices):
+            self._species_indices = mapping[self._species_indices]
+        self._delete(np.where(self._species_indices == -1)[0])
+
+    def _delete(self, indices):
+        """
+        Deletes the sites at indices. Negative indices count from the end.
+        """
+        indices = np.arange(len(self._species_indices))[
+            np.atleast_1d(np.array(indices, dtype=np.int))]
+        self._species_indices = np.delete(self._species_indices, indices)
+        self._frac_coords = np.delete(self._frac_coords, indices, axis=0)
+        indices = set(indices)
+        for k, v in self._site_properties.items():
+            self._site_properties[k] = [p for i, p in enumerate(v)
+                                        if i not in indices]
 
     def add_site_property(self, property_name, values):
         """
@@ -74,17 +137,12 @@ class StructureEditor(StructureModifier):
             values:
                 A sequence of values. Must be same length as number of sites.
         """
-        if len(values) != len(self._sites):
+        if len(values) != len(self._species_indices):
             raise ValueError("Values must be same length as sites.")
-        for i in xrange(len(self._sites)):
-            site = self._sites[i]
-            props = site.properties
-            if not props:
-                props = {}
-            props[property_name] = values[i]
-            self._sites[i] = PeriodicSite(site.species_and_occu,
-                                          site.frac_coords, self._lattice,
-                                          properties=props)
+        if property_name not in Site.supported_properties:
+            raise ValueError("{} is not a supported property"
+                             .format(property_name))
+        self._site_properties[property_name] = list(values)
 
     def replace_species(self, species_mapping):
         """
@@ -99,30 +157,20 @@ class StructureEditor(StructureModifier):
                 {Element('Si): {Element('Ge'):0.75, Element('C'):0.25} } will
                 have .375 Ge and .125 C.
         """
-        def mod_site(site):
-            new_atom_occu = dict()
-            for sp, amt in site.species_and_occu.items():
+        def mod_species(species_and_occu):
+            new_atom_occu = collections.defaultdict(float)
+            for sp, amt in species_and_occu.items():
                 if sp in species_mapping:
                     if isinstance(species_mapping[sp], (Element, Specie)):
-                        if species_mapping[sp] in new_atom_occu:
-                            new_atom_occu[species_mapping[sp]] += amt
-                        else:
-                            new_atom_occu[species_mapping[sp]] = amt
+                        new_atom_occu[species_mapping[sp]] += amt
                     elif isinstance(species_mapping[sp], dict):
                         for new_sp, new_amt in species_mapping[sp].items():
-                            if new_sp in new_atom_occu:
-                                new_atom_occu[new_sp] += amt * new_amt
-                            else:
-                                new_atom_occu[new_sp] = amt * new_amt
+                            new_atom_occu[new_sp] += amt * new_amt
                 else:
-                    if sp in new_atom_occu:
-                        new_atom_occu[sp] += amt
-                    else:
-                        new_atom_occu[sp] = amt
-            return PeriodicSite(new_atom_occu, site.frac_coords, self._lattice,
-                                properties=site.properties)
+                    new_atom_occu[sp] += amt
+            return new_atom_occu
 
-        self._sites = map(mod_site, self._sites)
+        self._map_species(mod_species)
 
     def replace_site(self, index, species_n_occu):
         """
@@ -135,11 +183,8 @@ class StructureEditor(StructureModifier):
             species:
                 A species object.
         """
-        self._sites[index] = PeriodicSite(species_n_occu,
-                                          self._sites[index].frac_coords,
-                                          self._lattice,
-                                          properties=self._sites[index].
-                                          properties)
+        self._species_indices[index] = self._get_species_index(
+            _get_species_and_occu(species_n_occu))
 
     def remove_species(self, species):
         """
@@ -149,15 +194,12 @@ class StructureEditor(StructureModifier):
             species:
                 species to remove.
         """
-        new_sites = []
-        for site in self._sites:
-            new_sp_occu = {sp: amt for sp, amt in site.species_and_occu.items()
+        def mod_species(species_and_occu):
+            new_sp_occu = {sp: amt for sp, amt in species_and_occu.items()
                            if sp not in species}
-            if len(new_sp_occu) > 0:
-                new_sites.append(PeriodicSite(new_sp_occu, site.frac_coords,
-                                              self._lattice,
-                                              properties=site.properties))
-        self._sites = new_sites
+            return new_sp_occu if len(new_sp_occu) > 0 else None
+
+        self._map_species(mod_species)
 
     def append_site(self, species, coords, coords_are_cartesian=False,
                     validate_proximity=True):
@@ -175,7 +217,7 @@ class StructureEditor(StructureModifier):
                 Whether to check if inserted site is too close to an existing
                 site. Defaults to True.
         """
-        self.insert_site(len(self._sites), species, coords,
+        self.insert_site(len(self._species_indices), species, coords,
                          coords_are_cartesian, validate_proximity)
 
     def insert_site(self, i, species, coords, coords_are_cartesian=False,
@@ -195,22 +237,39 @@ class StructureEditor(StructureModifier):
             validate_proximity:
                 Whether to check if inserted site is too close to an existing
                 site. Defaults to True.
+            properties:
+                Properties associated with the new site as a dict, e.g.
+                {"magmom": 5}. Defaults to None. Sites which do not have a
+                property that other sites have are assigned None.
         """
-        if not coords_are_cartesian:
-            new_site = PeriodicSite(species, coords, self._lattice,
-                                    properties=properties)
-        else:
+        if coords_are_cartesian:
             frac_coords = self._lattice.get_fractional_coords(coords)
-            new_site = PeriodicSite(species, frac_coords, self._lattice,
-                                    properties=properties)
-
-        if validate_proximity:
-            for site in self._sites:
-                if site.distance(new_site) < self.DISTANCE_TOLERANCE:
-                    raise ValueError("New site is too close to an existing "
-                                     "site!")
-
-        self._sites.insert(i, new_site)
+        else:
+            frac_coords = np.array(coords, dtype=np.float64)
+        properties = properties if properties else {}
+        for k in properties:
+            if k not in Site.supported_properties:
+                raise ValueError("{} is not a supported property".format(k))
+        ind = self._get_species_index(_get_species_and_occu(species))
+
+        if validate_proximity and len(self._frac_coords):
+            dists = pbc_all_distances(self._lattice, self._frac_coords,
+                                      [frac_coords])
+            if np.any(dists < self.DISTANCE_TOLERANCE):
+                raise ValueError("New site is too close to an existing "
+                                 "site!")
+
+        nsites = len(self._species_indices)
+        if i < 0:
+            i = max(0, nsites + i)
+        self._species_indices = np.insert(self._species_indices, i, ind)
+        self._frac_coords = np.insert(self._frac_coords, i, frac_coords,
+                                      axis=0)
+        for k in properties:
+            if k not in self._site_properties:
+                self._site_properties[k] = [None] * nsites
+        for k, v in self._site_properties.items():
+            v.insert(i, properties.get(k))
 
     def delete_site(self, i):
         """
@@ -220,7 +279,7 @@ class StructureEditor(StructureModifier):
             i:
                 index of site to delete.
         """
-        del(self._sites[i])
+        self._delete([i])
 
     def delete_sites(self, indices):
         """
@@ -230,8 +289,7 @@ class StructureEditor(StructureModifier):
             indices:
                 sequence of indices of sites to delete.
         """
-        self._sites = [self._sites[i] for i in range(len(self._sites))
-                       if i not in indices]
+        self._delete(list(indices))
 
     def apply_operation(self, symmop):
         """
@@ -243,15 +301,11 @@ class StructureEditor(StructureModifier):
             symmop:
                 Symmetry operation to apply.
         """
+        cart_coords = self._lattice.get_cartesian_coords(self._frac_coords)
         self._lattice = Lattice([symmop.apply_rotation_only(row)
                                  for row in self._lattice.matrix])
-
-        def operate_site(site):
-            new_cart = symmop.operate(site.coords)
-            new_frac = self._lattice.get_fractional_coords(new_cart)
-            return PeriodicSite(site.species_and_occu, new_frac, self._lattice,
-                                properties=site.properties)
-        self._sites = map(operate_site, self._sites)
+        self._frac_coords = self._lattice.get_fractional_coords(
+            symmop.operate_multi(cart_coords))
 
     def modify_lattice(self, new_lattice):
         """
@@ -263,13 +317,6 @@ class StructureEditor(StructureModifier):
                 New lattice
         """
         self._lattice = new_lattice
-        new_sites = []
-        for site in self._sites:
-            new_sites.append(PeriodicSite(site.species_and_occu,
-                                          site.frac_coords,
-                                          self._lattice,
-                                          properties=site.properties))
-        self._sites = new_sites
 
     def apply_strain(self, strain):
         """
@@ -293,23 +340,21 @@ class StructureEditor(StructureModifier):
             sites:
                 List of site indices on which to perform the translation.
             vector:
-                Translation vector for sites.
+                Translation vector for sites. Can also be a sequence of
+                vectors, one for each site.
             frac_coords:
                 Boolean stating whether the vector corresponds to fractional or
                 cartesian coordinates.
         """
-        for i in indices:
-            site = self._sites[i]
-            if frac_coords:
-                fcoords = site.frac_coords + vector
-            else:
-                fcoords = self._lattice.get_fractional_coords(site.coords
-                                                              + vector)
-            new_site = PeriodicSite(site.species_and_occu, fcoords,
-                                    self._lattice, to_unit_cell=True,
-                                    coords_are_cartesian=False,
-                                    properties=site.properties)
-            self._sites[i] = new_site
+        indices = np.array(indices, dtype=np.int)
+        if frac_coords:
+            fcoords = self._frac_coords[indices] + vector
+        else:
+            cart_coords = self._lattice.get_cartesian_coords(
+                self._frac_coords[indices])
+            fcoords = self._lattice.get_fractional_coords(cart_coords
+                                                          + vector)
+        self._frac_coords[indices] = np.mod(fcoords, 1)
 
     def perturb_structure(self, distance=0.1):
         """
@@ -320,14 +365,17 @@ class StructureEditor(StructureModifier):
             distance:
                 distance in angstroms by which to perturb each site.
         """
-        def get_rand_vec():
-            #deals with zero vectors.
-            vector = np.random.randn(3)
-            vnorm = np.linalg.norm(vector)
-            return vector / vnorm * distance if vnorm != 0 else get_rand_vec()
-
-        for i in range(len(self._sites)):
-            self.translate_sites([i], get_rand_vec(), frac_coords=False)
+        nsites = len(self._species_indices)
+        vectors = np.random.randn(nsites, 3)
+        vnorms = np.sqrt(np.sum(vectors ** 2, axis=1))
+        #deals with zero vectors.
+        while np.any(vnorms == 0):
+            zero = vnorms == 0
+            vectors[zero] = np.random.randn(np.sum(zero), 3)
+            vnorms = np.sqrt(np.sum(vectors ** 2, axis=1))
+        self.translate_sites(np.arange(nsites),
+                             vectors / vnorms[:, None] * distance,
+                             frac_coords=False)
 
     def add_oxidation_state_by_element(self, oxidation_states):
         """
@@ -340,18 +388,12 @@ class StructureEditor(StructureModifier):
                 dict of oxidation states.
                 E.g., {"Li":1, "Fe":2, "P":5, "O":-2}
         """
-        try:
-            for i, site in enumerate(self._sites):
-                new_sp = {}
-                for el, occu in site.species_and_occu.items():
-                    sym = el.symbol
-                    new_sp[Specie(sym, oxidation_states[sym])] = occu
-                new_site = PeriodicSite(new_sp, site.frac_coords,
-                                        self._lattice,
-                                        coords_are_cartesian=False,
-                                        properties=site.properties)
-                self._sites[i] = new_site
+        def mod_species(species_and_occu):
+            return {Specie(el.symbol, oxidation_states[el.symbol]): occu
+                    for el, occu in species_and_occu.items()}
 
+        try:
+            self._map_species(mod_species)
         except KeyError:
             raise ValueError("Oxidation state of all elements must be "
                              "specified in the dictionary.")
@@ -365,36 +407,32 @@ class StructureEditor(StructureModifier):
                 List of oxidation states.
                 E.g., [1, 1, 1, 1, 2, 2, 2, 2, 5, 5, 5, 5, -2, -2, -2, -2]
         """
-        try:
-            for i, site in enumerate(self._sites):
-                new_sp = {}
-                for el, occu in site.species_and_occu.items():
-                    sym = el.symbol
-                    new_sp[Specie(sym, oxidation_states[i])] = occu
-                new_site = PeriodicSite(new_sp, site.frac_coords,
-                                        self._lattice,
-                                        coords_are_cartesian=False,
-                                        properties=site.properties)
-                self._sites[i] = new_site
-
-        except IndexError:
+        if len(oxidation_states) < len(self._species_indices):
             raise ValueError("Oxidation state of all sites must be "
                              "specified in the dictionary.")
+        #Sites with the same species and oxidation state share the new
+        #species.
+        new_species = {}
+        for i, (ind, oxi) in enumerate(zip(self._species_indices,
+                                           oxidation_states)):
+            if (ind, oxi) not in new_species:
+                new_species[(ind, oxi)] = _get_species_and_occu(
+                    {Specie(el.symbol, oxi): occu for el, occu
+                     in self._unique_species[ind].items()})
+            self._species_indices[i] = self._get_species_index(
+                new_species[(ind, oxi)])
 
     def remove_oxidation_states(self):
         """
         Removes oxidation states from a structure.
         """
-        for i, site in enumerate(self._sites):
+        def mod_species(species_and_occu):
             new_sp = collections.defaultdict(float)
-            for el, occu in site.species_and_occu.items():
-                sym = el.symbol
-                new_sp[Element(sym)] += occu
-            new_site = PeriodicSite(new_sp, site.frac_coords,
-                                    self._lattice,
-                                    coords_are_cartesian=False,
-                                    properties=site.properties)
-            self._sites[i] = new_site
+            for el, occu in species_and_occu.items():
+                new_sp[Element(el.symbol)] += occu
+            return new_sp
+
+        self._map_species(mod_species)
 
     def to_unit_cell(self, tolerance=0.1):
         """
@@ -402,19 +440,19 @@ class StructureEditor(StructureModifier):
         If there is a site within the tolerance already there, the site is
         deleted instead of moved.
         """
-        new_sites = []
-        for site in self._sites:
-            if not new_sites:
-                new_sites.append(site)
-                frac_coords = np.array([site.frac_coords])
-                continue
-            if len(get_points_in_sphere_pbc(self._lattice, frac_coords,
-                                            site.coords, tolerance)):
-                continue
-            frac_coords = np.append(frac_coords, [site.frac_coords % 1],
-                                    axis=0)
-            new_sites.append(site.to_unit_cell)
-        self._sites = new_sites
+        self._frac_coords = np.mod(self._frac_coords, 1)
+        centers, points, images, dists = get_neighbor_list_pbc(
+            self._lattice, self._frac_coords,
+            self._lattice.get_cartesian_coords(self._frac_coords), tolerance)
+        #A site is deleted if it is close to an earlier site that is kept.
+        earlier = points < centers
+        centers, points = centers[earlier], points[earlier]
+        bounds = np.searchsorted(centers,
+                                 np.arange(len(self._frac_coords) + 1))
+        keep = np.ones(len(self._frac_coords), dtype=np.bool)
+        for i in np.where(bounds[1:] > bounds[:-1])[0]:
+            keep[i] = not np.any(keep[points[bounds[i]:bounds[i + 1]]])
+        self._delete(np.where(np.logical_not(keep))[0])
 
     @property
     def original_structure(self):
@@ -425,14 +463,30 @@ class StructureEditor(StructureModifier):
 
     @property
     def modified_structure(self):
-        coords = [site.frac_coords for site in self._sites]
-        species = [site.species_and_occu for site in self._sites]
-        props = {}
-        if self._sites[0].properties:
-            for k in self._sites[0].properties.keys():
-                props[k] = [site.properties[k] for site in self._sites]
-        return Structure(self._lattice, species, coords, False,
-                         site_properties=props)
+        """
+        The modified structure, as a new immutable Structure.
+        """
+        return Structure(self._lattice,
+                         [self._unique_species[i]
+                          for i in self._species_indices],
+                         np.copy(self._frac_coords),
+                         site_properties={k: list(v) for k, v
+                                          in self._site_properties.items()})
+
+
+def _get_species_and_occu(species):
+    """
+    Converts any of the species inputs accepted by Site to a Composition of
+    species and occupancies. The Compositions of ordered sites are shared.
+    """
+    if isinstance(species, collections.Mapping):
+        if len(species) == 1 and species.values()[0] == 1:
+            return get_ordered_species(species.keys()[0])
+        if isinstance(species, Composition):
+            return species
+        return Composition({smart_element_or_specie(k): v
+                            for k, v in species.items()})
+    return get_ordered_species(species)
 
 
 class SupercellMaker(StructureModifier):
@@ -457,32 +511,25 @@ class SupercellMaker(StructureModifier):
                 are the lattice vectors of the original structure.
         """
         self._original_structure = structure
-        old_lattice = structure.lattice
-        scale_matrix = np.array(scaling_matrix)
-        new_lattice = Lattice(np.dot(scale_matrix, old_lattice.matrix))
-        new_sites = []
-
-        def range_vec(i):
-            return range(max(scale_matrix[:][:, i])
-                         - min(scale_matrix[:][:, i]) + 1)
-
-        for site in structure.sites:
-            for (i, j, k) in itertools.product(range_vec(0), range_vec(1),
-                                               range_vec(2)):
-                fcoords = site.frac_coords + np.array([i, j, k])
-                coords = old_lattice.get_cartesian_coords(fcoords)
-                new_coords = new_lattice.get_fractional_coords(coords)
-                new_site = PeriodicSite(site.species_and_occu, new_coords,
-                                        new_lattice,
-                                        properties=site.properties)
-                contains_site = False
-                for s in new_sites:
-                    if s.is_periodic_image(new_site):
-                        contains_site = True
-                        break
-                if not contains_site:
-                    new_sites.append(new_site)
-        self._modified_structure = Structure.from_sites(new_sites)
+        scale_matrix = np.array(scaling_matrix, dtype=np.int)
+        new_lattice = Lattice(np.dot(scale_matrix, structure.lattice.matrix))
+
+        #The fractional coordinates of all images are computed at once. The
+        #images of each site are kept together, in the same order as the
+        #sites of the original structure.
+        inv_matrix = np.linalg.inv(scale_matrix)
+        trans = _get_lattice_points_in_supercell(scale_matrix)
+        fcoords = structure.frac_coords[:, None, :] + trans[None, :, :]
+        new_fcoords = np.dot(fcoords.reshape((-1, 3)), inv_matrix)
+
+        ntrans = len(trans)
+        species = [sp for sp in structure.species_and_occu
+                   for i in xrange(ntrans)]
+        props = {k: [p for p in v for i in xrange(ntrans)]
+                 for k, v in structure.site_properties.items()}
+        self._modified_structure = Structure(new_lattice, species,
+                                             new_fcoords,
+                                             site_properties=props)
 
     @property
     def original_structure(self):
@@ -493,6 +540,39 @@ class SupercellMaker(StructureModifier):
         return self._modified_structure
 
 
+def _get_lattice_points_in_supercell(scale_matrix):
+    """
+    Returns the lattice points of the original lattice which lie in the
+    supercell defined by an integer scaling matrix, i.e., one translation
+    vector for each copy of the original cell in the supercell.
+
+    Args:
+        scale_matrix:
+            3x3 integer scaling matrix.
+
+    Returns:
+        (|det(scale_matrix)|, 3) integer array of translations in the
+        fractional coordinates of the original lattice.
+    """
+    det = int(round(np.linalg.det(scale_matrix)))
+    if det == 0:
+        raise ValueError("Scaling matrix must be non-singular.")
+    #The corners of the supercell in the fractional coordinates of the
+    #original lattice give a bounding box of the lattice points.
+    corners = np.dot(np.array(list(itertools.product((0, 1), repeat=3))),
+                     scale_matrix)
+    lo = np.min(corners, axis=0)
+    hi = np.max(corners, axis=0) + 1
+    points = np.mgrid[lo[0]:hi[0], lo[1]:hi[1], lo[2]:hi[2]]
+    points = points.reshape((3, -1)).T
+    #Fractional coordinates of the points in the supercell are
+    #points * adj / det, which is computed exactly in integers.
+    adj = np.round(np.linalg.inv(scale_matrix) * det).astype(np.int)
+    x = np.dot(points, adj) * (1 if det > 0 else -1)
+    inside = np.all((x >= 0) & (x < abs(det)), axis=1)
+    return points[inside]
+
+
 class OxidationStateDecorator(StructureModifier):
     """
     .. deprecated:: v2.1.3
@@ -583,8 +663,8 @@ class BasisChange(StructureModifier):
                 a pymatgen.core.Lattice object
         """
         self._original_structure = structure
-        sp = [site.species_and_occu for site in structure._sites]
-        coords = [site.coords for site in structure._sites]
+        sp = structure.species_and_occu
+        coords = structure.cart_coords
         self._modified_structure = Structure(new_lattice, sp, coords,
                                              validate_proximity=False,
                                              to_unit_cell=True,
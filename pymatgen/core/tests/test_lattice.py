@@ -3,7 +3,7 @@
 from __future__ import division
 
 import unittest
-from pymatgen.core.lattice import Lattice
+from pymatgen.core.lattice import Lattice, reduce_lattices
 import numpy as np
 
 
@@ -171,6 +171,92 @@ class  LatticeTestCase(unittest.TestCase):
         self.assertTrue(np.allclose(latt.get_niggli_reduced_lattice().matrix,
                                     ans, atol=1e-5))
 
+        #All angles must be either acute or obtuse.
+        latt = Lattice([[0, 1, 2], [0, -2, 3], [1, 3, 2]])
+        reduced_cell = latt.get_niggli_reduced_lattice()
+        for a in reduced_cell.angles:
+            self.assertGreater(a, 90)
+
+    def test_reduction_cache(self):
+        m = [[0, 1, 2], [0, -2, 3], [1, 3, 2]]
+        latt = Lattice(m)
+        for reduce, get_mapping in [
+                (latt.get_niggli_reduced_lattice, latt.get_niggli_mapping),
+                (latt.get_lll_reduced_lattice, latt.get_lll_mapping)]:
+            reduced = reduce()
+            self.assertIs(reduce(), reduced)
+            self.assertTrue(np.allclose(np.dot(get_mapping(), m),
+                                        reduced.matrix))
+        self.assertTrue(np.allclose(latt.matrix, m))
+
+    def test_reduce_lattices(self):
+        #Lattices with known reduced cells are reduced together with random
+        #ones, which must not change their results.
+        niggli = {
+            0: [[-1.432950, -2.481942, 0.0],
+                [-2.8659, 0.0, 0.0],
+                [-1.432950, -0.827314, -4.751000]],
+            1: [[-2.578932, -0.826965, 0.000000],
+                [0.831059, -2.067413, -1.547813],
+                [0.458407, 2.480895, -1.129126]]}
+        lll = {
+            2: [[0.0, 1.0, 0.0], [1.0, 0.0, 1.0], [-2.0, 0.0, 1.0]],
+            3: [[-4.298850, 2.481942, 0.000000],
+                [2.865900, 4.963884, 0.000000],
+                [0.000000, 0.000000, 14.253000]]}
+        matrices = [
+            Lattice([1.432950, 0.827314, 4.751000, -1.432950, 0.827314,
+                     4.751000, 0.0, -1.654628, 4.751000]).matrix,
+            Lattice.from_parameters(7.365450, 6.199506, 5.353878,
+                                    75.542191, 81.181757,
+                                    156.396627).matrix,
+            np.reshape([1.0, 1, 1, -1.0, 0, 2, 3.0, 5, 6], (3, 3)),
+            np.reshape([7.164750, 2.481942, 0.000000, -4.298850, 2.481942,
+                        0.000000, 0.000000, 0.000000, 14.253000], (3, 3))]
+        rng = np.random.RandomState(0)
+        matrices.extend([rng.rand(3, 3) + np.eye(3) for i in range(20)])
+        #Unimodular transformations of the same lattice.
+        shear = np.array([[1, 2, 0], [0, 1, -1], [1, 0, 1]])
+        matrices.extend([np.dot(shear, m) for m in matrices[4:]])
+        nrand = 20
+
+        for algo, known in (("niggli", niggli), ("LLL", lll)):
+            reduced = reduce_lattices(matrices, algo)
+            for i, ans in known.items():
+                self.assertTrue(np.allclose(reduced[i].matrix, ans,
+                                            atol=1e-5))
+            for m, r in zip(matrices, reduced):
+                #The reduced lattice is the same lattice.
+                mapping = np.dot(r.matrix, np.linalg.inv(m))
+                self.assertTrue(np.allclose(mapping, np.round(mapping),
+                                            atol=1e-6))
+                self.assertAlmostEqual(abs(np.linalg.det(mapping)), 1)
+            for i in xrange(4, 4 + nrand):
+                r1, r2 = reduced[i].matrix, reduced[i + nrand].matrix
+                if algo == "niggli":
+                    #The Niggli cell is unique.
+                    self.assertTrue(np.allclose(np.dot(r1, r1.T),
+                                                np.dot(r2, r2.T)))
+                    abc = reduced[i].abc
+                    self.assertTrue(abc[0] <= abc[1] + 1e-5)
+                    self.assertTrue(abc[1] <= abc[2] + 1e-5)
+                else:
+                    #Size reduction and Lovasz conditions.
+                    q, rr = np.linalg.qr(r1.T)
+                    u = rr / np.diag(rr)[:, None]
+                    for k in xrange(3):
+                        for j in xrange(k):
+                            self.assertLessEqual(abs(u[j, k]), 0.5 + 1e-8)
+                    for k in xrange(1, 3):
+                        self.assertGreaterEqual(
+                            rr[k, k] ** 2 + rr[k - 1, k] ** 2 + 1e-8,
+                            0.75 * rr[k - 1, k - 1] ** 2)
+            #Results are cached on Lattice objects.
+            latt = Lattice(matrices[0])
+            self.assertIs(reduce_lattices([latt], algo)[0],
+                          reduce_lattices([latt], algo)[0])
+        self.assertRaises(ValueError, reduce_lattices, matrices, "foo")
+
     def test_find_mapping(self):
         m = np.array([[0.1, 0.2, 0.3], [-0.1, 0.2, 0.7], [0.6, 0.9, 0.2]])
         latt = Lattice(m)
@@ -14,6 +14,7 @@ __email__ = "shyue@mit.edu"
 __date__ = "Jul 17, 2012"
 
 import unittest
+import collections
 import numpy as np
 import pickle
 
@@ -188,6 +189,22 @@ class PeriodicSiteTest(unittest.TestCase):
         val = [0.25, 0.35, 0.46]
         self.assertTrue(np.allclose(site.frac_coords, val))
 
+    def test_compact(self):
+        site = PeriodicSite({"Fe": 1}, [0, 0, 0], self.lattice)
+        self.assertFalse(hasattr(site, "__dict__"))
+        self.assertIs(site.species_and_occu, self.site.species_and_occu)
+        self.assertIsInstance(site, collections.Mapping)
+        self.assertEqual(site.items(), [(Element("Fe"), 1)])
+        self.assertEqual(site.get("Mn", 0), 0)
+        spin_site = PeriodicSite(Specie("Fe", 2, {"spin": 5}), [0, 0, 0],
+                                 self.lattice)
+        self.assertIsNot(spin_site.species_and_occu,
+                         self.propertied_site.species_and_occu)
+        self.assertEqual(spin_site.specie.spin, 5)
+        site = pickle.loads(pickle.dumps(self.propertied_site))
+        self.assertEqual(site, self.propertied_site)
+        self.assertEqual(site.frac_coords.tolist(), [0.25, 0.35, 0.45])
+
 
 def get_distance_and_image_old(site1, site2, jimage=None):
     """
@@ -8,6 +8,7 @@ from pymatgen.core.structure import Structure, Molecule, StructureError
 from pymatgen.core.lattice import Lattice
 import numpy as np
 import random
+import itertools
 
 
 class StructureTest(unittest.TestCase):
@@ -182,6 +183,28 @@ class StructureTest(unittest.TestCase):
                             coords2)
         self.assertRaises(ValueError, struct.interpolate, struct2)
 
+    def test_lazy_sites(self):
+        coords = [[0, 0, 0], [0.75, 0.5, 0.75], [1.25, 0.5, -0.25]]
+        s = Structure(self.lattice, ["Si", Specie("Fe", 2, {"spin": 5}),
+                                     Specie("Fe", 2, {"spin": -5})], coords,
+                      site_properties={"magmom": [0, 5, -5]})
+        self.assertIsNone(s._sites)
+        self.assertEqual(s[-1].specie.spin, -5)
+        self.assertEqual(s[1].specie.spin, 5)
+        self.assertIs(s[1], s[1])
+        self.assertEqual(s[2].magmom, -5)
+        self.assertRaises(IndexError, s.__getitem__, 3)
+        self.assertIsNone(s._sites)
+        self.assertEqual(len(s._unique_species), 3)
+        self.assertIs(s.sites[1], s[1])
+        self.assertEqual(s.composition, Composition({"Si": 1, "Fe2+": 2}))
+        self.assertTrue(np.allclose(s[2].frac_coords, coords[2]))
+        self.assertTrue(np.allclose(s[2].coords, s.cart_coords[2]))
+        s = Structure(self.lattice, ["Si"] * 4, [[0, 0, 0]] * 4)
+        self.assertEqual(len(s._unique_species), 1)
+        self.assertRaises(ValueError, Structure, self.lattice,
+                          [{"Fe": 0.6, "Mn": 0.6}], [[0, 0, 0]])
+
     def test_get_primitive_structure(self):
         coords = [[0,0,0], [0.5,0.5,0], [0,0.5,0.5], [0.5,0,0.5]]
         fcc_ag = Structure(Lattice.cubic(4.09), ["Ag"] * 4, coords)
@@ -190,6 +213,26 @@ class StructureTest(unittest.TestCase):
         bcc_li = Structure(Lattice.cubic(4.09), ["Li"] * 2, coords)
         self.assertEqual(len(bcc_li.get_primitive_structure()), 1)
 
+        #Non-diagonal supercell of a cell with two species.
+        s = Structure(Lattice.hexagonal(3, 5), ["Li", "O"],
+                      [[0.1, 0.2, 0.3], [0.6, 0.5, 0.2]])
+        scale = [[1, 1, 0], [0, 1, 1], [2, 0, 1]]
+        fcoords = []
+        for image in itertools.product(range(-2, 3), repeat=3):
+            fcoords.extend(np.dot(s.frac_coords + image,
+                                  np.linalg.inv(scale)))
+        fcoords = np.array(fcoords)
+        inside = np.all((fcoords > -1e-8) & (fcoords < 1 - 1e-8), axis=1)
+        sc = Structure(np.dot(scale, s.lattice.matrix),
+                       ["Li", "O"] * 125, fcoords)
+        sc = Structure(sc.lattice, [sp for sp, i in zip(sc.species, inside)
+                                    if i], fcoords[inside])
+        self.assertEqual(len(sc), 6)
+        prim = sc.get_primitive_structure()
+        self.assertEqual(len(prim), 2)
+        self.assertAlmostEqual(prim.volume, s.volume)
+        self.assertEqual(prim.composition, s.composition)
+
     def test_primitive_structure_volume_check(self):
         l = Lattice.tetragonal(10, 30)
         coords = [[0.5,0.8,0],[0.5,0.2,0],
@@ -206,10 +249,54 @@ class StructureTest(unittest.TestCase):
         for i in range(len(s)):
             self.assertEqual(len(all_nn[i]), len(s.get_neighbors(s[i], r)))
 
+    def test_get_neighbor_list(self):
+        s = self.struct
+        r = random.uniform(3, 6)
+        (centers, indices, images, dists) = s.get_neighbor_list(r)
+        #compare against a brute force loop over images
+        for i in range(len(s)):
+            expected = []
+            for j in range(len(s)):
+                for image in itertools.product(xrange(-5, 6), repeat=3):
+                    d = np.linalg.norm(s.lattice.get_cartesian_coords(
+                        s[j].frac_coords + image) - s[i].coords)
+                    if 1e-8 < d <= r:
+                        expected.append((j, image, d))
+            expected.sort()
+            found = sorted([(indices[k], tuple(images[k]), dists[k])
+                            for k in np.where(centers == i)[0]])
+            self.assertEqual(len(found), len(expected))
+            for (j1, im1, d1), (j2, im2, d2) in zip(found, expected):
+                self.assertEqual(j1, j2)
+                self.assertEqual(im1, im2)
+                self.assertAlmostEqual(d1, d2)
+        fcoords = np.array(s.frac_coords)[indices] + images
+        vecs = s.lattice.get_cartesian_coords(fcoords) - \
+            np.array(s.cart_coords)[centers]
+        self.assertTrue(np.allclose(np.sum(vecs ** 2, axis=1) ** 0.5, dists))
+        #Si has 4 nearest neighbors at 2.35 A
+        (centers, indices, images, dists) = s.get_neighbor_list(2.5)
+        self.assertEqual(list(np.bincount(centers)), [4, 4])
+        self.assertTrue(np.allclose(dists, 2.3516318))
+        self.assertTrue(np.all(indices != centers))
+
     def test_get_dist_matrix(self):
         ans = [[0., 2.3516318],
                [2.3516318, 0.]]
         self.assertTrue(np.allclose(self.struct.distance_matrix, ans))
+        #the cached distance matrix is read-only, and modifying the returned
+        #coordinate arrays must not affect the cached values
+        self.assertIs(self.struct.distance_matrix,
+                      self.struct.distance_matrix)
+        self.assertRaises(ValueError, self.struct.distance_matrix.__setitem__,
+                          (0, 1), 10)
+        self.assertTrue(np.allclose(self.struct.distance_matrix, ans))
+        fcoords = self.struct.frac_coords
+        fcoords[1] = [0.5, 0.5, 0.5]
+        self.assertTrue(np.allclose(self.struct.frac_coords,
+                                    [[0, 0, 0], [0.75, 0.5, 0.75]]))
+        self.assertTrue(np.allclose(self.struct.cart_coords,
+                                    [site.coords for site in self.struct]))
 
 
 class MoleculeTest(unittest.TestCase):
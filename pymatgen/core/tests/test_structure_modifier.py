@@ -103,6 +103,42 @@ class StructureEditorTest(unittest.TestCase):
         self.assertEqual(s[0].charge, 4.1)
         self.assertEqual(s[0].magmom, 3)
 
+    def test_in_place_edits(self):
+        self.modifier.add_site_property("magmom", [[0, 0, 1], [0, 0, -1]])
+        self.modifier.insert_site(1, self.ge, [0.5, 0.5, 0.5],
+                                  properties={"charge": 2})
+        self.modifier.append_site(self.fe, [1.75, 0.5, 0.75],
+                                  validate_proximity=False)
+        self.modifier.to_unit_cell()
+        self.modifier.replace_species({self.si: self.ge})
+        s = self.modifier.modified_structure
+        self.assertEqual(s.formula, "Fe1 Ge2")
+        self.assertEqual(s.site_properties["magmom"],
+                         [[0, 0, 1], None, [0, 0, -1]])
+        self.assertEqual(s.site_properties["charge"], [None, 2, None])
+        #Ordered sites of the same species share their species.
+        self.assertIs(s[0].species_and_occu, s[1].species_and_occu)
+
+        self.modifier.delete_sites([0, 2])
+        self.modifier.remove_species([self.ge])
+        self.assertEqual(len(self.modifier.modified_structure), 0)
+        self.assertEqual(self.modifier.original_structure.formula,
+                         "Fe1 Si1")
+
+    def test_delete_negative_index(self):
+        s = Structure(Lattice.cubic(10), ["Li", "O", "Na"],
+                      [[0, 0, 0], [0.5, 0.5, 0.5], [0.25, 0.25, 0.25]],
+                      site_properties={"magmom": [1, 2, 3]})
+        editor = StructureEditor(s)
+        editor.delete_site(-3)
+        s = editor.modified_structure
+        self.assertEqual(s.formula, "Na1 O1")
+        self.assertEqual(s.site_properties["magmom"], [2, 3])
+        self.assertEqual(s[1].specie.symbol, "Na")
+        editor.delete_sites([-1])
+        self.assertEqual(editor.modified_structure.site_properties["magmom"],
+                         [2])
+
     def test_add_oxidation_states(self):
         si = Element("Si")
         fe = Element("Fe")
@@ -161,6 +197,21 @@ class SupercellMakerTest(unittest.TestCase):
         self.assertEquals(self.mod.modified_structure.formula, "Fe4 Si4",
                           "Wrong formula!")
 
+    def test_non_diagonal(self):
+        s = self.mod.original_structure.copy(
+            site_properties={"magmom": [1, -1]})
+        for m in ([[0, 1, 0], [1, 0, 0], [0, 0, -2]],
+                  [[2, -1, 0], [1, 1, 3], [0, 2, -1]]):
+            sc = SupercellMaker(s, m).modified_structure
+            det = abs(int(round(np.linalg.det(m))))
+            self.assertEqual(len(sc), 2 * det)
+            self.assertEqual(sc.site_properties["magmom"],
+                             [1] * det + [-1] * det)
+            #All images of a site are distinct in the supercell.
+            for i in xrange(len(sc)):
+                for j in xrange(i):
+                    self.assertFalse(sc[i].is_periodic_image(sc[j]))
+
 
 class MoleculeEditorTest(unittest.TestCase):
 
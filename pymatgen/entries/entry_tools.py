@@ -43,6 +43,9 @@ def _perform_grouping(args):
     entries = json.loads(entries_json, cls=PMGJSONDecoder)
     hosts = json.loads(hosts_json, cls=PMGJSONDecoder)
     unmatched = zip(entries, hosts)
+    matcher = StructureMatcher(ltol=ltol, stol=stol, angle_tol=angle_tol,
+                               primitive_cell=primitive_cell, scale=scale,
+                               comparator=comparator)
     while len(unmatched) > 0:
         ref_host = unmatched[0][1]
         logger.info(
@@ -58,10 +61,7 @@ def _perform_grouping(args):
                         .format(unmatched[i][0].entry_id, test_host.formula))
             test_formula = test_host.composition.reduced_formula
             logger.info("Test host = {}".format(test_formula))
-            m = StructureMatcher(ltol=ltol, stol=stol, angle_tol=angle_tol,
-                                 primitive_cell=primitive_cell, scale=scale,
-                                 comparator=comparator)
-            if m.fit(ref_host, test_host):
+            if matcher.fit(ref_host, test_host):
                 logger.info("Fit found")
                 matches.append(unmatched[i])
         groups.append(json.dumps([m[0] for m in matches], cls=PMGJSONEncoder))
@@ -1678,20 +1678,22 @@ class VolumetricData(object):
             coords = []
             for (x, y, z) in itertools.product(*[xrange(i) for i in a]):
                 coords.append([x / a[0], y / a[1], z / a[2]])
-            sites_dist = get_points_in_sphere_pbc(struct.lattice, coords,
-                                                  struct[ind].coords,
-                                                  radius)
+            (dists, pt_inds) = get_points_in_sphere_pbc(
+                struct.lattice, coords, struct[ind].coords, radius,
+                return_fcoords=False)
             self._distance_matrix[ind] = {"max_radius": radius,
-                                          "data": np.array(sites_dist)}
+                                          "dists": dists,
+                                          "indices": pt_inds}
 
-        data = self._distance_matrix[ind]["data"]
+        data = self._distance_matrix[ind]
 
         #Use boolean indexing to find all charges within the desired distance.
-        inds = data[:, 1] <= radius
-        dists = data[inds, 1]
-        data_inds = np.rint(np.mod(list(data[inds, 0]), 1) *
-                            np.tile(a, (len(dists), 1)))
-        vals = [self.data["diff"][x, y, z] for x, y, z in data_inds]
+        inds = data["dists"] <= radius
+        dists = data["dists"][inds]
+        #Grid points were generated in C order, so the grid indices follow
+        #directly from the point indices.
+        data_inds = np.unravel_index(data["indices"][inds], a)
+        vals = self.data["diff"][data_inds]
 
         hist, edges = np.histogram(dists, bins=nbins,
                                    range=[0, radius],
@@ -22,10 +22,20 @@ class LinearAssignment(object):
     It finds a minimum cost matching between two sets, given a cost
     matrix.
 
-    This class is an implementation of the LAPJV algorithm described in:
+    This class is an implementation of the shortest augmenting path
+    algorithm of Jonker and Volgenant, with a column reduction to find an
+    initial partial matching and Dijkstra searches on the reduced costs to
+    complete it, as described in:
     R. Jonker, A. Volgenant. A Shortest Augmenting Path Algorithm for
     Dense and Sparse Linear Assignment Problems. Computing 38, 325-340
     (1987)
+    D. F. Crouse. On implementing 2D rectangular assignment algorithms.
+    IEEE Transactions on Aerospace and Electronic Systems 52, 1679-1696
+    (2016)
+
+    Each step of the searches is vectorized over the columns. Many
+    problems of the same size can be solved together with
+    batch_linear_assignment.
 
     .. attribute: min_cost:
 
@@ -48,25 +58,12 @@ class LinearAssignment(object):
         """
         self.c = np.array(costs)
         self.n = len(costs)
-        
+
         #check that cost matrix is square
         if self.c.shape != (self.n, self.n):
             raise ValueError("cost matrix is not square")
-        
-        #initialize solution vectors
-        self._x = np.zeros(self.n, dtype=np.int) - 1
-        self._y = np.zeros(self.n, dtype=np.int) - 1
-
-        #if column reduction doesn't find a solution, augment with shortest
-        #paths until one is found
-        if self._column_reduction():
-            self._augmenting_row_reduction()
-            #initialize the reduced costs
-            self._update_cred()
-            while np.min(self._x) < 0:
-                self._augment()
-
-        self.solution = self._x
+
+        self.solution = _solve(self.c.astype(np.float))
         self._min_cost = None
 
     @property
@@ -74,152 +71,170 @@ class LinearAssignment(object):
         """
         Returns the cost of the best assignment
         """
-        if self._min_cost:
-            return self._min_cost
-
-        self._min_cost = np.sum(self.c[np.arange(len(self.c)), self.solution])
+        if self._min_cost is None:
+            self._min_cost = np.sum(self.c[np.arange(self.n), self.solution])
         return self._min_cost
 
-    def _column_reduction(self):
-        """
-        Column reduction and reduction transfer steps from LAPJV algorithm
-        """
-        #assign each column to its lowest cost row, ensuring that only row
-        #or column is assigned once
-        i1, j = np.unique(np.argmin(self.c, axis=0), return_index=True)
-        self._x[i1] = j
-
-        #if problem is solved, return
-        if len(i1) == self.n:
-            return False
-
-        self._y[j] = i1
-
-        #reduction_transfer
-        #tempc is array with previously assigned matchings masked
-        self._v = np.min(self.c, axis=0)
-        tempc = self.c.copy()
-        tempc[i1, j] = np.max(tempc.flatten()) * 10
-        mu = np.min(tempc[i1, :] - self._v[None, :], axis=1)
-        self._v[j] -= mu
-        return True
-
-    def _augmenting_row_reduction(self):
-        """
-        Augmenting row reduction step from LAPJV algorithm
-        """
-        unassigned = np.where(self._x == -1)[0]
-        for i in unassigned:
-            while True:
-                #find smallest 2 values and indices
-                temp = self.c[i] - self._v
-                j1 = np.argmin(temp)
-                u1 = temp[j1]
-                temp[j1] = np.max(temp) + 1
-                j2 = np.argmin(temp)
-                u2 = temp[j2]
-
-                if u1 < u2:
-                    self._v[j1] -= u2 - u1
-                elif self._y[j1] != -1:
-                    j1 = j2
-                k = self._y[j1]
-                if k != -1:
-                    self._x[k] = -1
-                    self._x[i] = j1
-                    self._y[j1] = i
-                    i = k
-                if np.allclose(u1, u2) or k == -1:
-                    break
-
-    def _update_cred(self):
-        """
-        Updates the reduced costs with the values from the
-        dual solution
-        """
-        ui = np.diag(self.c[:, self._x]) - self._v[self._x]
-        self.cred = self.c - ui[:, None] - self._v[None, :]
 
-    def _augment(self):
-        """
-        Finds a minimum cost path and adds it to the matching
-        """
-        #build a minimum cost tree
-        self._build_tree()
+def batch_linear_assignment(costs):
+    """
+    Solves many Linear Assignment Problems of the same size at once. This is
+    much faster than using LinearAssignment for each problem when there are
+    many small problems, since the steps of the algorithm are vectorized
+    over the problems.
+
+    Args:
+        costs:
+            (k, n, n) array of the cost matrices of k problems.
+
+    Returns:
+        (solutions, min_costs), where solutions is a (k, n) array of the
+        matchings of the rows to columns of each problem, as in
+        LinearAssignment.solution, and min_costs are the k minimum costs.
+    """
+    costs = np.array(costs)
+    if costs.ndim != 3 or costs.shape[1] != costs.shape[2]:
+        raise ValueError("costs must be a stack of square matrices")
+    solutions = _solve_batch(costs.astype(np.float))
+    k, n = solutions.shape
+    min_costs = np.sum(costs[np.arange(k)[:, None], np.arange(n)[None, :],
+                             solutions], axis=1)
+    return solutions, min_costs
 
-        #update prices
-        delta = self._d[self._ready] - self._mu
-        self._v[self._ready] += delta
 
-        #augment the solution with the minimum cost path from the
-        #tree. Follows an alternating path along matched, unmatched
-        #edges from X to Y
+def _solve(c):
+    """
+    Solves a square assignment problem. Returns the array of the columns
+    assigned to each row.
+    """
+    n = len(c)
+    #Column reduction: each column is assigned to its lowest cost row,
+    #unless that row has already been taken by a previous column. The duals
+    #are then feasible and the assigned entries have zero reduced cost.
+    u = np.zeros(n)
+    v = np.min(c, axis=0) if n else np.zeros(0)
+    col4row = np.zeros(n, dtype=np.int) - 1
+    row4col = np.zeros(n, dtype=np.int) - 1
+    for j, i in enumerate(np.argmin(c, axis=0) if n else []):
+        if col4row[i] == -1:
+            col4row[i] = j
+            row4col[j] = i
+
+    #Each remaining free row is assigned with a shortest augmenting path in
+    #the reduced costs, found with Dijkstra's algorithm.
+    for cur_row in np.where(col4row == -1)[0]:
+        shortest = np.zeros(n) + np.inf
+        path = np.zeros(n, dtype=np.int) - 1
+        unscanned = np.ones(n, dtype=np.bool)
+        scanned_rows = []
+        min_val = 0
+        i = cur_row
+        while True:
+            r = min_val + c[i] - u[i] - v
+            shorter = unscanned & (r < shortest)
+            path[shorter] = i
+            shortest[shorter] = r[shorter]
+            dists = np.where(unscanned, shortest, np.inf)
+            j = np.argmin(dists)
+            min_val = dists[j]
+            if row4col[j] == -1:
+                break
+            unscanned[j] = False
+            i = row4col[j]
+            scanned_rows.append(i)
+
+        #Update the duals.
+        u[cur_row] += min_val
+        scanned_rows = np.array(scanned_rows, dtype=np.int)
+        u[scanned_rows] += min_val - shortest[col4row[scanned_rows]]
+        scanned = np.logical_not(unscanned)
+        v[scanned] -= min_val - shortest[scanned]
+
+        #Augment the matching along the path to the sink.
         while True:
-            self._i = self._pred[self._j]
-            self._y[self._j] = self._i
-            k = self._j
-            self._j = self._x[self._i]
-            self._x[self._i] = k
-            if self._i == self._istar:
+            i = path[j]
+            row4col[j] = i
+            j, col4row[i] = col4row[i], j
+            if i == cur_row:
                 break
-        self._update_cred()
+    return col4row
 
-    def _build_tree(self):
-        """
-        Builds the tree finding an augmenting path. Alternates along
-        matched and unmatched edges between X and Y. The paths are
-        stored in self._pred (new predecessor of nodes in Y), and
-        self._x and self._y
-        """
-        #find unassigned i*
-        self._istar = np.argmin(self._x)
-
-        #compute distances
-        self._d = self.c[self._istar] - self._v
-        self._pred = np.zeros(self.n, dtype=np.int) + self._istar
-
-        #initialize sets
-        #READY: set of nodes visited and in the path (whose price gets
-        #updated in augment)
-        #SCAN: set of nodes at the bottom of the tree, which we need to
-        #look at
-        #T0DO: unvisited nodes
-        self._ready = np.zeros(self.n, dtype=np.bool)
-        self._scan = np.zeros(self.n, dtype=np.bool)
-        self._todo = np.zeros(self.n, dtype=np.bool) + True
 
-        while True:
-            #populate scan with minimum reduced distances
-            if np.max(self._scan) == 0:
-                self._mu = np.min(self._d[self._todo])
-                self._scan[np.where(self._d == self._mu)] = 1
-                self._todo[self._scan] = 0
-                if np.min(self._y * self._scan) < 0:
-                    self._j = np.argmin(self._y * self._scan)
-                    return
-
-            #pick jstar from scan (scan always has at least 1)
-            self._jstar = np.argmax(self._scan)
-
-            #pick i associated with jstar
-            self._i = self._y[self._jstar]
-
-            self._scan[self._jstar] = 0
-            self._ready[self._jstar] = 1
-
-            #find shorter distances
-            newdists = self._mu + self.cred[self._i, :]
-            shorter = (newdists < self._d) * self._todo
-
-            #update distances
-            self._d[shorter] = newdists[shorter]
-
-            #update predecessors
-            self._pred[shorter] = self._i
-
-            for self._j in np.argwhere((self._d == self._mu)
-                                       * self._todo).flatten():
-                if self._y[self._j] == -1:
-                    return
-                self._scan[self._j] = 1
-                self._todo[self._j] = 0
+def _solve_batch(c):
+    """
+    Solves a stack of square assignment problems with the same algorithm as
+    _solve, with each step vectorized over the problems. Returns the (k, n)
+    array of the columns assigned to the rows of each problem.
+    """
+    k, n = c.shape[:2]
+    if k == 0 or n == 0:
+        return np.zeros((k, n), dtype=np.int)
+    probs = np.arange(k)
+
+    u = np.zeros((k, n))
+    v = np.min(c, axis=1)
+    col4row = np.zeros((k, n), dtype=np.int) - 1
+    row4col = np.zeros((k, n), dtype=np.int) - 1
+    best = np.argmin(c, axis=1)
+    for j in xrange(n):
+        free = col4row[probs, best[:, j]] == -1
+        col4row[probs[free], best[free, j]] = j
+        row4col[probs[free], j] = best[free, j]
+
+    #The t-th free row of all problems is processed together.
+    free_rows = [np.where(col4row[p] == -1)[0] for p in probs]
+    for t in xrange(max([len(r) for r in free_rows])):
+        p = np.array([q for q in probs if len(free_rows[q]) > t],
+                     dtype=np.int)
+        cur_row = np.array([free_rows[q][t] for q in p], dtype=np.int)
+        m = len(p)
+        rows = np.arange(m)
+        shortest = np.zeros((m, n)) + np.inf
+        path = np.zeros((m, n), dtype=np.int) - 1
+        scanned_cols = np.zeros((m, n), dtype=np.bool)
+        scanned_rows = np.zeros((m, n), dtype=np.bool)
+        sink = np.zeros(m, dtype=np.int) - 1
+        min_val = np.zeros(m)
+        i = cur_row.copy()
+        active = rows
+
+        while len(active):
+            ia = i[active]
+            pa = p[active]
+            scanned_rows[active, ia] = True
+            r = min_val[active, None] + c[pa, ia] - u[pa, ia][:, None] - \
+                v[pa]
+            shorter = np.logical_not(scanned_cols[active]) & \
+                (r < shortest[active])
+            path[active] = np.where(shorter, ia[:, None], path[active])
+            shortest[active] = np.where(shorter, r, shortest[active])
+            dists = np.where(scanned_cols[active], np.inf, shortest[active])
+            j = np.argmin(dists, axis=1)
+            min_val[active] = dists[np.arange(len(active)), j]
+            found = row4col[pa, j] == -1
+            sink[active[found]] = j[found]
+            nf = np.logical_not(found)
+            scanned_cols[active[nf], j[nf]] = True
+            i[active[nf]] = row4col[pa[nf], j[nf]]
+            active = active[nf]
+
+        #Update the duals.
+        u[p, cur_row] += min_val
+        scanned_rows[rows, cur_row] = False
+        sr, si = np.where(scanned_rows)
+        u[p[sr], si] += min_val[sr] - shortest[sr, col4row[p[sr], si]]
+        sc, sj = np.where(scanned_cols)
+        v[p[sc], sj] -= min_val[sc] - shortest[sc, sj]
+
+        #Augment the matching along the path to the sink.
+        j = sink
+        active = rows
+        while len(active):
+            pa = p[active]
+            ja = j[active]
+            ia = path[active, ja]
+            row4col[pa, ja] = ia
+            j[active] = col4row[pa, ia]
+            col4row[pa, ia] = ja
+            active = active[ia != cur_row[active]]
+    return col4row
@@ -2,7 +2,8 @@
 
 import unittest
 
-from pymatgen.optimization.linear_assignment import LinearAssignment
+from pymatgen.optimization.linear_assignment import LinearAssignment, \
+    batch_linear_assignment
 import numpy as np
 
 class LinearAssignmentTest(unittest.TestCase):
@@ -50,6 +51,15 @@ class LinearAssignmentTest(unittest.TestCase):
         la2 = LinearAssignment(w2)
         self.assertEqual(la2.min_cost, 110, 'Incorrect cost')
 
+        solutions, min_costs = batch_linear_assignment([w0, w1, w2])
+        self.assertEqual(list(min_costs), [194, 125, 110])
+        for sol, w, cost in zip(solutions, [w0, w1, w2], [194, 125, 110]):
+            self.assertEqual(sorted(sol), list(range(10)))
+            self.assertEqual(np.sum(w[np.arange(10), sol]), cost)
+        self.assertEqual(batch_linear_assignment(np.zeros((0, 3, 3)))[0].shape,
+                         (0, 3))
+        self.assertRaises(ValueError, batch_linear_assignment, w0)
+
         
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
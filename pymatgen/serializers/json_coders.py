@@ -53,6 +53,9 @@ class MSONable(object):
     """
     __metaclass__ = abc.ABCMeta
 
+    #Allows subclasses to make use of __slots__.
+    __slots__ = ()
+
     @abc.abstractproperty
     def to_dict(self):
         """
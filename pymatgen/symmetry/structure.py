@@ -31,7 +31,7 @@ class SymmetrizedStructure(Structure):
                            refined_structure.frac_coords)
 
         self._spacegroup = spacegroup
-        site_map = zip(self._sites, equivalent_positions)
+        site_map = zip(self.sites, equivalent_positions)
         site_map = sorted(site_map, key=lambda x: x[1])
         self._equivalent_sites = [[x[0] for x in g]
                                   for k, g
@@ -18,6 +18,10 @@ __date__ = "Nov 27, 2011"
 import numpy as np
 import math
 
+#Default cap in bytes on the temporary arrays used in periodic neighbor
+#searches.
+MAX_MEMORY = 64 * 1024 ** 2
+
 
 def find_in_coord_list(coord_list, coord, atol=1e-8):
     """
@@ -260,7 +264,163 @@ def in_coord_list_pbc(fcoord_list, fcoord, atol=1e-8):
     return len(find_in_coord_list_pbc(fcoord_list, fcoord, atol=atol)) > 0
 
 
-def get_points_in_sphere_pbc(lattice, frac_points, center, r):
+def get_neighbor_list_pbc(lattice, frac_points, center_coords, r,
+                          max_memory=MAX_MEMORY):
+    """
+    Find all pairs of (center, periodic image of a point) that are within a
+    distance r of each other, taking into account periodic boundary
+    conditions. This is the engine behind the sphere and neighbor queries
+    on Structure.
+
+    Algorithm (linked-cell binning):
+
+    1. Determine the range of periodic images that can possibly contain
+       points within r of any center (see get_points_in_sphere_pbc), and
+       keep only the image points that fall in the bounding box of the
+       centers expanded by r. The images are streamed in blocks so that
+       the full image grid is never materialized.
+    2. Bin the image points into cubic cells of edge length >= r.
+    3. For each center, only the points in the 27 cells surrounding the
+       center need to be tested. Centers are also processed in blocks.
+
+    For a fixed cutoff, the cost scales linearly with the number of points
+    and centers, instead of as the product of the two.
+
+    Args:
+        lattice:
+            The lattice/basis for the periodic boundary conditions.
+        frac_points:
+            All points in the lattice in fractional coordinates.
+        center_coords:
+            Cartesian coordinates of the centers, e.g., [[0, 0, 0]] for a
+            single sphere centered at the origin.
+        r:
+            Cutoff radius.
+        max_memory:
+            Approximate upper bound in bytes on the size of the temporary
+            arrays created in each block. Note that the returned arrays
+            are not counted. Defaults to MAX_MEMORY (64 MB).
+
+    Returns:
+        (center_indices, point_indices, images, distances) as numpy arrays.
+        The periodic image of point_indices[k] within r of center
+        center_indices[k] has fractional coordinates
+        frac_points[point_indices[k]] + images[k] and lies at a distance
+        distances[k] from the center. Pairs are sorted by center index,
+        then point index.
+    """
+    fcoords = np.array(frac_points, dtype=np.float64).reshape((-1, 3))
+    centers = np.array(center_coords, dtype=np.float64).reshape((-1, 3))
+    n = len(fcoords)
+    if n == 0 or len(centers) == 0 or r < 0:
+        return (np.zeros(0, dtype=np.int), np.zeros(0, dtype=np.int),
+                np.zeros((0, 3), dtype=np.int), np.zeros(0))
+
+    #Bring all points into the unit cell and keep track of the offsets so
+    #that images can be reported relative to the original coordinates.
+    offsets = np.floor(fcoords)
+    cart = lattice.get_cartesian_coords(fcoords - offsets)
+
+    #Same supercell construction as get_points_in_sphere_pbc, spanning all
+    #centers at once.
+    recp_len = np.array(lattice.reciprocal_lattice.abc)
+    nmax = (r + 0.15) * recp_len / (2 * math.pi)
+    pcoords = lattice.get_fractional_coords(centers)
+    nmin = np.floor(np.min(pcoords, axis=0) - nmax).astype(np.int)
+    nmax = np.floor(np.max(pcoords, axis=0) + nmax).astype(np.int)
+    grid_shape = tuple(nmax - nmin + 1)
+    nimages = int(np.prod(grid_shape))
+
+    #Keep image points inside the bounding box of the centers + r. About
+    #four temporary float arrays of shape (block, n, 3) are used per block.
+    lower = np.min(centers, axis=0) - r
+    upper = np.max(centers, axis=0) + r
+    block = max(1, int(max_memory // (4 * 24 * n)))
+    all_images = []
+    all_pt_inds = []
+    all_pts = []
+    for first in xrange(0, nimages, block):
+        images = np.array(np.unravel_index(
+            np.arange(first, min(first + block, nimages)), grid_shape)).T
+        images += nmin
+        img_cart = cart[None, :, :] + \
+            lattice.get_cartesian_coords(images)[:, None, :]
+        in_box = np.all((img_cart >= lower) & (img_cart <= upper), axis=2)
+        img_inds, pt_inds = np.where(in_box)
+        all_images.append(images[img_inds])
+        all_pt_inds.append(pt_inds)
+        all_pts.append(img_cart[img_inds, pt_inds])
+    images = np.concatenate(all_images)
+    pt_inds = np.concatenate(all_pt_inds)
+    pts = np.concatenate(all_pts)
+
+    #Bin the image points. The bin size must be at least r so that only
+    #the 27 bins around a center need to be searched. A lower bound keeps
+    #the number of bins sane for tiny radii.
+    bin_size = max(r, 0.1)
+    nbins = np.floor((upper - lower) / bin_size).astype(np.int64) + 1
+
+    def get_keys(bins):
+        return (bins[..., 0] * nbins[1] + bins[..., 1]) * nbins[2] + \
+            bins[..., 2]
+
+    pt_bins = np.floor((pts - lower) / bin_size).astype(np.int64)
+    pt_bins = np.minimum(np.maximum(pt_bins, 0), nbins - 1)
+    pt_keys = get_keys(pt_bins)
+    order = np.argsort(pt_keys, kind="mergesort")
+    sorted_keys = pt_keys[order]
+
+    #Bins surrounding each center.
+    center_bins = np.floor((centers - lower) / bin_size).astype(np.int64)
+    center_bins = np.minimum(np.maximum(center_bins, 0), nbins - 1)
+    shifts = np.mgrid[-1:2, -1:2, -1:2].reshape((3, -1)).T
+    nn_bins = center_bins[:, None, :] + shifts[None, :, :]
+    valid = np.all((nn_bins >= 0) & (nn_bins < nbins), axis=2)
+    nn_keys = get_keys(nn_bins)
+    starts = np.searchsorted(sorted_keys, nn_keys, side="left")
+    counts = (np.searchsorted(sorted_keys, nn_keys, side="right") - starts) \
+        * valid
+
+    #Expand the (center, bin) ranges into flat candidate pairs, in blocks
+    #of centers such that each block has a bounded number of candidates.
+    #About ten 8-byte values are stored per candidate pair.
+    max_cand = max(1, int(max_memory // 80))
+    cum_counts = np.cumsum(np.sum(counts, axis=1))
+    results = []
+    first = 0
+    while first < len(centers):
+        last = np.searchsorted(cum_counts, cum_counts[first] -
+                               np.sum(counts[first]) + max_cand, side="right")
+        last = max(last, first + 1)
+        c_counts = counts[first:last].ravel()
+        c_starts = starts[first:last].ravel()
+        offsets_in_block = np.cumsum(c_counts) - c_counts
+        cand_centers = np.repeat(np.repeat(np.arange(first, last),
+                                           len(shifts)), c_counts)
+        pos = np.arange(np.sum(c_counts)) - \
+            np.repeat(offsets_in_block - c_starts, c_counts)
+        cand = order[pos]
+        dists = np.sqrt(np.sum((pts[cand] - centers[cand_centers]) ** 2,
+                               axis=1))
+        within_r = dists <= r
+        results.append((cand_centers[within_r], cand[within_r],
+                        dists[within_r]))
+        first = last
+
+    cand_centers = np.concatenate([res[0] for res in results])
+    cand = np.concatenate([res[1] for res in results])
+    dists = np.concatenate([res[2] for res in results])
+    pt_inds = pt_inds[cand]
+    images = images[cand] - offsets[pt_inds].astype(np.int)
+
+    sort_inds = np.lexsort((images[:, 2], images[:, 1], images[:, 0],
+                           pt_inds, cand_centers))
+    return (cand_centers[sort_inds], pt_inds[sort_inds], images[sort_inds],
+            dists[sort_inds])
+
+
+def get_points_in_sphere_pbc(lattice, frac_points, center, r,
+                             return_fcoords=True, max_memory=MAX_MEMORY):
     """
     Find all points within a sphere from the point taking into account
     periodic boundary conditions. This includes sites in other periodic images.
@@ -277,6 +437,10 @@ def get_points_in_sphere_pbc(lattice, frac_points, center, r):
 
     2. keep points falling within r.
 
+    The periodic images are generated and screened in blocks (see
+    get_neighbor_list_pbc), so the peak memory is bounded by max_memory
+    plus the size of the result, even for large radii or skewed cells.
+
     Args:
         lattice:
             The lattice/basis for the periodic boundary conditions.
@@ -286,45 +450,33 @@ def get_points_in_sphere_pbc(lattice, frac_points, center, r):
             cartesian coordinates of center of sphere.
         r:
             radius of sphere.
+        return_fcoords:
+            If False, only the distances and indices are returned as two
+            numpy arrays. This avoids building the object array of
+            fractional coordinates, which is the expensive part for large
+            numbers of points. Defaults to True.
+        max_memory:
+            Approximate upper bound in bytes on the temporary arrays used.
+            Defaults to MAX_MEMORY (64 MB).
 
     Returns:
-        [(fcoord, dist) ...] since most of the time, subsequent processing
-        requires the distance.
+        [(fcoord, dist, index) ...] since most of the time, subsequent
+        processing requires the distance. If return_fcoords is False,
+        (distances, indices) as numpy arrays.
     """
-    recp_len = np.array(lattice.reciprocal_lattice.abc)
-    sr = r + 0.15
-    nmax = sr * recp_len / (2 * math.pi)
-    pcoords = lattice.get_fractional_coords(center)
-    floor = math.floor
-
-    n = len(frac_points)
-    fcoords = np.array(frac_points)
-    frac_2_cart = lattice.get_cartesian_coords
-    pts = np.tile(center, (n, 1))
-    indices = np.array(range(n))
-
-    arange = np.arange(start=int(floor(pcoords[0] - nmax[0])),
-                       stop=int(floor(pcoords[0] + nmax[0])) + 1)
-    brange = np.arange(start=int(floor(pcoords[1] - nmax[1])),
-                       stop=int(floor(pcoords[1] + nmax[1])) + 1)
-    crange = np.arange(start=int(floor(pcoords[2] - nmax[2])),
-                       stop=int(floor(pcoords[2] + nmax[2])) + 1)
-
-    arange = arange[:, None] * np.array([1, 0, 0])[None, :]
-    brange = brange[:, None] * np.array([0, 1, 0])[None, :]
-    crange = crange[:, None] * np.array([0, 0, 1])[None, :]
-
-    images = arange[:, None, None] + brange[None, :, None] +\
-        crange[None, None, :]
-
-    shifted_coords = fcoords[:, None, None, None, :] + images[None, :, :, :, :]
-    coords = frac_2_cart(shifted_coords)
-    dists = np.sqrt(np.sum((coords - pts[:, None, None, None, :]) ** 2, axis=4))
-    within_r = np.where(dists <= r)
-
-    d = [shifted_coords[within_r], dists[within_r], indices[within_r[0]]]
-
-    return np.transpose(d)
+    fcoords = np.array(frac_points, dtype=np.float64).reshape((-1, 3))
+    (centers, indices, images, dists) = get_neighbor_list_pbc(
+        lattice, fcoords, [center], r, max_memory=max_memory)
+    if not return_fcoords:
+        return dists, indices
+
+    shifted_coords = fcoords[indices] + images
+    d = np.empty((len(indices), 3), dtype=object)
+    for i, fcoord in enumerate(shifted_coords):
+        d[i, 0] = fcoord
+    d[:, 1] = dists
+    d[:, 2] = indices
+    return d
 
 
 def barycentric_coords(coords, simplex):
@@ -21,7 +21,7 @@ from pymatgen.core.lattice import Lattice
 from pymatgen.util.coord_utils import get_linear_interpolated_value,\
     in_coord_list, pbc_diff, in_coord_list_pbc, get_points_in_sphere_pbc,\
     find_in_coord_list, find_in_coord_list_pbc, pbc_all_distances,\
-    barycentric_coords
+    barycentric_coords, get_neighbor_list_pbc
 
 
 class CoordUtilsTest(unittest.TestCase):
@@ -122,7 +122,44 @@ class CoordUtilsTest(unittest.TestCase):
         self.assertEqual(len(get_points_in_sphere_pbc(latt, pts,
                                                       [0.5, 0.5, 0.5],
                                                       0.5)), 515)
+        #blocked evaluation gives the same results
+        (dists, inds) = get_points_in_sphere_pbc(latt, pts, [0.5, 0.5, 0.5],
+                                                 0.5, return_fcoords=False,
+                                                 max_memory=1000)
+        self.assertEqual(len(dists), 515)
+        self.assertEqual(len(inds), 515)
+        self.assertTrue(np.all(dists <= 0.5))
         
+    def test_get_neighbor_list_pbc(self):
+        latt = Lattice.from_lengths_and_angles([3, 4, 5], [80, 95, 110])
+        fcoords = [[0.1, 0.2, 0.3], [0.5, 0.5, 0.5], [1.2, -0.3, 0.7]]
+        centers = latt.get_cartesian_coords([[0, 0, 0], [0.4, 0.6, 1.5]])
+        (c, inds, images, dists) = get_neighbor_list_pbc(latt, fcoords,
+                                                         centers, 4.5)
+        #compare against a brute force loop over images
+        for i, center in enumerate(centers):
+            expected = []
+            for j, fc in enumerate(fcoords):
+                for image in itertools.product(xrange(-6, 7), repeat=3):
+                    d = np.linalg.norm(latt.get_cartesian_coords(
+                        np.add(fc, image)) - center)
+                    if d <= 4.5:
+                        expected.append((j, tuple(image), d))
+            expected.sort()
+            found = sorted([(inds[k], tuple(images[k]), dists[k])
+                            for k in np.where(c == i)[0]])
+            self.assertEqual(len(found), len(expected))
+            for (j1, im1, d1), (j2, im2, d2) in zip(found, expected):
+                self.assertEqual(j1, j2)
+                self.assertEqual(im1, im2)
+                self.assertAlmostEqual(d1, d2)
+        #images are relative to the input coordinates
+        shifted = latt.get_cartesian_coords(np.array(fcoords)[inds] + images)
+        self.assertTrue(np.allclose(np.sum((shifted - centers[c]) ** 2,
+                                           axis=1) ** 0.5, dists))
+        self.assertEqual(len(get_neighbor_list_pbc(latt, [], centers, 4)[0]),
+                         0)
+
     def test_barycentric(self):
         #2d test
         simplex1 = np.array([[0.3,0.1], [0.2,-1.2], [1.3,2.3]])